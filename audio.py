@@ -0,0 +1,230 @@
+## Sound effects of the game. SoundBank loads each sound once and keeps
+#  a fixed pool of voices (AudioSound objects) for it, so playing a sound
+#  doesn't read the file or allocate anything. When all the voices of
+#  a sound are playing, the one with the lowest priority (the oldest one of
+#  those) is stolen, unless the new sound has an even lower priority.
+#  The sounds used by the game scripts can be found in advance with
+#  find_script_sounds and preloaded.
+#
+#  PositionalAudio plays sounds of sources in the scene (nodes or
+#  positions): the volume falls linearly with the distance from the
+#  listener, to zero at the audible radius, and the balance follows the
+#  direction. Sounds farther than the radius are not played (nor loaded) at
+#  all.
+
+import ast
+from collections import deque
+
+from panda3d.core import *
+
+from general import *
+
+SOUND_FUNCTIONS = ["script_play_sound","script_play_sound_at"]      ##< script API functions whose first argument is a sound file name
+
+## Returns the list of sound file names literally given to the sound
+#  functions of the script API in given script source.
+
+def find_script_sounds(source):
+  result = []
+
+  for node in ast.walk(ast.parse(source)):
+    if isinstance(node,ast.Call) and isinstance(node.func,ast.Attribute) and node.func.attr in SOUND_FUNCTIONS and len(node.args) > 0:
+      value = getattr(node.args[0],"s",getattr(node.args[0],"value",None))   # string node differs in Python versions
+
+      if isinstance(value,type("")) and not value in result:
+        result.append(value)
+
+  return result
+
+## One of the pooled AudioSounds of a sound.
+
+class Voice:
+  def __init__(self, sound):
+    self.sound = sound
+    self.priority = 0
+    self.play_number = 0                 ##< number of the play that started the voice, for finding the oldest one
+
+  def is_playing(self):
+    return self.sound.status() == AudioSound.PLAYING
+
+class SoundBank:
+  ## Creates the bank.
+  #
+  #  @param loader Panda3D loader
+  #  @param voices number of voices of each sound (how many times the sound
+  #         can play at once)
+
+  def __init__(self, loader, voices=4, path=RESOURCE_PATH):
+    self.loader = loader
+    self.voices = voices
+    self.path = path
+    self.pools = {}                      ##< sound file name => list of Voice
+    self.play_count = 0                  ##< number of played sounds
+    self.hits = 0                        ##< number of plays of already loaded sounds
+    self.misses = 0                      ##< number of plays that had to load the sound
+    self.steals = 0                      ##< number of plays that stopped a playing voice
+    self.rejected = 0                    ##< number of plays not played as all voices played sounds with higher priority
+
+  ## Loads given sound and makes its voices if it's not loaded yet.
+
+  def load(self, filename):
+    if not filename in self.pools:
+      self.pools[filename] = [Voice(self.loader.loadSfx(self.path + filename)) for i in range(self.voices)]
+
+    return self.pools[filename]
+
+  def preload(self, filenames):
+    for filename in filenames:
+      self.load(filename)
+
+  ## Returns the voice to play given sound with, None if there is no voice
+  #  with lower or same priority.
+
+  def get_voice(self, filename, priority):
+    if filename in self.pools:
+      self.hits += 1
+    else:
+      self.misses += 1
+
+    stolen = None
+
+    for voice in self.load(filename):
+      if not voice.is_playing():
+        return voice
+
+      if voice.priority <= priority and (stolen == None or (voice.priority,voice.play_number) < (stolen.priority,stolen.play_number)):
+        stolen = voice
+
+    if stolen == None:
+      self.rejected += 1
+    else:
+      self.steals += 1
+      stolen.sound.stop()
+
+    return stolen
+
+  ## Plays given sound, returns the playing Voice or None if no voice was
+  #  free.
+  #
+  #  @param priority sounds with lower priority are stopped for sounds with
+  #         higher or the same priority when there are no free voices
+
+  def play_voice(self, filename, volume=1.0, priority=0, balance=0.0):
+    voice = self.get_voice(filename,priority)
+
+    if voice == None:
+      return None
+
+    self.play_count += 1
+    voice.priority = priority
+    voice.play_number = self.play_count
+    voice.sound.setVolume(volume)
+    voice.sound.setBalance(balance)
+    voice.sound.play()
+    return voice
+
+  ## Same as play_voice but returns the playing AudioSound.
+
+  def play(self, filename, volume=1.0, priority=0):
+    voice = self.play_voice(filename,volume,priority)
+    return voice.sound if voice != None else None
+
+  ## Returns the number of voices currently playing.
+
+  def get_playing_count(self):
+    return sum(1 for pool in self.pools.values() for voice in pool if voice.is_playing())
+
+  ## Returns the statistics as a dict name => value.
+
+  def get_statistics(self):
+    return {"sounds": len(self.pools),"voices": sum(len(pool) for pool in self.pools.values()),"playing": self.get_playing_count(),
+      "hits": self.hits,"misses": self.misses,"steals": self.steals,"rejected": self.rejected}
+
+## A playing sound of PositionalAudio.
+
+class SoundSource:
+  def __init__(self, voice, volume, source):
+    self.voice = voice
+    self.play_number = voice.play_number   ##< when the voice's play number changes, the voice was stolen for another sound
+    self.volume = volume                   ##< volume at the source
+    self.source = source                   ##< NodePath or Point3
+
+  def is_playing(self):
+    return self.voice.play_number == self.play_number and self.voice.is_playing()
+
+class PositionalAudio:
+  MIN_DISTANCE = 1.0                     ##< sounds closer than this play at full volume
+
+  ## Creates the positional audio.
+  #
+  #  @param sound_bank SoundBank to play the sounds with
+  #  @param listener node path of the listener (e.g. the camera)
+  #  @param root node path the positions are given in (e.g. render)
+  #  @param radius sounds farther than this aren't heard
+  #  @param max_updates maximum number of playing sounds updated in one
+  #         update (the others keep their volume and balance until their
+  #         turn comes)
+
+  def __init__(self, sound_bank, listener, root, radius, max_updates=8):
+    self.sound_bank = sound_bank
+    self.listener = listener
+    self.root = root
+    self.radius = radius
+    self.max_updates = max_updates
+    self.sources = deque()               ##< playing SoundSources, updated in turns
+    self.culled = 0                      ##< number of sounds not played for being too far
+
+  ## Returns the position of given source (NodePath or Point3 in the root
+  #  coordinates) relative to the listener.
+
+  def get_relative_position(self, source):
+    if isinstance(source,NodePath):
+      return source.getPos(self.listener)
+
+    return self.listener.getRelativePoint(self.root,source)
+
+  ## Returns the (volume,balance) of a sound of given volume at given
+  #  relative position.
+
+  def get_volume_and_balance(self, volume, relative_position):
+    distance = relative_position.length()
+    attenuation = min(max((self.radius - distance) / max(self.radius - PositionalAudio.MIN_DISTANCE,0.001),0.0),1.0)
+    balance = min(max(relative_position[0] / distance,-1.0),1.0) if distance > PositionalAudio.MIN_DISTANCE else 0.0
+    return (volume * attenuation,balance)
+
+  ## Plays given sound at given source (NodePath or Point3 in the root
+  #  coordinates), returns the playing AudioSound or None if the source is
+  #  too far (or no voice was free).
+
+  def play(self, filename, source, volume=1.0, priority=0):
+    relative_position = self.get_relative_position(source)
+
+    if relative_position.length() >= self.radius:
+      self.culled += 1
+      return None
+
+    voice_volume, balance = self.get_volume_and_balance(volume,relative_position)
+    voice = self.sound_bank.play_voice(filename,voice_volume,priority,balance)
+
+    if voice == None:
+      return None
+
+    self.sources.append(SoundSource(voice,volume,source))
+    return voice.sound
+
+  ## Updates the volume and balance of up to max_updates playing sounds
+  #  (going around all of them in turns), finished sounds are dropped.
+
+  def update(self):
+    updates = min(self.max_updates,len(self.sources))
+
+    for i in range(updates):
+      sound_source = self.sources.popleft()
+
+      if not sound_source.is_playing() or (isinstance(sound_source.source,NodePath) and sound_source.source.isEmpty()):
+        continue
+
+      volume, balance = self.get_volume_and_balance(sound_source.volume,self.get_relative_position(sound_source.source))
+      sound_source.voice.sound.setVolume(volume)
+      sound_source.voice.sound.setBalance(balance)
+      self.sources.append(sound_source)
@@ -0,0 +1,37 @@
+## Camera paths for repeatable flythroughs (see render_benchmark.py). A path
+#  is a list of camera poses, one per frame, each pose is a tuple (x,y,
+#  height,heading,pitch) with the position in level coordinates (tile
+#  centers at integer coordinates, as the player position) and the angles
+#  in degrees. Paths are saved as text files with one pose per line, the
+#  game can record the path the player goes (see Game.CAMERA_PATH_FILE).
+
+## Saves given list of poses into a file.
+
+def save_camera_path(filename, poses):
+  recorder = CameraPathRecorder(filename)
+
+  for pose in poses:
+    recorder.record(pose)
+
+  recorder.close()
+
+## Loads a list of poses from a file.
+
+def load_camera_path(filename):
+  input_file = open(filename,"r")
+  result = [tuple(float(value) for value in line.split()) for line in input_file if len(line.split()) == 5]
+  input_file.close()
+  return result
+
+## Writes poses into a path file one by one, as they come (each line is
+#  written right away so that the path is kept even if the game crashes).
+
+class CameraPathRecorder:
+  def __init__(self, filename):
+    self.output_file = open(filename,"w",1)      # line buffered
+
+  def record(self, pose):
+    self.output_file.write("%.4f %.4f %.4f %.3f %.3f\n" % tuple(pose))
+
+  def close(self):
+    self.output_file.close()
@@ -0,0 +1,154 @@
+## Finds the level chunk size that works best on this machine and saves it
+#  to the settings file (see game_settings). For each candidate size the
+#  level geometry is streamed around sample positions the same way as in the
+#  game (see level_streaming), measuring the chunk build times and the time
+#  of rendering frames from the positions. The chosen size is the one with
+#  the fastest frames whose slowest chunk build fits into BUILD_BUDGET (as
+#  chunks get built during the game). Usage:
+#
+#  python chunk_benchmark.py [-n] [level_file]
+#
+#  -n only prints the results, the settings file is not changed.
+
+import sys
+import time
+
+from panda3d.core import *
+from direct.showbase.ShowBase import ShowBase
+
+from chunked_level import *
+from level_streaming import *
+from scene_builder import *
+from chunk_mesher import *
+from game_settings import *
+from main import Game
+
+CANDIDATE_SIZES = [4,8,16,32]
+BUILD_BUDGET = 0.008                 ##< maximum time in seconds one chunk build may take (half of a 60 FPS frame)
+SAMPLE_GRID = 3                      ##< positions are sampled from a grid of SAMPLE_GRID x SAMPLE_GRID cells over the level
+CAMERA_HEADINGS = [0,90,180,270]
+FRAMES_PER_VIEW = 3
+
+## Returns a list of steppable (x,y) positions spread over the level.
+
+def get_sample_positions(level):
+  result = []
+
+  for cell_x in range(SAMPLE_GRID):
+    for cell_y in range(SAMPLE_GRID):
+      x = int((cell_x + 0.5) * level.get_width() / SAMPLE_GRID)
+      y = int((cell_y + 0.5) * level.get_height() / SAMPLE_GRID)
+
+      if level.get_tile(x,y).steppable:
+        result.append((x,y))
+
+  return result if len(result) > 0 else [(level.get_width() // 2,level.get_height() // 2)]
+
+## Makes a ChunkStreamer that builds the tile geometry of the level under
+#  level_node_path (with given builder) and hides chunks by stashing them,
+#  as the game does. Build times (in seconds) are appended to build_times.
+
+def make_scene_streamer(builder, level, chunk_size, radius, level_node_path, build_times):
+  def build_chunk(chunk_x, chunk_y, region):
+    start = time.time()
+    result = builder.build_tiles(level,region)
+    build_times.append(time.time() - start)
+    result.reparentTo(level_node_path)
+    return result
+
+  def destroy_chunk(chunk_x, chunk_y, node_path):
+    node_path.removeNode()
+
+  def set_chunk_visible(chunk_x, chunk_y, node_path, visible):
+    if visible:
+      node_path.unstash()
+    else:
+      node_path.stash()
+
+  return ChunkStreamer(level,chunk_size,radius,build_chunk,destroy_chunk,set_chunk_visible=set_chunk_visible)
+
+## Sets the camera lens as the game does for given level.
+
+def setup_lens(base, level):
+  base.camLens.setFov(105)
+  base.camLens.setNear(0.01)
+  base.camLens.setFar(level.get_fog_distance() + Game.FOG_RANGE + 5)
+
+## Streams the level with given chunk size around the positions, returns a
+#  tuple (build times,frame times,average number of shown chunks), times in
+#  seconds.
+
+def benchmark_chunk_size(base, builder, level, chunk_size, positions):
+  radius = level.get_fog_distance() + Game.FOG_RANGE
+  level_node_path = base.render.attachNewNode("level")
+  build_times = []
+  frame_times = []
+  shown_chunks = 0
+  streamer = make_scene_streamer(builder,level,chunk_size,radius,level_node_path,build_times)
+  setup_lens(base,level)
+
+  for position in positions:
+    streamer.update(position,True)
+    streamer.update_visibility(position,radius)
+    shown_chunks += len(streamer.get_built_chunks()) - len(streamer.get_hidden_chunks())
+
+    for heading in CAMERA_HEADINGS:
+      base.camera.setPos(position[1],position[0],Game.CAMERA_HEIGHT)
+      base.camera.setHpr(heading,0,0)
+      base.graphicsEngine.renderFrame()        # not measured, the first frame uploads the new geometry
+
+      for i in range(FRAMES_PER_VIEW):
+        start = time.time()
+        base.graphicsEngine.renderFrame()
+        frame_times.append(time.time() - start)
+
+  streamer.clear()
+  level_node_path.removeNode()
+  return (build_times,frame_times,shown_chunks / float(len(positions)))
+
+def main():
+  arguments = sys.argv[1:]
+  save = True
+
+  if len(arguments) > 0 and arguments[0] == "-n":
+    save = False
+    arguments = arguments[1:]
+
+  level = load_level(arguments[0] if len(arguments) > 0 else Game.DEFAULT_LEVEL)
+
+  if isinstance(level,ChunkedLevel):
+    print("chunked level files have a fixed chunk size, use a level in another format")
+    sys.exit(1)
+
+  base = ShowBase(windowType="offscreen")
+  scene_builder = SceneBuilder(base.loader)
+  builder = ChunkMesher(scene_builder) if Game.USE_CHUNK_MESHER else scene_builder
+  positions = get_sample_positions(level)
+
+  builder.build_tiles(level,(0,0,level.get_width(),level.get_height())).removeNode()   # load the models and textures
+
+  best_size = None
+  best_frame_time = None
+
+  print("%6s %14s %14s %14s %12s" % ("size","build avg (ms)","build max (ms)","frame avg (ms)","chunks shown"))
+
+  for chunk_size in CANDIDATE_SIZES:
+    build_times, frame_times, shown_chunks = benchmark_chunk_size(base,builder,level,chunk_size,positions)
+    frame_time = sum(frame_times) / len(frame_times)
+    print("%6d %14.2f %14.2f %14.2f %12.1f" % (chunk_size,sum(build_times) / len(build_times) * 1000,max(build_times) * 1000,frame_time * 1000,shown_chunks))
+
+    if max(build_times) <= BUILD_BUDGET and (best_size == None or frame_time < best_frame_time):
+      best_size = chunk_size
+      best_frame_time = frame_time
+
+  if best_size == None:          # no size builds fast enough, take the smallest
+    best_size = CANDIDATE_SIZES[0]
+
+  print("best chunk size: " + str(best_size))
+
+  if save:
+    save_setting(LEVEL_CHUNK_SIZE,best_size)
+    print("saved to " + SETTINGS_FILE)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,337 @@
+## Direct building of level chunk geometry. Instead of instancing a model
+#  node for every tile and wall face and flattening them (see SceneBuilder),
+#  the mesher walks the tiles of a chunk once and copies the transformed
+#  vertices of the source models straight into one GeomVertexData per
+#  render state. Runs of neighbouring wall faces whose model is flat along
+#  the run (a quad or a profile extruded over the tile, such as
+#  wall_flat.obj or wall_house.obj) are merged into one long face with
+#  repeating texture.
+#
+#  Benchmark against SceneBuilder: python mesher_benchmark.py
+
+from array import array
+
+from panda3d.core import *
+
+from scene_builder import *
+
+## Geometry of a model in one orientation: list of parts, each part being
+#  (source render state,vertices,triangle indices), a vertex is a tuple
+#  (x,y,z,nx,ny,nz,u,v).
+
+class OrientedModel:
+  def __init__(self, parts):
+    self.parts = parts
+    self.part_values = [array("f",[value for vertex in part[1] for value in vertex]) for part in parts]  ##< vertices of each part as flat arrays, see MeshBucket
+    self.part_indices = [array("I",part[2]) for part in parts]
+    self.flat_axis_minimums = {}    ##< cache of get_flat_axis_minimum results, axis => result
+
+  ## Checks if the model spans exactly one tile along given axis (0 = x,
+  #  1 = y), has all its vertices on the two edges and each triangle touches
+  #  both edges (i.e. the model is a profile extruded along the axis), so
+  #  that neighbouring copies can be merged into one. Returns the minimum
+  #  coordinate along the axis or None.
+
+  def get_flat_axis_minimum(self, axis):
+    if not axis in self.flat_axis_minimums:
+      self.flat_axis_minimums[axis] = self.compute_flat_axis_minimum(axis)
+
+    return self.flat_axis_minimums[axis]
+
+  def compute_flat_axis_minimum(self, axis):
+    if len(self.parts) != 1:
+      return None
+
+    vertices = self.parts[0][1]
+    coordinates = [vertex[axis] for vertex in vertices]
+    minimum = min(coordinates)
+    maximum = max(coordinates)
+
+    if abs(maximum - minimum - 1.0) > ChunkMesher.EPSILON:
+      return None
+
+    for vertex in vertices:
+      if abs(vertex[axis] - minimum) > ChunkMesher.EPSILON and abs(vertex[axis] - maximum) > ChunkMesher.EPSILON:
+        return None
+
+      if self.get_partner(vertex,axis,minimum) == None:
+        return None
+
+    indices = self.parts[0][2]
+
+    for i in range(0,len(indices),3):
+      on_minimum = [abs(vertices[index][axis] - minimum) <= ChunkMesher.EPSILON for index in indices[i:i + 3]]
+
+      if all(on_minimum) or not any(on_minimum):
+        return None
+
+    return minimum
+
+  ## Returns the vertex on the other edge of a flat model (see
+  #  get_flat_axis_minimum) that only differs from given one in the
+  #  coordinate along the axis, None if there is none.
+
+  def get_partner(self, vertex, axis, minimum):
+    on_minimum = abs(vertex[axis] - minimum) <= ChunkMesher.EPSILON
+
+    for other in self.parts[0][1]:
+      if (abs(other[axis] - minimum) <= ChunkMesher.EPSILON) != on_minimum and all(abs(other[i] - vertex[i]) <= ChunkMesher.EPSILON for i in range(3) if i != axis):
+        return other
+
+    return None
+
+## Vertices and triangles of one render state being built. Vertices are
+#  copied untransformed, the offsets of the copies are applied when the geom
+#  is made (by Panda, which is much faster than doing it per vertex here).
+
+class MeshBucket:
+  def __init__(self, state):
+    self.state = state
+    self.vertices = array("f")          ##< interleaved vertex, normal and texcoord values
+    self.indices = array("I")
+    self.vertex_count = 0
+    self.offsets = []                   ##< (first row,end row,offset) of each added copy
+
+  ## Adds a copy of vertices (flat array of values, see OrientedModel) and
+  #  triangle indices (array) moved by given offset (x,y,z).
+
+  def add(self, values, indices, offset):
+    base = self.vertex_count
+    count = len(values) // 8
+
+    self.vertices.extend(values)
+    self.indices.extend([base + index for index in indices] if base != 0 else indices)
+    self.offsets.append((base,base + count,offset))
+    self.vertex_count += count
+
+  def make_geom(self):
+    vertex_data = GeomVertexData("tiles",GeomVertexFormat.getV3n3t2(),Geom.UH_static)
+    vertex_data.modifyArrayHandle(0).copyDataFrom(array_to_bytes(self.vertices))
+
+    for first_row, end_row, offset in self.offsets:
+      vertex_data.transformVertices(Mat4.translateMat(offset[0],offset[1],offset[2]),first_row,end_row)
+
+    triangles = GeomTriangles(Geom.UH_static)
+    triangles.setIndexType(Geom.NT_uint32)
+    triangles.modifyVertices().modifyHandle().copyDataFrom(array_to_bytes(self.indices))
+    result = Geom(vertex_data)
+    result.addPrimitive(triangles)
+    return result
+
+def array_to_bytes(values):
+  return values.tobytes() if hasattr(values,"tobytes") else values.tostring()
+
+class ChunkMesher:
+  EPSILON = 0.0001
+
+  ## Creates the mesher, models and textures are loaded through given
+  #  SceneBuilder (which is also used for tiles with animated textures).
+
+  def __init__(self, builder):
+    self.builder = builder
+    self.loader = builder.loader
+    self.oriented_models = {}          ##< (model name,h,p,r) => OrientedModel
+    self.repeated_textures = {}        ##< texture name => copy of the texture with repeat wrapping
+    self.states = {}                   ##< state key (see get_bucket) => RenderState
+
+  ## Returns the OrientedModel of given model rotated by given angles.
+
+  def get_oriented_model(self, model_name, h, p, r):
+    key = (model_name,h,p,r)
+
+    try:
+      return self.oriented_models[key]
+    except KeyError:
+      pass
+
+    model = self.builder.load_model(model_name)
+    rotation = TransformState.makeHpr(Vec3(h,p,r)).getMat()
+    parts = []
+
+    for geom_node_path in model.findAllMatches("**/+GeomNode"):
+      matrix = geom_node_path.getMat(model) * rotation
+      geom_node = geom_node_path.node()
+      node_state = geom_node_path.getNetState()
+
+      for i in range(geom_node.getNumGeoms()):
+        geom = geom_node.getGeom(i).decompose()
+        vertex_data = geom.getVertexData()
+        vertex_reader = GeomVertexReader(vertex_data,"vertex")
+        normal_reader = GeomVertexReader(vertex_data,"normal") if vertex_data.hasColumn("normal") else None
+        texcoord_reader = GeomVertexReader(vertex_data,"texcoord") if vertex_data.hasColumn("texcoord") else None
+        vertices = []
+
+        for row in range(vertex_data.getNumRows()):
+          position = matrix.xformPoint(vertex_reader.getData3())
+          normal = matrix.xformVec(normal_reader.getData3()).normalized() if normal_reader != None else Vec3(0,0,1)
+          texcoord = texcoord_reader.getData2() if texcoord_reader != None else (0,0)
+          vertices.append((position[0],position[1],position[2],normal[0],normal[1],normal[2],texcoord[0],texcoord[1]))
+
+        indices = []
+
+        for j in range(geom.getNumPrimitives()):
+          primitive = geom.getPrimitive(j)
+
+          if primitive.getPrimitiveType() == Geom.PT_polygons:
+            indices.extend(primitive.getVertex(k) for k in range(primitive.getNumVertices()))
+
+        parts.append((node_state.compose(geom_node.getGeomState(i)),vertices,indices))
+
+    self.oriented_models[key] = OrientedModel(parts)
+    return self.oriented_models[key]
+
+  def get_repeated_texture(self, texture_name):
+    if not texture_name in self.repeated_textures:
+      texture = self.builder.load_texture(texture_name).makeCopy()
+      texture.setWrapU(Texture.WM_repeat)
+      texture.setWrapV(Texture.WM_repeat)
+      self.repeated_textures[texture_name] = texture
+
+    return self.repeated_textures[texture_name]
+
+  ## Returns the MeshBucket for given model part and texture in buckets
+  #  (dict), creates it if needed.
+
+  def get_bucket(self, buckets, oriented_model, part_index, texture_name, shadow, repeated):
+    key = (id(oriented_model),part_index,texture_name,shadow,repeated)
+
+    try:
+      return buckets[key]
+    except KeyError:
+      pass
+
+    if not key in self.states:
+      attribute = TextureAttrib.makeDefault()
+
+      if len(texture_name) != 0:
+        attribute = attribute.addOnStage(TextureStage.getDefault(),self.get_repeated_texture(texture_name) if repeated else self.builder.load_texture(texture_name))
+
+      if shadow:
+        attribute = attribute.addOnStage(self.builder.overlay_texture_stage,self.builder.load_texture("tile_shadow.png"))
+
+      self.states[key] = RenderState.make(attribute).compose(oriented_model.parts[part_index][0])
+
+    buckets[key] = MeshBucket(self.states[key])
+    return buckets[key]
+
+  ## Adds a model (AnimatedTextureModel or ModelHandle) placed at given
+  #  position with given rotation to the buckets. Models with animated
+  #  textures are made as separate nodes (see SceneBuilder.make_node) under
+  #  node_path.
+
+  def add_model(self, buckets, node_path, model, name, position, hpr, shadow=False):
+    texture_names = [texture_name for texture_name in model.texture_names if len(texture_name) != 0]
+
+    if len(texture_names) > 1:
+      animated_node_path = node_path.attachNewNode(self.builder.make_node(model,name))
+      animated_node_path.setPos(position[0],position[1],position[2])
+      animated_node_path.setHpr(hpr[0],hpr[1],hpr[2])
+
+      if shadow:
+        self.builder.add_overlay_texture(animated_node_path,"tile_shadow.png")
+
+      return
+
+    oriented_model = self.get_oriented_model(model.model_name,hpr[0],hpr[1],hpr[2])
+    texture_name = texture_names[0] if len(texture_names) == 1 else ""
+
+    for i in range(len(oriented_model.parts)):
+      self.get_bucket(buckets,oriented_model,i,texture_name,shadow,False).add(oriented_model.part_values[i],oriented_model.part_indices[i],position)
+
+  ## Adds a run of count neighbouring faces of a flat model (see
+  #  OrientedModel.get_flat_axis_minimum) going along given axis from given
+  #  position as one stretched copy of the model.
+
+  def add_flat_run(self, buckets, oriented_model, texture_name, position, axis, count):
+    minimum = oriented_model.get_flat_axis_minimum(axis)
+    vertices = []
+
+    for vertex in oriented_model.parts[0][1]:
+      if abs(vertex[axis] - minimum) <= ChunkMesher.EPSILON:
+        vertices.append(vertex)
+      else:                 # stretch the vertex over the whole run, repeat the texture accordingly
+        partner = oriented_model.get_partner(vertex,axis,minimum)
+        stretched = list(vertex)
+        stretched[axis] = partner[axis] + count
+        stretched[6] = partner[6] + count * (vertex[6] - partner[6])
+        stretched[7] = partner[7] + count * (vertex[7] - partner[7])
+        vertices.append(tuple(stretched))
+
+    self.get_bucket(buckets,oriented_model,0,texture_name,False,True).add(array("f",[value for vertex in vertices for value in vertex]),oriented_model.part_indices[0],position)
+
+  ## Builds the geometry of the tiles in given region (x,y,width,height) of
+  #  the level, same as SceneBuilder.build_tiles.
+
+  def build_tiles(self, level, region):
+    x, y, width, height = region
+    result = NodePath(PandaNode("sublevel " + str(x) + " " + str(y)))
+    buckets = {}
+
+    exposed_wall_faces = level.get_exposed_wall_faces(region)
+    shadowed_tiles = level.get_shadowed_tiles(region)
+    offsets = SceneBuilder.WALL_OFFSETS
+    rotations = SceneBuilder.WALL_ROTATIONS
+    merged_faces = set()       # (x,y,direction) of wall faces already merged into a run
+
+    for j in range(y,y + height):
+      for i in range(x,x + width):
+        tile = level.get_tile(i,j)
+        coordinate_string = str(i) + " " + str(j)
+
+        if not tile.is_empty():
+          if not tile.wall: # floor tile
+            self.add_model(buckets,result,tile.floor_model,"tile " + coordinate_string,(j,i,0),(90,90,tile.floor_orientation * 90),shadowed_tiles[i - x][j - y])
+          else:             # wall
+            wall_model = tile.wall_model
+            texture_names = [texture_name for texture_name in wall_model.texture_names if len(texture_name) != 0]
+
+            for k in range(4):  # 4 walls (one for each direction)
+              if not exposed_wall_faces[k][i - x][j - y]:
+                continue
+
+              position = (j + offsets[k][1],i + offsets[k][0],0)
+              run_axis = 1 if k in (0,3) else 0          # faces facing along the tile y axis neighbour along x (world y) and vice versa
+              oriented_model = self.get_oriented_model(wall_model.model_name,90,90,rotations[k]) if len(texture_names) <= 1 else None
+
+              if oriented_model == None or oriented_model.get_flat_axis_minimum(run_axis) == None:
+                self.add_model(buckets,result,wall_model,"wall " + coordinate_string,position,(90,90,rotations[k]))
+                continue
+
+              # flat wall face, merge it with the run of the same faces going from this tile:
+
+              if (i,j,k) in merged_faces:
+                continue
+
+              record = wall_model.get_record()
+              count = 1
+
+              while True:
+                next_i = i + (count if run_axis == 1 else 0)
+                next_j = j + (count if run_axis == 0 else 0)
+
+                if next_i >= x + width or next_j >= y + height or not exposed_wall_faces[k][next_i - x][next_j - y]:
+                  break
+
+                next_tile = level.get_tile(next_i,next_j)
+
+                if next_tile.is_empty() or next_tile.wall_model.get_record() != record:
+                  break
+
+                merged_faces.add((next_i,next_j,k))
+                count += 1
+
+              self.add_flat_run(buckets,oriented_model,texture_names[0] if len(texture_names) == 1 else "",position,run_axis,count)
+
+        if tile.ceiling:
+          self.add_model(buckets,result,tile.ceiling_model,"ceiling " + coordinate_string,(j,i,tile.ceiling_height),(90,90,tile.floor_orientation * 90))
+
+    geom_node = GeomNode("tiles")
+
+    for bucket in buckets.values():
+      if bucket.vertex_count > 0:
+        geom_node.addGeom(bucket.make_geom(),bucket.state)
+
+    result.attachNewNode(geom_node)
+    result.set_bin("opaque",1)
+    result.setCollideMask(BitMask32.allOff())     # level geometry is never picked, see SceneBuilder.add_collision_box
+    return result
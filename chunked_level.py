@@ -0,0 +1,500 @@
+## Chunked level container for very large levels.
+#
+#  The level is divided into square chunks of chunk_size x chunk_size tiles
+#  (smaller at the level border), each chunk with its tiles, props and items
+#  is stored as a separate level in the binary format (see level_file) and
+#  can be loaded and unloaded independently. The file contains (all numbers
+#  little endian):
+#
+#  - header: see CHUNKED_HEADER_FORMAT
+#  - properties: level with no tiles holding the level properties (name,
+#    fog, lights, ...)
+#  - chunks: props and items positions are relative to the chunk corner
+#  - chunk table: (offset, size) for each chunk, ordered by x then y, size
+#    0 means a chunk of default tiles with no objects
+#
+#  ChunkedLevel behaves like Level but only keeps the loaded chunks in
+#  memory, see level_streaming for loading the chunks around the player.
+#  Modified chunks are unloaded too, their changes are kept in a temporary
+#  side file.
+
+import mmap
+import struct
+import os
+import sys
+import copy
+import tempfile
+
+from level import *
+import level_file
+
+CHUNKED_MAGIC = b"PRCK"
+CHUNKED_FORMAT_VERSION = 1
+
+CHUNKED_HEADER_FORMAT = "<4sHHIIIQIQ"   # magic, version, reserved, width, height, chunk size, properties offset, properties size, chunk table offset
+CHUNK_ENTRY_FORMAT = "<QI"             # offset, size
+
+DEFAULT_CHUNK_SIZE = 32
+
+## Returns the region (x,y,width,height) of given chunk.
+
+def get_chunk_region(width, height, chunk_size, chunk_x, chunk_y):
+  x = chunk_x * chunk_size
+  y = chunk_y * chunk_size
+  return (x,y,min(chunk_size,width - x),min(chunk_size,height - y))
+
+## Returns the number of chunks as (columns,rows).
+
+def get_chunk_count(width, height, chunk_size):
+  return ((width + chunk_size - 1) // chunk_size,(height + chunk_size - 1) // chunk_size)
+
+def is_chunked_level_file(filename):
+  input_file = open(filename,"rb")
+  magic = input_file.read(len(CHUNKED_MAGIC))
+  input_file.close()
+  return magic == CHUNKED_MAGIC
+
+## Loads a level from given file in any supported format, returns
+#  ChunkedLevel for chunked level files and Level otherwise.
+
+def load_level(filename):
+  if is_chunked_level_file(filename):
+    return ChunkedLevel(filename)
+
+  return Level.load_from_file(filename)
+
+## Writes a chunked level file chunk by chunk, so that the whole level
+#  never has to be in memory.
+
+class ChunkedLevelWriter:
+  ## Starts writing the file.
+  #
+  #  @param properties Level whose properties (not tiles) will be saved
+
+  def __init__(self, filename, properties, width, height, chunk_size=DEFAULT_CHUNK_SIZE):
+    self.width = width
+    self.height = height
+    self.chunk_size = chunk_size
+    self.chunk_columns, self.chunk_rows = get_chunk_count(width,height,chunk_size)
+    self.entries = [(0,0) for i in range(self.chunk_columns * self.chunk_rows)]   ##< chunk table
+
+    properties_level = Level(0,0)
+    properties_level.copy_properties(properties)
+    properties_data = level_file.encode_level(properties_level)
+
+    self.output_file = open(filename,"wb")
+    self.output_file.write(b"\0" * struct.calcsize(CHUNKED_HEADER_FORMAT))      # written in close
+    self.properties_entry = (self.output_file.tell(),len(properties_data))
+    self.output_file.write(properties_data)
+
+  def get_chunk_count(self):
+    return (self.chunk_columns,self.chunk_rows)
+
+  def get_chunk_region(self, chunk_x, chunk_y):
+    return get_chunk_region(self.width,self.height,self.chunk_size,chunk_x,chunk_y)
+
+  ## Writes one chunk, given as a level of the chunk size with object
+  #  positions relative to the chunk corner.
+
+  def write_chunk(self, chunk_x, chunk_y, chunk_level):
+    self.write_chunk_data(chunk_x,chunk_y,level_file.encode_level(chunk_level))
+
+  ## Writes one chunk already encoded in the level format (see level_file),
+  #  empty data means a chunk of default tiles with no objects.
+
+  def write_chunk_data(self, chunk_x, chunk_y, data):
+    if len(data) == 0:
+      self.entries[chunk_x * self.chunk_rows + chunk_y] = (0,0)
+      return
+
+    self.entries[chunk_x * self.chunk_rows + chunk_y] = (self.output_file.tell(),len(data))
+    self.output_file.write(data)
+
+  ## Writes the chunk table and the header and closes the file.
+
+  def close(self):
+    table_offset = self.output_file.tell()
+
+    for entry in self.entries:
+      self.output_file.write(struct.pack(CHUNK_ENTRY_FORMAT,*entry))
+
+    self.output_file.seek(0)
+    self.output_file.write(struct.pack(CHUNKED_HEADER_FORMAT,CHUNKED_MAGIC,CHUNKED_FORMAT_VERSION,0,self.width,self.height,self.chunk_size,self.properties_entry[0],self.properties_entry[1],table_offset))
+    self.output_file.close()
+
+## Saves given level as a chunked level file.
+
+def write_chunked_level_file(level_to_save, filename, chunk_size=DEFAULT_CHUNK_SIZE):
+  writer = ChunkedLevelWriter(filename,level_to_save,level_to_save.get_width(),level_to_save.get_height(),chunk_size)
+  chunk_columns, chunk_rows = writer.get_chunk_count()
+
+  for chunk_x in range(chunk_columns):
+    for chunk_y in range(chunk_rows):
+      writer.write_chunk(chunk_x,chunk_y,level_to_save.copy_region(writer.get_chunk_region(chunk_x,chunk_y)))
+
+  writer.close()
+
+## Tile layout (see tile_layout) of ChunkedLevel, passes the accesses to
+#  the layouts of the chunks (loading them if needed).
+
+class ChunkedTileLayout:
+  def __init__(self, chunked_level):
+    self.level = chunked_level
+    self.width = chunked_level.width
+    self.height = chunked_level.height
+
+  def get_record(self, x, y):
+    chunk, local_x, local_y = self.level.get_tile_chunk(x,y)
+    return chunk.layout.get_record(local_x,local_y)
+
+  def get_value(self, x, y, attribute_index):
+    chunk, local_x, local_y = self.level.get_tile_chunk(x,y)
+    return chunk.layout.get_value(local_x,local_y,attribute_index)
+
+  def set_record(self, x, y, record):
+    chunk, local_x, local_y = self.level.get_tile_chunk(x,y,True)
+    chunk.layout.set_record(local_x,local_y,record)
+
+  def set_value(self, x, y, attribute_index, value):
+    chunk, local_x, local_y = self.level.get_tile_chunk(x,y,True)
+    chunk.layout.set_value(local_x,local_y,attribute_index,value)
+
+  def get_grid(self, attribute_index, region=None):
+    return self.assemble_grid(lambda chunk, chunk_region: chunk.layout.get_grid(attribute_index,chunk_region),region)
+
+  def get_solid_wall_grid(self, model_palette, region=None):
+    return self.assemble_grid(lambda chunk, chunk_region: chunk.layout.get_solid_wall_grid(model_palette,chunk_region),region)
+
+  ## Makes a grid of given region (lying inside the level) out of the grids
+  #  of the chunks returned by get_chunk_grid(chunk,chunk_region).
+
+  def assemble_grid(self, get_chunk_grid, region):
+    x, y, width, height = region if region != None else (0,0,self.width,self.height)
+    chunk_size = self.level.chunk_size
+    result = None
+
+    for chunk_x in range(x // chunk_size,(x + width - 1) // chunk_size + 1):
+      for chunk_y in range(y // chunk_size,(y + height - 1) // chunk_size + 1):
+        chunk_region = self.level.get_chunk_region(chunk_x,chunk_y)
+        left = max(x,chunk_region[0])
+        top = max(y,chunk_region[1])
+        right = min(x + width,chunk_region[0] + chunk_region[2])
+        bottom = min(y + height,chunk_region[1] + chunk_region[3])
+
+        part = get_chunk_grid(self.level.load_chunk(chunk_x,chunk_y),(left - chunk_region[0],top - chunk_region[1],right - left,bottom - top))
+
+        if result is None:      # (result may be an array)
+          result = numpy.empty((width,height),dtype=part.dtype) if numpy != None and isinstance(part,numpy.ndarray) else make_grid(width,height,None,False)
+
+        copy_grid_region(part,0,0,result,left - x,top - y,right - left,bottom - top)
+
+    return result
+
+## CollisionMask of ChunkedLevel, tiles of chunks that are not loaded are
+#  not steppable.
+
+class ChunkedCollisionMask:
+  def __init__(self, chunked_level):
+    self.level = chunked_level
+
+  def get_width(self):
+    return self.level.width
+
+  def get_height(self):
+    return self.level.height
+
+  def is_inside(self, x, y):
+    return 0 <= x < self.level.width and 0 <= y < self.level.height
+
+  def is_steppable(self, x, y):
+    chunk_size = self.level.chunk_size
+
+    if x < 0 or y < 0:
+      return False
+
+    chunk = self.level.chunks.get((x // chunk_size,y // chunk_size))
+
+    if chunk == None:
+      return False
+
+    return chunk.collision_mask.is_steppable(x % chunk_size,y % chunk_size)
+
+  def set_steppable(self, x, y, steppable):
+    chunk, local_x, local_y = self.level.get_tile_chunk(x,y,True)
+    chunk.collision_mask.set_steppable(local_x,local_y,steppable)
+
+## Level stored in a chunked level file, only the loaded chunks are kept
+#  in memory. Chunks are loaded by load_chunk or automatically when their
+#  tiles are accessed. All chunks share the model palette, the props and
+#  items of the loaded chunks are in the props and items lists of the
+#  level (with their positions relative to the level).
+
+class ChunkedLevel(Level):
+  def __init__(self, filename):
+    Level.__init__(self,0,0)
+
+    input_file = open(filename,"rb")
+    self.mapped_file = mmap.mmap(input_file.fileno(),0,access=mmap.ACCESS_READ)
+    input_file.close()
+
+    magic, version, _, width, height, chunk_size, properties_offset, properties_size, table_offset = struct.unpack_from(CHUNKED_HEADER_FORMAT,self.mapped_file,0)
+
+    if magic != CHUNKED_MAGIC:
+      raise IOError("'" + filename + "' is not a chunked level file")
+
+    if version > CHUNKED_FORMAT_VERSION:
+      raise IOError("'" + filename + "' has unsupported version " + str(version))
+
+    self.filename = filename
+    self.width = width
+    self.height = height
+    self.chunk_size = chunk_size
+    self.chunk_columns, self.chunk_rows = get_chunk_count(width,height,chunk_size)
+    self.chunk_entries = [struct.unpack_from(CHUNK_ENTRY_FORMAT,self.mapped_file,table_offset + i * struct.calcsize(CHUNK_ENTRY_FORMAT)) for i in range(self.chunk_columns * self.chunk_rows)]
+    self.chunks = {}                     ##< loaded chunks, (chunk x,chunk y) => Level
+    self.chunk_objects = {}              ##< (chunk x,chunk y) => props and items that were loaded with the chunk
+    self.object_chunks = {}              ##< prop or item => (chunk x,chunk y) of the chunk it belongs to
+    self.modified_chunks = set()         ##< loaded chunks changed since they were loaded, written to the side file when unloaded
+    self.side_file = None                ##< temporary file holding the modified chunks that were unloaded, created when needed
+    self.side_entries = {}               ##< (chunk x,chunk y) => (offset,size) of the chunk's last version in side_file
+
+    self.copy_properties(level_file.decode_level(self.mapped_file,properties_offset,"properties of '" + filename + "'"))
+    self.layout = ChunkedTileLayout(self)
+    self.collision_mask = ChunkedCollisionMask(self)
+
+  def get_chunk_size(self):
+    return self.chunk_size
+
+  ## Returns the number of chunks as (columns,rows).
+
+  def get_chunk_count(self):
+    return (self.chunk_columns,self.chunk_rows)
+
+  def get_chunk_region(self, chunk_x, chunk_y):
+    return get_chunk_region(self.width,self.height,self.chunk_size,chunk_x,chunk_y)
+
+  def is_chunk_loaded(self, chunk_x, chunk_y):
+    return (chunk_x,chunk_y) in self.chunks
+
+  def get_loaded_chunks(self):
+    return list(self.chunks)
+
+  ## Returns a tuple (chunk level,x,y) for given tile, x and y are the tile
+  #  coordinates within the chunk. The chunk is loaded if needed.
+  #
+  #  @param modify if True, the chunk is marked as modified
+
+  def get_tile_chunk(self, x, y, modify=False):
+    if not self.is_inside(x,y):
+      raise IndexError("tile " + str((x,y)) + " is outside the level")
+
+    key = (x // self.chunk_size,y // self.chunk_size)
+    chunk = self.load_chunk(key[0],key[1])
+
+    if modify:
+      self.modified_chunks.add(key)
+
+    return (chunk,x - key[0] * self.chunk_size,y - key[1] * self.chunk_size)
+
+  ## Loads given chunk (if it isn't loaded yet) and returns it as a Level.
+
+  def load_chunk(self, chunk_x, chunk_y):
+    key = (chunk_x,chunk_y)
+
+    try:
+      return self.chunks[key]
+    except KeyError:
+      pass
+
+    x, y, width, height = self.get_chunk_region(chunk_x,chunk_y)
+    offset, size = self.chunk_entries[chunk_x * self.chunk_rows + chunk_y]
+
+    if key in self.side_entries:
+      chunk = level_file.decode_level(self.read_side_entry(key),0,"modified chunk " + str(key) + " of '" + self.filename + "'",self.model_palette)
+    elif size == 0:
+      chunk = Level(0,0)
+      chunk.model_palette = self.model_palette
+      default_record = chunk.make_tile_record(LevelTile())
+      chunk.set_layout((ArrayTileLayout if numpy != None else PaletteTileLayout)(width,height,default_record))
+    else:
+      chunk = level_file.decode_level(self.mapped_file,offset,"chunk " + str(key) + " of '" + self.filename + "'",self.model_palette)
+
+    objects = chunk.get_props() + chunk.get_items()
+
+    for what in objects:
+      what.position = (what.position[0] + x,what.position[1] + y)
+
+      if what in chunk.prop_index:
+        self.props.append(what)
+        self.prop_index.insert(what,what.position)
+      else:
+        self.items.append(what)
+        self.item_index.insert(what,what.position)
+
+      self.object_chunks[what] = key
+
+    chunk.props = []           # the objects now belong to this level
+    chunk.items = []
+    chunk.prop_index = SpatialGrid()
+    chunk.item_index = SpatialGrid()
+
+    self.chunks[key] = chunk
+    self.chunk_objects[key] = objects
+    return chunk
+
+  def read_side_entry(self, key):
+    offset, size = self.side_entries[key]
+    self.side_file.seek(offset)
+    return self.side_file.read(size)
+
+  ## Encodes given loaded chunk in the level format (see level_file) with
+  #  the object positions relative to the chunk corner, as it is stored in
+  #  the file.
+
+  def encode_chunk(self, chunk_x, chunk_y):
+    key = (chunk_x,chunk_y)
+    x, y = self.get_chunk_region(chunk_x,chunk_y)[:2]
+    chunk = self.chunks[key]
+    chunk_level = Level(0,0)
+    chunk_level.model_palette = self.model_palette
+    chunk_level.set_layout(chunk.layout,chunk.collision_mask)
+
+    for what in self.chunk_objects[key]:
+      saved_object = copy.copy(what)      # only the position differs, the object itself is not copied
+      saved_object.position = (what.position[0] - x,what.position[1] - y)
+      (chunk_level.props if what in self.prop_index else chunk_level.items).append(saved_object)
+
+    return level_file.encode_level(chunk_level)
+
+  ## Unloads given chunk, a modified chunk is written to the side file
+  #  first. Returns True if the chunk was unloaded.
+
+  def unload_chunk(self, chunk_x, chunk_y):
+    key = (chunk_x,chunk_y)
+
+    if not key in self.chunks:
+      return False
+
+    if key in self.modified_chunks:
+      data = self.encode_chunk(chunk_x,chunk_y)
+
+      if self.side_file == None:
+        self.side_file = tempfile.TemporaryFile()
+
+      self.side_file.seek(0,2)            # appended, older versions of the chunk are just left in the file
+      self.side_entries[key] = (self.side_file.tell(),len(data))
+      self.side_file.write(data)
+      self.modified_chunks.remove(key)
+
+    objects = self.chunk_objects.pop(key)
+    removed = set(objects)
+
+    for what in objects:
+      (self.prop_index if what in self.prop_index else self.item_index).remove(what)
+      del self.object_chunks[what]
+
+    if len(removed) > 0:
+      self.props = [what for what in self.props if not what in removed]
+      self.items = [what for what in self.items if not what in removed]
+
+    del self.chunks[key]
+    return True
+
+  ## Saves the level as a chunked level file, only the modified chunks are
+  #  encoded again, the others are copied. The file is written under a
+  #  temporary name first, as it may be the file this level is mapped from.
+
+  def write_file(self, filename):
+    temporary_filename = filename + ".tmp"
+    writer = ChunkedLevelWriter(temporary_filename,self,self.width,self.height,self.chunk_size)
+
+    for chunk_x in range(self.chunk_columns):
+      for chunk_y in range(self.chunk_rows):
+        key = (chunk_x,chunk_y)
+
+        if key in self.modified_chunks:
+          data = self.encode_chunk(chunk_x,chunk_y)
+        elif key in self.side_entries:
+          data = self.read_side_entry(key)
+        else:
+          offset, size = self.chunk_entries[chunk_x * self.chunk_rows + chunk_y]
+          data = self.mapped_file[offset:offset + size]
+
+        writer.write_chunk_data(chunk_x,chunk_y,data)
+
+    writer.close()
+
+    if os.path.exists(filename) and os.name == "nt":     # Windows can't rename over an existing file
+      os.remove(filename)
+
+    os.rename(temporary_filename,filename)
+
+  ## Chunked levels can't be resized, only a change to the same size is
+  #  accepted (e.g. by the map editor setting all the level properties).
+
+  def set_size(self, new_width, new_height):
+    if (new_width,new_height) != (self.width,self.height):
+      raise ValueError("chunked levels can't be resized")
+
+  def add_prop(self, prop):
+    self.add_object(prop,Level.add_prop)
+
+  def add_item(self, item):
+    self.add_object(item,Level.add_item)
+
+  ## Returns the (chunk x,chunk y) of the chunk an object at given position
+  #  belongs to (objects outside the level belong to the nearest chunk).
+
+  def get_position_chunk(self, position):
+    return (min(max(int(position[0]) // self.chunk_size,0),self.chunk_columns - 1),min(max(int(position[1]) // self.chunk_size,0),self.chunk_rows - 1))
+
+  def add_object(self, what, add_function):
+    key = self.get_position_chunk(what.position)
+
+    self.load_chunk(key[0],key[1])
+    add_function(self,what)
+    self.chunk_objects[key].append(what)
+    self.object_chunks[what] = key
+    self.modified_chunks.add(key)
+
+  def remove_prop(self, prop):
+    self.remove_object(prop,Level.remove_prop)
+
+  def remove_item(self, item):
+    self.remove_object(item,Level.remove_item)
+
+  def remove_object(self, what, remove_function):
+    remove_function(self,what)
+    key = self.object_chunks.pop(what)
+    self.chunk_objects[key].remove(what)
+    self.modified_chunks.add(key)
+
+  ## Sets the position of a prop or item, an object moved to another chunk
+  #  moves to that chunk's objects (so that it's saved and unloaded with the
+  #  chunk it stands in). The chunks are updated before the object listeners
+  #  are called.
+
+  def set_object_position(self, what, new_position):
+    if what in self.object_chunks:
+      key = self.object_chunks[what]
+      new_key = self.get_position_chunk(new_position)
+      self.modified_chunks.add(key)
+
+      if new_key != key:
+        self.load_chunk(new_key[0],new_key[1])
+        self.chunk_objects[key].remove(what)
+        self.chunk_objects[new_key].append(what)
+        self.object_chunks[what] = new_key
+        self.modified_chunks.add(new_key)
+
+    Level.set_object_position(self,what,new_position)
+
+## Converts a level file to the chunked format, usage:
+#  python chunked_level.py input_file output_file [chunk_size]
+
+if __name__ == "__main__":
+  if len(sys.argv) not in (3,4):
+    print("usage: python chunked_level.py input_file output_file [chunk_size]")
+    sys.exit(1)
+
+  write_chunked_level_file(Level.load_from_file(sys.argv[1]),sys.argv[2],int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_CHUNK_SIZE)
@@ -0,0 +1,66 @@
+## Persistent collision mask of a level, one byte per tile (1 = steppable,
+#  0 = not steppable), stored column by column (index = x * height + y).
+#  The level keeps it up to date when tiles change, so it never has to be
+#  rebuilt during the game.
+
+from tile_layout import *
+
+class CollisionMask:
+  ## Creates the mask out of given bytearray (see above).
+
+  def __init__(self, width, height, data):
+    self.width = width
+    self.height = height
+    self.data = data
+
+  ## Class static method, creates the mask from given grid of steppable
+  #  values (see tile_layout).
+
+  @staticmethod
+  def from_grid(steppable_grid):
+    result = CollisionMask(0,0,bytearray())
+    result.set_grid(steppable_grid)
+    return result
+
+  ## Replaces the mask content with given grid of steppable values.
+
+  def set_grid(self, steppable_grid):
+    self.width = len(steppable_grid)
+    self.height = len(steppable_grid[0]) if self.width > 0 else 0
+
+    if numpy != None and isinstance(steppable_grid,numpy.ndarray):
+      self.data = bytearray(steppable_grid.astype("uint8").tobytes())
+    else:
+      self.data = bytearray(1 if value else 0 for column in steppable_grid for value in column)
+
+  ## Sets the tiles of a rectangle with its corner at (x,y) from given grid
+  #  of steppable values, the rectangle has to lie inside the mask.
+
+  def set_region(self, x, y, steppable_grid):
+    use_numpy = numpy != None and isinstance(steppable_grid,numpy.ndarray)
+
+    for i in range(len(steppable_grid)):
+      start = (x + i) * self.height + y
+      column = steppable_grid[i]
+      self.data[start:start + len(column)] = bytearray(column.astype("uint8").tobytes()) if use_numpy else bytearray(1 if value else 0 for value in column)
+
+  def get_width(self):
+    return self.width
+
+  def get_height(self):
+    return self.height
+
+  def is_inside(self, x, y):
+    return 0 <= x < self.width and 0 <= y < self.height
+
+  ## Says whether given tile can be stepped on, tiles outside the level
+  #  can't.
+
+  def is_steppable(self, x, y):
+    if x < 0 or y < 0 or x >= self.width or y >= self.height:
+      return False
+
+    return self.data[x * self.height + y] != 0
+
+  def set_steppable(self, x, y, steppable):
+    self.data[x * self.height + y] = 1 if steppable else 0
@@ -0,0 +1,134 @@
+## Measuring where the frame time goes. FrameProfiler collects the wall
+#  time of named parts of a frame (tasks, scripts, picking, ...), sums it
+#  over each frame and keeps a rolling histogram of the per-frame sums of
+#  the last frames for each name. The statistics can be shown as text
+#  (e.g. in an on-screen overlay) or saved as CSV or JSON. Code that
+#  measures anything should only hold an optional profiler (None when
+#  profiling is off), so that it costs nothing but a check when disabled.
+
+import json
+import time
+from collections import deque
+
+HISTOGRAM_BUCKETS = [0.1,0.2,0.5,1.0,2.0,5.0,10.0,20.0,50.0,100.0]   ##< upper bounds of the histogram buckets in milliseconds, the last bucket is unbounded
+
+def get_percentile(sorted_values, fraction):
+  return sorted_values[min(int(fraction * len(sorted_values)),len(sorted_values) - 1)]
+
+## Histogram of the last values (times in milliseconds).
+
+class RollingHistogram:
+  def __init__(self, window):
+    self.values = deque(maxlen=window)
+    self.counts = [0 for i in range(len(HISTOGRAM_BUCKETS) + 1)]   ##< number of the kept values in each bucket
+    self.total_count = 0                 ##< number of all values ever added
+
+  @staticmethod
+  def get_bucket(value):
+    for i, bound in enumerate(HISTOGRAM_BUCKETS):
+      if value < bound:
+        return i
+
+    return len(HISTOGRAM_BUCKETS)
+
+  def add(self, value):
+    if len(self.values) == self.values.maxlen:
+      self.counts[RollingHistogram.get_bucket(self.values[0])] -= 1
+
+    self.values.append(value)
+    self.counts[RollingHistogram.get_bucket(value)] += 1
+    self.total_count += 1
+
+  ## Returns the statistics of the kept values as a dict name => value.
+
+  def get_statistics(self):
+    sorted_values = sorted(self.values)
+
+    if len(sorted_values) == 0:
+      sorted_values = [0.0]
+
+    return {"samples": len(self.values),"total_samples": self.total_count,"avg_ms": sum(sorted_values) / len(sorted_values),
+      "p50_ms": get_percentile(sorted_values,0.5),"p95_ms": get_percentile(sorted_values,0.95),"p99_ms": get_percentile(sorted_values,0.99),
+      "max_ms": sorted_values[-1],"histogram": list(self.counts)}
+
+class FrameProfiler:
+  ## Creates the profiler.
+  #
+  #  @param window number of the last frames the statistics are made of
+
+  def __init__(self, window=300):
+    self.window = window
+    self.histograms = {}                 ##< name => RollingHistogram
+    self.frame_times = {}                ##< name => time in seconds measured in the current frame
+    self.frames = 0
+
+  ## Adds given time in seconds to the current frame's time of given name.
+
+  def add(self, name, seconds):
+    self.frame_times[name] = self.frame_times.get(name,0.0) + seconds
+
+  ## Calls given function with given arguments measuring it under given
+  #  name, returns what the function returns.
+
+  def call(self, name, function, *arguments):
+    start = time.time()
+    result = function(*arguments)
+    self.add(name,time.time() - start)
+    return result
+
+  ## Returns a function that calls given function measuring it under given
+  #  name (e.g. for a Panda3D task).
+
+  def wrap(self, name, function):
+    return lambda *arguments: self.call(name,function,*arguments)
+
+  ## Ends the current frame: its times go to the histograms. Only the names
+  #  measured in the frame get a value.
+
+  def end_frame(self):
+    for name, seconds in self.frame_times.items():
+      if not name in self.histograms:
+        self.histograms[name] = RollingHistogram(self.window)
+
+      self.histograms[name].add(seconds * 1000)
+
+    self.frame_times = {}
+    self.frames += 1
+
+  ## Returns a list of (name,statistics dict) sorted by the average time,
+  #  the longest first.
+
+  def get_statistics(self):
+    result = [(name,histogram.get_statistics()) for name, histogram in self.histograms.items()]
+    result.sort(key=lambda item: - item[1]["avg_ms"])
+    return result
+
+  ## Returns the statistics as lines of text.
+  #
+  #  @param max_lines maximum number of measured names shown
+
+  def format_text(self, max_lines=None):
+    lines = ["%-28s %7s %7s %7s" % ("ms (last " + str(self.window) + " frames)","avg","95 %","max")]
+
+    for name, statistics in self.get_statistics()[:max_lines]:
+      lines.append("%-28s %7.2f %7.2f %7.2f" % (name[:28],statistics["avg_ms"],statistics["p95_ms"],statistics["max_ms"]))
+
+    return "\n".join(lines)
+
+  ## Saves the statistics into a file, as JSON if the file name ends with
+  #  .json, otherwise as CSV.
+
+  def save(self, filename):
+    statistics = self.get_statistics()
+    output_file = open(filename,"w")
+
+    if filename.endswith(".json"):
+      json.dump({"frames": self.frames,"window": self.window,"histogram_buckets_ms": HISTOGRAM_BUCKETS,"measured": dict(statistics)},output_file,indent=2,sort_keys=True,separators=(",",": "))
+    else:
+      columns = ["samples","total_samples","avg_ms","p50_ms","p95_ms","p99_ms","max_ms"]
+      output_file.write(",".join(["name"] + columns + ["<" + str(bound) + " ms" for bound in HISTOGRAM_BUCKETS] + [">=" + str(HISTOGRAM_BUCKETS[-1]) + " ms"]) + "\n")
+
+      for name, values in statistics:
+        output_file.write(",".join(['"' + name.replace('"','""') + '"'] + [str(values[column]) for column in columns] + [str(count) for count in values["histogram"]]) + "\n")
+
+    output_file.close()
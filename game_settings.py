@@ -0,0 +1,54 @@
+## Settings tuned for the machine the game runs on (e.g. by
+#  chunk_benchmark.py), kept in a Panda3D config (prc) file in the game
+#  directory so that they are read like any other Panda3D config variable.
+
+import os
+
+from panda3d.core import *
+
+SETTINGS_FILE = "settings.prc"
+LEVEL_CHUNK_SIZE = "level-chunk-size"          ##< size of level chunks in tiles
+
+loaded_settings_file = None                    ##< name of the settings file loaded by load_settings, None if none was loaded
+
+## Loads the settings file into the Panda3D config if it exists, has to be
+#  called before the settings are read.
+
+def load_settings(filename=SETTINGS_FILE):
+  global loaded_settings_file
+
+  if os.path.isfile(filename):
+    loadPrcFile(Filename.fromOsSpecific(filename))
+    loaded_settings_file = filename
+
+## Writes given setting to the settings file (keeping the other settings)
+#  and applies it to the running config.
+
+def save_setting(name, value, filename=SETTINGS_FILE):
+  lines = []
+
+  if os.path.isfile(filename):
+    input_file = open(filename,"r")
+    lines = [line for line in input_file.read().splitlines() if line.split()[:1] != [name]]
+    input_file.close()
+
+  lines.append(name + " " + str(value))
+
+  output_file = open(filename,"w")
+  output_file.write("\n".join(lines) + "\n")
+  output_file.close()
+
+  loadPrcFileData("",name + " " + str(value))
+
+## Returns the value of given setting (ConfigVariable), says where it comes
+#  from if it's set and a settings file was loaded, as the settings change
+#  the results of the benchmarks and tools.
+
+def get_setting(variable):
+  if variable.hasValue() and loaded_settings_file != None:
+    print("using " + variable.getName() + " " + str(variable.getValue()) + " (settings file " + os.path.abspath(loaded_settings_file) + ")")
+
+  return variable.getValue()
+
+def get_level_chunk_size(default):
+  return get_setting(ConfigVariableInt(LEVEL_CHUNK_SIZE,default))
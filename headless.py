@@ -0,0 +1,125 @@
+## Runs the game simulation (see simulation) without a window or renderer
+#  and as fast as possible, with a bot giving random input (walking,
+#  running, turning, jumping and using the props it stands next to). Prints
+#  the throughput and the stalls, the ticks that took longer than the
+#  simulated time (SIMULATION_STEP), so that long soak runs can be made
+#  e.g. in CI without a GPU. Usage:
+#
+#  python headless.py [-s simulated_seconds] [-r random_seed] [level_file]
+
+import sys
+import time
+import random
+from array import array
+
+from level_streaming import *
+from game_settings import *
+from simulation import *
+from render_benchmark import get_percentile
+from main import Game
+
+DEFAULT_SIMULATED_SECONDS = 600.0
+BOT_DECISION_TIME = 0.5              ##< the bot changes its input every this many simulated seconds (on average)
+REPORTED_STALLS = 5                  ##< how many of the slowest stalls are listed
+
+## Gives random input to a simulation, as a player would.
+
+class InputBot:
+  def __init__(self, simulation, seed=None):
+    self.simulation = simulation
+    self.random = random.Random(seed)
+    self.next_decision_time = 0.0
+
+  ## Changes the input of the simulation when the time for a new decision
+  #  comes, to be called before each tick.
+
+  def update(self):
+    simulation = self.simulation
+
+    if simulation.simulation_time < self.next_decision_time:
+      return
+
+    self.next_decision_time = simulation.simulation_time + self.random.uniform(0.0,2 * BOT_DECISION_TIME)
+    input_state = simulation.input_state
+
+    input_state["w"] = self.random.random() < 0.6
+    input_state["s"] = not input_state["w"] and self.random.random() < 0.2
+    input_state["a"] = self.random.random() < 0.15
+    input_state["d"] = not input_state["a"] and self.random.random() < 0.15
+    input_state["shift"] = self.random.random() < 0.3
+    input_state["e"] = self.random.random() < 0.1
+    simulation.player_rotation = (simulation.player_rotation + self.random.uniform(-90,90)) % 360
+
+    # the presentation picks the focused prop, here the bot looks at the nearest one:
+
+    position = simulation.script_get_player_position()
+    simulation.focused_prop = simulation.level.get_nearest_object(position,Simulation.USE_DISTANCE,items=False)
+    input_state["space"] = simulation.focused_prop != None and self.random.random() < 0.5
+
+## Runs given simulation with the bot for given simulated time, returns the
+#  list of tick durations in seconds and the list of stalls as tuples
+#  (duration,simulation time,player position).
+
+def run_simulation(simulation, bot, simulated_seconds):
+  # the props are activated by chunks around the player as in the game:
+
+  streamer = ChunkStreamer(simulation.level,get_level_chunk_size(Game.CHUNK_SIZE),simulation.level.get_fog_distance() + Game.FOG_RANGE,
+    lambda chunk_x, chunk_y, region: simulation.activate_props(simulation.level.get_objects_in_region(region,items=False)),
+    lambda chunk_x, chunk_y, props: None)
+
+  streamer.update(simulation.player_position,True)
+  tick_times = array("d")
+  stalls = []
+
+  for i in range(int(simulated_seconds / Simulation.SIMULATION_STEP)):
+    start = time.time()
+    bot.update()
+    simulation.simulation_tick()
+    streamer.update(simulation.player_position)
+    tick_time = time.time() - start
+    tick_times.append(tick_time)
+
+    if tick_time > Simulation.SIMULATION_STEP:
+      stalls.append((tick_time,simulation.simulation_time,tuple(simulation.player_position)))
+
+  return (tick_times,stalls)
+
+def main():
+  arguments = sys.argv[1:]
+  simulated_seconds = DEFAULT_SIMULATED_SECONDS
+  seed = None
+
+  while len(arguments) >= 2 and arguments[0] in ("-s","-r"):
+    if arguments[0] == "-s":
+      simulated_seconds = float(arguments[1])
+    else:
+      seed = int(arguments[1])
+
+    arguments = arguments[2:]
+
+  load_settings()
+  level_filename = arguments[0] if len(arguments) > 0 else Game.DEFAULT_LEVEL
+  simulation = Simulation(level_filename)
+  bot = InputBot(simulation,seed)
+
+  start = time.time()
+  tick_times, stalls = run_simulation(simulation,bot,simulated_seconds)
+  real_time = time.time() - start
+
+  sorted_tick_times = sorted(tick_times)
+
+  print("level " + level_filename + ", " + str(len(tick_times)) + " ticks (" + str(simulated_seconds) + " s simulated) in " + ("%.2f" % real_time) + " s")
+  print("%12s %16s %14s %14s %14s %8s" % ("ticks/s","simulated s/s","tick avg (ms)","99 % (ms)","max (ms)","stalls"))
+  print("%12.0f %16.1f %14.3f %14.3f %14.3f %8d" % (len(tick_times) / real_time,simulation.simulation_time / real_time,real_time / len(tick_times) * 1000,
+    get_percentile(sorted_tick_times,0.99) * 1000,sorted_tick_times[-1] * 1000,len(stalls)))
+
+  stalls.sort(reverse=True)
+
+  for tick_time, simulation_time, position in stalls[:REPORTED_STALLS]:
+    print("stall of %.2f ms at %.2f s, player at (%.1f,%.1f)" % (tick_time * 1000,simulation_time,position[0],position[1]))
+
+  print("scripts: %d running, %d resumed, %d postponed, %d ticks over budget, %d compiled in %.1f ms" % (simulation.script_scheduler.get_script_count(),simulation.script_scheduler.resumed,
+    simulation.script_scheduler.postponed,simulation.script_scheduler.overruns,simulation.script_manager.misses - simulation.script_manager.cache_loads,simulation.script_manager.compile_time * 1000))
+
+if __name__ == "__main__":
+  main()
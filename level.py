@@ -1,6 +1,11 @@
 from general import *
 import pickle
 import copy
+import level_file
+from tile_palette import *
+from tile_layout import *
+from collision_mask import *
+from spatial_index import *
 
 ## Represents one level tile.
 
@@ -62,42 +67,43 @@ class LevelProp:
 ## Represents one game level.
 
 class Level:
-  ## Class static method, saves the level into given file.
+  ## Class static method, saves the level into given file (in the binary
+  #  format, see level_file).
   
   @staticmethod
   def save_to_file(level, filename):
-    output_file = open(filename,"w")
-    pickle.dump(level,output_file)
-    output_file.close()
+    level.write_file(filename)
+
+  ## Saves the level into given file, see save_to_file (ChunkedLevel saves
+  #  itself as a chunked level file).
+
+  def write_file(self, filename):
+    level_file.write_level_file(self,filename)
   
   ## Class static method, loads the level from given file and returns it.
-  #  the level argument has to be there because of python interpreter
-  #  for some reason.
+  #  Old pickled levels are converted when loaded.
   
   @staticmethod
   def load_from_file(filename):
-    input_file = open(filename,"r")
-    level = Level(1,1)
-    result = unpickle_backwards_compatible(level,input_file)
-    input_file.close()
-    return result
+    if level_file.is_level_file(filename):
+      return level_file.read_level_file(filename)
+    
+    return level_file.read_legacy_level_file(filename)
   
-  ## Returns a 2D list representing the level collision mask (x, y
-  #  coordinates contain either True - steppable, or False - not
-  #  steppable)
+  ## Returns the level CollisionMask. The mask is owned by the level and
+  #  kept up to date when the tiles change.
   
   def get_collision_mask(self):
-    result = []
-    
-    for i in range(self.get_width()):
-      result.append([])
-      for j in range(self.get_height()):
-        result[i].append(self.get_tile(i,j).steppable)
-          
-    return result
+    return self.collision_mask
+
+  ## Creates the level.
+  #
+  #  @param default_tile LevelTile the level will be filled with, None means empty tiles
+  #  @param array_backed whether to store the tiles in NumPy arrays (see tile_layout),
+  #         None means yes if NumPy is available
     
-  def __init__(self, width, height, default_tile=None):
-    self.layout = [[None for i in range(height)] for j in range(width)]
+  def __init__(self, width, height, default_tile=None, array_backed=None):
+    self.model_palette = Palette()         ##< unique model definitions (see tile_palette)
     self.width = width
     self.height = height
     self.skybox_textures = []              ##< contains names of skybox textures that are being chained between during daytime
@@ -107,15 +113,20 @@ class Level:
     self.diffuse_lights = [(1.0,1.0,1.0),(0.5,0.5,0.5)]  ##< list of light colors (3-item tuples tuples) that are interpolated between during daytime
     self.props = []
     self.items = []
+    self.prop_index = SpatialGrid()        ##< spatial index of props, kept in sync by add_prop, remove_prop and set_object_position
+    self.item_index = SpatialGrid()        ##< spatial index of items, see prop_index
+    self.object_blocks = []                ##< props and items of the level file not decoded yet (see level_file.MappedObjectBlocks), they are decoded when queried
     self.name = ""                         ##< level name
     self.database_name = ""                ## name of the database file
 
-    for i in range(len(self.layout)):
-      for j in range(len(self.layout[0])):
-        if default_tile == None:
-          self.layout[i][j] = LevelTile()
-        else:
-          self.layout[i][j] = LevelTile(default_tile)
+    if array_backed == None:
+      array_backed = numpy != None
+
+    default_record = self.make_tile_record(LevelTile() if default_tile == None else default_tile)
+    self.tile_listeners = []               ##< functions called as f(x,y,attribute_index) when a tile changes, attribute_index is None if the whole tile changed
+    self.object_listeners = []             ##< functions called as f(object,old_position) when a prop or item moves
+    self.layout = (ArrayTileLayout if array_backed else PaletteTileLayout)(width,height,default_record)   ##< tile storage (see tile_layout)
+    self.collision_mask = CollisionMask.from_grid(self.layout.get_grid(STEPPABLE))                          ##< steppable tiles, see get_collision_mask
 
   def get_database_name(self):
     return self.database_name
@@ -126,20 +137,120 @@ class Level:
   ## Resizes the map.
 
   def set_size(self, new_width, new_height):
-    old_size = (self.get_width(),self.get_height())
-    old_layout = self.layout
-    
+    self.layout.resize(new_width,new_height,self.make_tile_record(LevelTile()))
     self.width = new_width
     self.height = new_height
-    
-    self.layout = [[None for i in range(new_height)] for j in range(new_width)]
-    
-    for i in range(len(self.layout)):
-      for j in range(len(self.layout[0])):
-        try:
-          self.layout[i][j] = old_layout[i][j]
-        except Exception:
-          self.layout[i][j] = LevelTile()
+    self.collision_mask.set_grid(self.layout.get_grid(STEPPABLE))
+
+  ## Sets the tile storage (see tile_layout) and updates the level size
+  #  and collision mask accordingly.
+  #
+  #  @param collision_mask CollisionMask matching the layout, None means
+  #         it will be computed from the layout
+
+  def set_layout(self, layout, collision_mask=None):
+    self.layout = layout
+    self.width = layout.width
+    self.height = layout.height
+
+    if collision_mask == None:
+      self.collision_mask.set_grid(layout.get_grid(STEPPABLE))
+    else:
+      self.collision_mask = collision_mask
+
+  ## Copies the level properties (name, database, fog, lights and skybox)
+  #  from another level.
+
+  def copy_properties(self, other):
+    self.set_name(other.get_name())
+    self.set_database_name(other.get_database_name())
+    self.set_fog_distance(other.get_fog_distance())
+    self.set_fog_color(other.get_fog_color())
+    self.set_light_properties(other.get_ambient_light_amount(),list(other.get_diffuse_lights()))
+    self.set_skybox_textures(list(other.get_skybox_textures()))
+
+  ## Returns a new level made of given region (x,y,width,height) of this
+  #  level. It has the same properties and contains copies of the props and
+  #  items standing in the region with positions relative to its corner.
+
+  def copy_region(self, region):
+    x, y, width, height = region
+    array_backed = isinstance(self.layout,ArrayTileLayout)
+    result = Level(0,0,array_backed=array_backed)
+    result.copy_properties(self)
+
+    if array_backed:
+      default_record = result.make_tile_record(LevelTile())
+      arrays = [values.copy() for values in self.layout.get_region_arrays(region)]
+      model_arrays = [TILE_ATTRIBUTE_INDICES[attribute] for attribute in TILE_MODEL_ATTRIBUTES]
+      model_map = numpy.zeros(max(len(self.model_palette),1),dtype="uint32")    # model index in this level => model index in the result
+
+      for model_index in numpy.unique(numpy.concatenate([arrays[index].ravel() for index in model_arrays])):
+        model_map[model_index] = result.model_palette.intern(self.model_palette[model_index])
+
+      for index in model_arrays:
+        arrays[index] = model_map[arrays[index]]
+
+      result.set_layout(ArrayTileLayout(width,height,default_record,arrays))
+    else:
+      result.set_size(width,height)
+
+      for i in range(width):
+        for j in range(height):
+          result.set_tile(i,j,self.get_tile(x + i,y + j))
+
+    for what in self.get_objects_in_region(region):
+      new_object = what.copy()
+      new_object.position = (what.position[0] - x,what.position[1] - y)
+
+      if what in self.prop_index:
+        result.add_prop(new_object)
+      else:
+        result.add_item(new_object)
+
+    return result
+
+  ## Copies given region (x,y,width,height) of another level into this
+  #  level with its corner at (x,y) (the opposite of copy_region), including
+  #  copies of the props and items standing in the region. The region has
+  #  to fit into this level.
+
+  def paste_region(self, source, region, x, y):
+    source_x, source_y, width, height = region
+    model_map = [self.model_palette.intern(model) for model in source.model_palette.values]   # model index in the source => model index in this level
+    model_indices = [TILE_ATTRIBUTE_INDICES[attribute] for attribute in TILE_MODEL_ATTRIBUTES]
+
+    if isinstance(self.layout,ArrayTileLayout) and isinstance(source.layout,ArrayTileLayout):
+      model_map = numpy.array(model_map,dtype="uint32")
+
+      for index, (values, source_values) in enumerate(zip(self.layout.get_region_arrays((x,y,width,height)),source.layout.get_region_arrays(region))):
+        values[:,:] = model_map[source_values] if index in model_indices else source_values
+    else:
+      for i in range(width):
+        for j in range(height):
+          record = list(source.layout.get_record(source_x + i,source_y + j))
+
+          for index in model_indices:
+            record[index] = model_map[record[index]]
+
+          self.layout.set_record(x + i,y + j,tuple(record))
+
+    self.collision_mask.set_region(x,y,source.layout.get_grid(STEPPABLE,region))
+
+    for what in source.get_objects_in_region(region):
+      new_object = what.copy()
+      new_object.position = (what.position[0] - source_x + x,what.position[1] - source_y + y)
+
+      if what in source.prop_index:
+        self.add_prop(new_object)
+      else:
+        self.add_item(new_object)
+
+    if len(self.tile_listeners) != 0:
+      for i in range(width):
+        for j in range(height):
+          for listener in self.tile_listeners:
+            listener(x + i,y + j,None)
 
   def set_fog_distance(self,distance):
     self.fog_distance = distance
@@ -149,14 +260,115 @@ class Level:
 
   def add_prop(self, prop):
     self.props.append(prop)
+    self.prop_index.insert(prop,prop.position)
 
   def add_item(self, item):
     self.items.append(item)
+    self.item_index.insert(item,item.position)
+
+  def remove_prop(self, prop):
+    self.props.remove(prop)
+    self.prop_index.remove(prop)
+
+  def remove_item(self, item):
+    self.items.remove(item)
+    self.item_index.remove(item)
+
+  ## Sets the position of a prop or item of this level. The position should
+  #  always be changed this way so that the spatial index stays valid. The
+  #  object listeners are called afterwards.
+
+  def set_object_position(self, what, new_position):
+    old_position = what.position
+    what.position = (new_position[0],new_position[1])
+
+    for index in (self.prop_index,self.item_index):
+      if what in index:
+        index.move(what,what.position)
+
+    for listener in self.object_listeners:
+      listener(what,old_position)
+
+  ## Adds props or items that are decoded from the level file when they are
+  #  queried (see level_file.MappedObjectBlocks).
+
+  def add_object_blocks(self, object_blocks):
+    self.object_blocks.append(object_blocks)
+
+  ## Decodes the props and items not decoded yet (see object_blocks) within
+  #  the rectangle given by two (x,y) corners, all of them if no rectangle is
+  #  given.
+
+  def decode_objects(self, corner1=None, corner2=None):
+    if len(self.object_blocks) == 0:
+      return
+
+    for object_blocks in self.object_blocks:
+      object_blocks.decode(self,corner1,corner2)
+
+    self.object_blocks = [object_blocks for object_blocks in self.object_blocks if not object_blocks.is_decoded()]
+
+  ## Returns a list of props and/or items within given distance from given
+  #  (x,y) position.
+
+  def get_objects_in_radius(self, position, radius, props=True, items=True):
+    self.decode_objects((position[0] - radius,position[1] - radius),(position[0] + radius,position[1] + radius))
+    result = self.prop_index.query_radius(position,radius) if props else []
+
+    if items:
+      result += self.item_index.query_radius(position,radius)
+
+    return result
+
+  ## Returns a list of props and/or items within rectangle given by two
+  #  (x,y) corners.
+
+  def get_objects_in_rectangle(self, corner1, corner2, props=True, items=True):
+    self.decode_objects(corner1,corner2)
+    result = self.prop_index.query_rectangle(corner1,corner2) if props else []
+
+    if items:
+      result += self.item_index.query_rectangle(corner1,corner2)
+
+    return result
+
+  ## Returns a list of props and/or items standing on the tiles of given
+  #  region (x,y,width,height).
+
+  def get_objects_in_region(self, region, props=True, items=True):
+    x, y, width, height = region
+    return [what for what in self.get_objects_in_rectangle((x,y),(x + width,y + height),props,items) if x <= what.position[0] < x + width and y <= what.position[1] < y + height]
+
+  ## Returns the prop or item nearest to given (x,y) position or None if
+  #  there is none (within max_distance, if given).
+
+  def get_nearest_object(self, position, max_distance=None, props=True, items=True):
+    if max_distance == None:
+      self.decode_objects()
+    else:
+      self.decode_objects((position[0] - max_distance,position[1] - max_distance),(position[0] + max_distance,position[1] + max_distance))
+
+    candidates = []
+
+    if props:
+      candidates.append(self.prop_index.query_nearest(position,max_distance))
+
+    if items:
+      candidates.append(self.item_index.query_nearest(position,max_distance))
+
+    candidates = [candidate for candidate in candidates if candidate != None]
+
+    if len(candidates) == 0:
+      return None
+
+    return min(candidates,key=lambda candidate: (candidate.position[0] - position[0]) ** 2 + (candidate.position[1] - position[1]) ** 2)
 
   def get_props(self):
+    self.decode_objects()
     return self.props
 
   def get_items(self):
+    self.decode_objects()
     return self.items
 
   def get_width(self):
@@ -210,17 +422,163 @@ class Level:
   def get_skybox_textures(self):
     return self.skybox_textures
 
+  ## Returns a TileHandle for the tile at given position, the handle
+  #  can be used as a LevelTile, changes made through it are written
+  #  back to the level.
+
   def get_tile(self, x, y):
-    return self.layout[x][y]
+    return TileHandle(self,x,y)
+  
+  ## Sets the tile at given position to a copy of given tile (LevelTile
+  #  or TileHandle).
   
   def set_tile(self, x, y, tile):
-    try:
-      self.layout[x][y] = tile
-    except Exception:
-      pass
+    if not self.is_inside(x,y):
+      return
+
+    record = self.make_tile_record(tile)
+    self.layout.set_record(x,y,record)
+    self.collision_mask.set_steppable(x,y,record[STEPPABLE])
+
+    for listener in self.tile_listeners:
+      listener(x,y,None)
+
+  ## Sets one attribute of a tile.
+  #
+  #  @param attribute_index index of the attribute in TILE_ATTRIBUTES
+  #  @param value new value, models can be given as AnimatedTextureModel
+  #         or ModelHandle
+
+  def set_tile_value(self, x, y, attribute_index, value):
+    if not self.is_inside(x,y):
+      raise IndexError("tile " + str((x,y)) + " is outside the level")
+
+    if TILE_ATTRIBUTES[attribute_index] in TILE_MODEL_ATTRIBUTES:
+      value = self.intern_model(value)
+    elif attribute_index == STEPPABLE:
+      self.collision_mask.set_steppable(x,y,value)
+
+    self.layout.set_value(x,y,attribute_index,value)
+
+    for listener in self.tile_listeners:
+      listener(x,y,attribute_index)
+
+  ## Sets one attribute of many tiles at once: all the values are written
+  #  (and the collision mask updated) before the tile listeners are called.
+  #
+  #  @param values dict (x,y) => new value (see set_tile_value)
+
+  def set_tile_values(self, attribute_index, values):
+    for x, y in values:
+      if not self.is_inside(x,y):
+        raise IndexError("tile " + str((x,y)) + " is outside the level")
+
+    is_model = TILE_ATTRIBUTES[attribute_index] in TILE_MODEL_ATTRIBUTES
+
+    for (x, y), value in values.items():
+      if is_model:
+        value = self.intern_model(value)
+      elif attribute_index == STEPPABLE:
+        self.collision_mask.set_steppable(x,y,value)
+
+      self.layout.set_value(x,y,attribute_index,value)
+
+    for x, y in values:
+      for listener in self.tile_listeners:
+        listener(x,y,attribute_index)
+
+  ## Registers a function that will be called as f(x,y,attribute_index)
+  #  every time a tile changes (attribute_index is None if the whole
+  #  tile was replaced).
+
+  def add_tile_listener(self, listener):
+    self.tile_listeners.append(listener)
+
+  def remove_tile_listener(self, listener):
+    self.tile_listeners.remove(listener)
+
+  ## Registers a function that will be called as f(object,old_position)
+  #  every time a prop or item moves (see set_object_position).
+
+  def add_object_listener(self, listener):
+    self.object_listeners.append(listener)
+
+  def remove_object_listener(self, listener):
+    self.object_listeners.remove(listener)
+
+  def is_inside(self, x, y):
+    return 0 <= x < self.width and 0 <= y < self.height
   
   def is_wall(self, x, y):
-    if x < 0 or y < 0 or x >= self.get_width() or y >= self.get_height():
+    if not self.is_inside(x,y):
       return True
     
-    return self.layout[x][y].wall
\ No newline at end of file
+    return self.layout.get_value(x,y,WALL)
+
+  ## Returns four grids (one for each direction in NEIGHBOUR_OFFSETS) saying
+  #  which wall tiles have a face exposed in that direction, i.e. the neighbour
+  #  tile in that direction is not a wall (see is_wall).
+  #
+  #  @param region (x,y,width,height) region of the level to compute the grids
+  #         for (the grids are indexed relative to its corner), None means
+  #         the whole level
+
+  def get_exposed_wall_faces(self, region=None):
+    return exposed_wall_faces(self.get_wall_grids(region)[0])
+
+  ## Returns a grid saying which tiles neighbour with a (non-empty) wall and
+  #  should therefore have a wall shadow.
+  #
+  #  @param region same as in get_exposed_wall_faces
+
+  def get_shadowed_tiles(self, region=None):
+    return shadowed_tiles(self.get_wall_grids(region)[1])
+
+  ## Returns a tuple of grids (walls, solid_walls) for given region (see
+  #  get_exposed_wall_faces) extended by one tile on each side. Tiles outside
+  #  the level are walls without a model.
+
+  def get_wall_grids(self, region=None):
+    x, y, width, height = region if region != None else (0,0,self.width,self.height)
+    left = min(max(x - 1,0),self.width)
+    top = min(max(y - 1,0),self.height)
+    inner_region = (left,top,max(min(x + width + 1,self.width) - left,0),max(min(y + height + 1,self.height) - top,0))
+
+    if inner_region[2] == 0 or inner_region[3] == 0:
+      use_numpy = isinstance(self.layout,ArrayTileLayout)
+      return (make_grid(width + 2,height + 2,True,use_numpy),make_grid(width + 2,height + 2,False,use_numpy))
+
+    walls = self.layout.get_grid(WALL,inner_region)
+    solid_walls = self.layout.get_solid_wall_grid(self.model_palette,inner_region)
+    return (crop_grid(walls,x - 1 - left,y - 1 - top,width + 2,height + 2,True),crop_grid(solid_walls,x - 1 - left,y - 1 - top,width + 2,height + 2,False))
+
+  ## Returns the model palette index of given model (AnimatedTextureModel
+  #  or ModelHandle), adds the model to the palette if needed.
+
+  def intern_model(self, model):
+    return self.model_palette.intern(model_to_record(model))
+
+  ## Makes a tile record (see tile_layout) out of given tile (LevelTile or
+  #  TileHandle), the models are added to the model palette if needed.
+
+  def make_tile_record(self, tile):
+    if isinstance(tile,TileHandle) and tile.level == self:
+      return tile.get_record()
+
+    record = []
+
+    for attribute in TILE_ATTRIBUTES:
+      value = getattr(tile,attribute)
+      record.append(self.intern_model(value) if attribute in TILE_MODEL_ATTRIBUTES else value)
+
+    return tuple(record)
+
+  ## Makes a standalone LevelTile out of given tile record.
+
+  def make_tile(self, record):
+    result = LevelTile()
+
+    for attribute, value in zip(TILE_ATTRIBUTES,record):
+      setattr(result,attribute,record_to_model(self.model_palette[value]) if attribute in TILE_MODEL_ATTRIBUTES else value)
+
+    return result
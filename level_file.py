@@ -0,0 +1,891 @@
+## Binary level file format.
+#
+#  The file starts with a fixed header followed by a section table. Each
+#  section is identified by a four character tag:
+#
+#  - STRS: string table (model names, texture names, captions, scripts, ...)
+#  - MODL: table of AnimatedTextureModel definitions referencing the strings
+#  - META: level properties (name, lights, fog, skybox, ...)
+#  - TILE: tiles as fixed-width records in struct-of-arrays layout, each array
+#          stored column by column (all tiles with the same x are contiguous)
+#  - PROP: level props, ordered by the blocks of BLOCK_SIZE x BLOCK_SIZE
+#          tiles they stand in
+#  - ITEM: level items, ordered as props
+#  - PBLK: block table of the props (see BLOCK_TABLE_FORMAT), an entry for
+#          each block ordered by x then y (see BLOCK_ENTRY_FORMAT)
+#  - IBLK: block table of the items
+#
+#  All numbers are little endian. The file is memory-mapped when loaded and
+#  decoded on demand: each tile column is decoded (into the ArrayTileLayout
+#  with NumPy, otherwise into the PaletteTileLayout) when it is first
+#  accessed and the props and items of a block when they are first queried.
+#  Files without the block tables have their objects decoded at once.
+
+import mmap
+import pickle
+import struct
+import sys
+from array import array
+
+from general import *
+from tile_palette import *
+from tile_layout import *
+from collision_mask import *
+import level
+
+MAGIC = b"PRLV"
+FORMAT_VERSION = 1
+
+HEADER_FORMAT = "<4sHHIII"          # magic, version, reserved, width, height, section count
+SECTION_FORMAT = "<4sII"            # tag, offset, size
+BLOCK_TABLE_FORMAT = "<III"         # block size, columns, rows
+BLOCK_ENTRY_FORMAT = "<II"          # offset in the object section, object count
+
+BLOCK_SIZE = 32                     ##< size of the blocks (in tiles) by which props and items are decoded
+MIN_OBJECT_SIZE = 24                ##< number of bytes each prop and item takes at least (its position and orientation)
+MIN_MODEL_SIZE = 16                 ##< number of bytes each model of the MODL section takes at least
+REQUIRED_SECTIONS = [b"STRS",b"MODL",b"META",b"TILE",b"PROP",b"ITEM"]
+
+TILE_FLAG_WALL = 1
+TILE_FLAG_CEILING = 2
+TILE_FLAG_STEPPABLE = 4
+
+STEPPABLE_FLAG_TABLE = bytes(bytearray(1 if flags & TILE_FLAG_STEPPABLE else 0 for flags in range(256)))   ##< translates tile flags to collision mask bytes
+
+## Arrays of the TILE section in the order they are stored: (struct type, tile attribute).
+
+TILE_ARRAYS = [
+  ("B","flags"),
+  ("B","floor_orientation"),
+  ("d","ceiling_height"),
+  ("I","wall_model"),
+  ("I","floor_model"),
+  ("I","ceiling_model")]
+
+def _align(offset, alignment=8):
+  return (offset + alignment - 1) // alignment * alignment
+
+def _encode_string(string):
+  return string if isinstance(string,bytes) else string.encode("utf-8")
+
+def _array_to_bytes(values):
+  if sys.byteorder != "little":
+    values.byteswap()
+
+  return values.tobytes() if hasattr(values,"tobytes") else values.tostring()
+
+## Returns the offsets of the TILE section arrays (relative to the section
+#  start) for given number of tiles.
+
+def tile_array_offsets(tile_count):
+  result = []
+  offset = 0
+
+  for array_type, _ in TILE_ARRAYS:
+    offset = _align(offset)
+    result.append(offset)
+    offset += struct.calcsize("<" + array_type) * tile_count
+
+  return result
+
+## Checks whether given file is in the binary level format.
+
+def is_level_file(filename):
+  input_file = open(filename,"rb")
+  magic = input_file.read(len(MAGIC))
+  input_file.close()
+  return magic == MAGIC
+
+## Helper for building a section: packs values and interns strings.
+
+class SectionWriter:
+  def __init__(self, string_table):
+    self.string_table = string_table
+    self.chunks = []
+    self.size = 0                        ##< number of bytes written
+
+  def pack(self, struct_format, *values):
+    self.chunks.append(struct.pack("<" + struct_format,*values))
+    self.size += len(self.chunks[-1])
+
+  def string(self, string):
+    self.pack("I",self.string_table.intern(string))
+
+  def string_list(self, strings):
+    self.pack("I",len(strings))
+
+    for string in strings:
+      self.string(string)
+
+  def get_bytes(self):
+    return b"".join(self.chunks)
+
+## Interns strings for the STRS section.
+
+class StringTable:
+  def __init__(self):
+    self.strings = []
+    self.indices = {}
+
+  def intern(self, string):
+    if string == None:
+      string = ""
+
+    if not string in self.indices:
+      self.indices[string] = len(self.strings)
+      self.strings.append(string)
+
+    return self.indices[string]
+
+  def get_bytes(self):
+    encoded = [_encode_string(string) for string in self.strings]
+    offsets = array("I",[0])
+
+    for string in encoded:
+      offsets.append(offsets[-1] + len(string))
+
+    return struct.pack("<I",len(encoded)) + _array_to_bytes(offsets) + b"".join(encoded)
+
+## Interns AnimatedTextureModel definitions for the MODL section.
+
+class ModelTable:
+  def __init__(self, string_table):
+    self.string_table = string_table
+    self.models = []
+    self.indices = {}
+
+  def intern(self, model):
+    return self.intern_record(model_to_record(model))
+
+  def intern_record(self, record):
+    if not record in self.indices:
+      self.indices[record] = len(self.models)
+      self.models.append(record)
+
+    return self.indices[record]
+
+  def get_bytes(self):
+    writer = SectionWriter(self.string_table)
+    writer.pack("I",len(self.models))
+
+    for model_name, texture_names, framerate in self.models:
+      writer.string(model_name)
+      writer.pack("d",framerate)
+      writer.string_list(texture_names)
+
+    return writer.get_bytes()
+
+def encode_prop(writer, prop, model_table):
+  writer.pack("ddd",prop.position[0],prop.position[1],prop.orientation)
+  writer.pack("I",model_table.intern(prop.model))
+  writer.string(prop.caption)
+  writer.string(prop.data)
+  writer.string_list(prop.scripts_load)
+  writer.string_list(prop.scripts_use)
+  writer.string_list(prop.scripts_examine)
+
+def encode_item(writer, item):
+  writer.pack("ddd",item.position[0],item.position[1],item.orientation)
+  writer.string(item.data)
+  writer.pack("i",int(item.db_id))
+  writer.string_list(item.scripts_pickup)
+
+## Encodes props or items of a level of given size into a PROP or ITEM
+#  section, the objects are ordered by the blocks they stand in (see
+#  MappedObjectBlocks). Returns a tuple (section,block table section).
+#
+#  @param encode_object function f(writer,object) encoding one object
+
+def encode_objects(objects, encode_object, string_table, width, height):
+  columns = max((width + BLOCK_SIZE - 1) // BLOCK_SIZE,1)
+  rows = max((height + BLOCK_SIZE - 1) // BLOCK_SIZE,1)
+  blocks = [[] for i in range(columns * rows)]
+
+  for what in objects:
+    block_x = min(max(int(what.position[0] // BLOCK_SIZE),0),columns - 1)
+    block_y = min(max(int(what.position[1] // BLOCK_SIZE),0),rows - 1)
+    blocks[block_x * rows + block_y].append(what)
+
+  writer = SectionWriter(string_table)
+  writer.pack("I",len(objects))
+  block_table = [struct.pack(BLOCK_TABLE_FORMAT,BLOCK_SIZE,columns,rows)]
+
+  for block in blocks:
+    block_table.append(struct.pack(BLOCK_ENTRY_FORMAT,writer.size,len(block)))
+
+    for what in block:
+      encode_object(writer,what)
+
+  return (writer.get_bytes(),b"".join(block_table))
+
+## Encodes given level in the binary format, returns the bytes of the whole
+#  file.
+
+def encode_level(level_to_save):
+  width = level_to_save.get_width()
+  height = level_to_save.get_height()
+  tile_count = width * height
+
+  string_table = StringTable()
+  model_table = ModelTable(string_table)
+
+  # tiles:
+
+  # only the models the tiles use are written, the model palette also keeps
+  # the models of tiles that were changed since:
+
+  model_palette = level_to_save.model_palette
+  layout = level_to_save.layout
+
+  if isinstance(layout,ArrayTileLayout):
+    wall, ceiling, ceiling_height, floor_orientation, steppable, wall_model, floor_model, ceiling_model = layout.get_region_arrays(None)
+    used_models = numpy.zeros(max(len(model_palette),1),dtype=bool)
+
+    for model_indices in (wall_model,floor_model,ceiling_model):
+      used_models[model_indices] = True
+
+    model_map = numpy.zeros(len(used_models),dtype="uint32")   # level model index => file model index
+
+    for model_index in numpy.nonzero(used_models)[0]:
+      model_map[model_index] = model_table.intern_record(model_palette[model_index])
+
+    tile_arrays = [
+      (wall * TILE_FLAG_WALL | ceiling * TILE_FLAG_CEILING | steppable * TILE_FLAG_STEPPABLE).astype("<u1"),
+      (floor_orientation % 4).astype("<u1"),
+      ceiling_height.astype("<f8"),
+      model_map[wall_model].astype("<u4"),
+      model_map[floor_model].astype("<u4"),
+      model_map[ceiling_model].astype("<u4")]
+
+    tile_arrays = [values.tobytes() for values in tile_arrays]
+  else:
+    tile_arrays = [array(array_type) for array_type, _ in TILE_ARRAYS]
+    tile_records = {}     # tile palette index => values of the TILE_ARRAYS
+
+    def map_model(model_index):
+      return model_table.intern_record(model_palette[model_index])
+
+    def make_tile_record(tile_index):
+      wall, ceiling, ceiling_height, floor_orientation, steppable, wall_model, floor_model, ceiling_model = layout.palette[tile_index]
+
+      return (
+        (TILE_FLAG_WALL if wall else 0) | (TILE_FLAG_CEILING if ceiling else 0) | (TILE_FLAG_STEPPABLE if steppable else 0),
+        int(floor_orientation) % 4,
+        float(ceiling_height),
+        map_model(wall_model),
+        map_model(floor_model),
+        map_model(ceiling_model))
+
+    for i in range(width):
+      for tile_index in layout.columns[i]:
+        try:
+          record = tile_records[tile_index]
+        except KeyError:
+          record = make_tile_record(tile_index)
+          tile_records[tile_index] = record
+
+        for values, value in zip(tile_arrays,record):
+          values.append(value)
+
+    tile_arrays = [_array_to_bytes(values) for values in tile_arrays]
+
+  tile_section = b""
+
+  for offset, values in zip(tile_array_offsets(tile_count),tile_arrays):
+    tile_section += b"\0" * (offset - len(tile_section)) + values
+
+  # props and items:
+
+  prop_section, prop_blocks = encode_objects(level_to_save.get_props(),lambda writer, prop: encode_prop(writer,prop,model_table),string_table,width,height)
+  item_section, item_blocks = encode_objects(level_to_save.get_items(),encode_item,string_table,width,height)
+
+  # level properties:
+
+  writer = SectionWriter(string_table)
+  writer.string(level_to_save.get_name())
+  writer.string(level_to_save.get_database_name())
+  writer.pack("d",level_to_save.get_fog_distance())
+  writer.pack("ddd",*level_to_save.get_fog_color())
+  writer.pack("d",level_to_save.get_ambient_light_amount())
+  writer.string_list(level_to_save.get_skybox_textures())
+  writer.pack("I",len(level_to_save.get_diffuse_lights()))
+
+  for light in level_to_save.get_diffuse_lights():
+    writer.pack("ddd",*light)
+
+  meta_section = writer.get_bytes()
+
+  model_section = model_table.get_bytes()   # has to be done before the string table is finished
+  string_section = string_table.get_bytes()
+
+  sections = [(b"STRS",string_section),(b"MODL",model_section),(b"META",meta_section),(b"TILE",tile_section),(b"PROP",prop_section),(b"ITEM",item_section),(b"PBLK",prop_blocks),(b"IBLK",item_blocks)]
+
+  offset = struct.calcsize(HEADER_FORMAT) + len(sections) * struct.calcsize(SECTION_FORMAT)
+  section_table = b""
+  data = b""
+
+  for tag, section_data in sections:
+    padding = _align(offset) - offset
+    data += b"\0" * padding
+    offset += padding
+    section_table += struct.pack(SECTION_FORMAT,tag,offset,len(section_data))
+    data += section_data
+    offset += len(section_data)
+
+  return struct.pack(HEADER_FORMAT,MAGIC,FORMAT_VERSION,0,width,height,len(sections)) + section_table + data
+
+## Saves given level into a file in the binary format.
+
+def write_level_file(level_to_save, filename):
+  data = encode_level(level_to_save)
+
+  # the level may be mapped from the file being overwritten (its objects
+  # are all decoded by encoding them):
+
+  if isinstance(level_to_save.layout,MappedArrayTileLayout):
+    level_to_save.layout.release()
+  elif isinstance(getattr(level_to_save.layout,"columns",None),MappedTileColumns):
+    level_to_save.layout.columns.release()
+
+  output_file = open(filename,"wb")
+  output_file.write(data)
+  output_file.close()
+
+## Sequential reader of section data. Reading past the end of the section
+#  raises IOError, so that corrupted data isn't read from other sections or
+#  past the end of the file.
+
+class SectionReader:
+  ## Creates the reader.
+  #
+  #  @param end offset at which the section ends
+  #  @param description description of the data used in error messages
+
+  def __init__(self, buffer, offset, end, strings, description="level data"):
+    self.buffer = buffer
+    self.offset = offset
+    self.end = end
+    self.strings = strings
+    self.description = description
+
+  def error(self):
+    return IOError(self.description + " is corrupted or truncated")
+
+  def unpack(self, struct_format):
+    struct_format = "<" + struct_format
+    size = struct.calcsize(struct_format)
+
+    if self.offset + size > self.end:
+      raise self.error()
+
+    result = struct.unpack_from(struct_format,self.buffer,self.offset)
+    self.offset += size
+    return result
+
+  def number(self, struct_format):
+    return self.unpack(struct_format)[0]
+
+  ## Reads a count of values that take at least given number of bytes each,
+  #  checking that they can fit in the rest of the section.
+
+  def count(self, value_size):
+    result = self.number("I")
+
+    if result * value_size > self.end - self.offset:
+      raise self.error()
+
+    return result
+
+  def string(self):
+    index = self.number("I")
+
+    if index >= len(self.strings):
+      raise self.error()
+
+    return self.strings[index]
+
+  def string_list(self):
+    return [self.string() for i in range(self.count(4))]
+
+## Columns of PaletteTileLayout that are decoded from a memory-mapped level
+#  file on demand. Behaves like the list of columns.
+
+class MappedTileColumns:
+  def __init__(self, mapped_file, tile_offset, width, height, model_indices, palette):
+    self.mapped_file = mapped_file
+    self.width = width
+    self.height = height
+    self.model_indices = model_indices                     ##< file model index => level model palette index
+    self.palette = palette                                 ##< tile palette of the layout
+    self.array_offsets = [tile_offset + offset for offset in tile_array_offsets(width * height)]
+    self.columns = [None for i in range(width)]           ##< decoded columns, None for not yet decoded
+
+  def __len__(self):
+    return self.width
+
+  def __iter__(self):
+    for i in range(self.width):
+      yield self[i]
+
+  def __getitem__(self, x):
+    column = self.columns[x]
+
+    if column == None:
+      column = self.decode_column(x % self.width)
+      self.columns[x] = column
+
+    return column
+
+  def __setitem__(self, x, column):
+    self.columns[x] = column
+
+  ## Decodes one column of tiles into an array of tile palette indices.
+
+  def decode_column(self, x):
+    values = []
+
+    for (array_type, _), offset in zip(TILE_ARRAYS,self.array_offsets):
+      item_format = "<%d%s" % (self.height,array_type)
+      values.append(struct.unpack_from(item_format,self.mapped_file,offset + x * struct.calcsize("<" + array_type) * self.height))
+
+    column = array("H")
+    model_indices = self.model_indices
+    tile_palette = self.palette
+    decoded = {}
+
+    for record in zip(*values):
+      try:
+        column.append(decoded[record])
+        continue
+      except KeyError:
+        pass
+
+      flags, orientation, ceiling_height, wall_model, floor_model, ceiling_model = record
+      tile_index = tile_palette.intern((
+        (flags & TILE_FLAG_WALL) != 0,
+        (flags & TILE_FLAG_CEILING) != 0,
+        ceiling_height,
+        orientation,
+        (flags & TILE_FLAG_STEPPABLE) != 0,
+        model_indices[wall_model],
+        model_indices[floor_model],
+        model_indices[ceiling_model]))
+
+      decoded[record] = tile_index
+
+      if tile_index > 0xFFFF:
+        column = array("I",column)
+
+      column.append(tile_index)
+
+    return column
+
+  ## Decodes all the remaining columns and drops the reference to the mapped
+  #  file (which is closed once nothing else references it, the mapping may
+  #  be shared by several levels, see chunked_level).
+
+  def release(self):
+    if self.mapped_file == None:
+      return
+
+    for i in range(self.width):
+      self[i]
+
+    self.mapped_file = None
+
+## ArrayTileLayout whose arrays are decoded from a memory-mapped level file
+#  on demand: the file arrays are read-only NumPy views of the mapped file
+#  and the tile columns are converted into the layout arrays when they are
+#  first accessed (together for all the attributes).
+
+class MappedArrayTileLayout(ArrayTileLayout):
+  def __init__(self, mapped_file, tile_offset, width, height, default_record, model_indices):
+    self.file_arrays = []                                  ##< views of the TILE_ARRAYS in the mapped file, indexed [x,y]
+
+    for (array_type, _), offset in zip(TILE_ARRAYS,tile_array_offsets(width * height)):
+      values = numpy.frombuffer(mapped_file,dtype="<" + array_type,count=width * height,offset=tile_offset + offset)
+      self.file_arrays.append(values.reshape((width,height)))
+
+    self.model_indices = numpy.array(model_indices,dtype="uint32")   ##< file model index => level model palette index
+    self.decoded_columns = numpy.zeros(width,dtype=bool)
+    arrays = [numpy.empty((width,height),dtype=ArrayTileLayout.ATTRIBUTE_TYPES[attribute]) for attribute in TILE_ATTRIBUTES]   # memory not touched until the columns are decoded
+    ArrayTileLayout.__init__(self,width,height,default_record,arrays)
+
+  ## Decodes the columns from x1 (including) to x2 (excluding) that are not
+  #  decoded yet.
+
+  def decode_columns(self, x1, x2):
+    if self.file_arrays == None:
+      return
+
+    columns = numpy.flatnonzero(~self.decoded_columns[x1:x2]) + x1
+
+    if len(columns) == 0:
+      return
+
+    flags, orientations, ceiling_heights, wall_models, floor_models, ceiling_models = [values[columns] for values in self.file_arrays]
+    model_indices = self.model_indices
+
+    for values, decoded in zip(self.arrays,[
+      (flags & TILE_FLAG_WALL) != 0,
+      (flags & TILE_FLAG_CEILING) != 0,
+      ceiling_heights,
+      orientations,
+      (flags & TILE_FLAG_STEPPABLE) != 0,
+      model_indices[wall_models],
+      model_indices[floor_models],
+      model_indices[ceiling_models]]):
+      values[columns] = decoded
+
+    self.decoded_columns[columns] = True
+
+    if self.decoded_columns.all():       # the mapped file is not needed anymore
+      self.file_arrays = None
+
+  def decode_region(self, region):
+    if region == None:
+      self.decode_columns(0,self.width)
+    else:
+      self.decode_columns(region[0],region[0] + region[2])
+
+  def get_record(self, x, y):
+    self.decode_columns(x,x + 1)
+    return ArrayTileLayout.get_record(self,x,y)
+
+  def get_value(self, x, y, attribute_index):
+    self.decode_columns(x,x + 1)
+    return ArrayTileLayout.get_value(self,x,y,attribute_index)
+
+  def set_record(self, x, y, record):
+    self.decode_columns(x,x + 1)
+    ArrayTileLayout.set_record(self,x,y,record)
+
+  def set_value(self, x, y, attribute_index, value):
+    self.decode_columns(x,x + 1)
+    ArrayTileLayout.set_value(self,x,y,attribute_index,value)
+
+  def resize(self, new_width, new_height, default_record):
+    self.release()
+    ArrayTileLayout.resize(self,new_width,new_height,default_record)
+
+  def get_grid(self, attribute_index, region=None):
+    self.decode_region(region)
+    return ArrayTileLayout.get_grid(self,attribute_index,region)
+
+  def get_solid_wall_grid(self, model_palette, region=None):
+    self.decode_region(region)
+    return ArrayTileLayout.get_solid_wall_grid(self,model_palette,region)
+
+  def get_region_arrays(self, region):
+    self.decode_region(region)
+    return ArrayTileLayout.get_region_arrays(self,region)
+
+  ## Decodes all the remaining columns and drops the views of the mapped
+  #  file (see MappedTileColumns.release).
+
+  def release(self):
+    self.decode_columns(0,self.width)
+
+## Props or items of a level file decoded from the memory-mapped file on
+#  demand, by blocks of BLOCK_SIZE x BLOCK_SIZE tiles (see the PBLK and
+#  IBLK sections). Decoded objects are added to the level.
+
+class MappedObjectBlocks:
+  ## Creates the blocks.
+  #
+  #  @param strings strings of the STRS section
+  #  @param section (offset,size) of the PROP or ITEM section
+  #  @param table (offset,size) of the PBLK or IBLK section
+  #  @param decode_object function f(reader) that decodes one object
+  #  @param add_object function f(level,object) adding an object to the level
+  #  @param description description of the data used in error messages
+
+  def __init__(self, mapped_file, strings, section, table, decode_object, add_object, description="level data"):
+    self.mapped_file = mapped_file
+    self.strings = strings
+    self.section_offset, self.section_size = section
+    self.decode_object = decode_object
+    self.add_object = add_object
+    self.description = description
+
+    reader = SectionReader(mapped_file,table[0],table[0] + table[1],strings,description)
+    self.block_size, self.columns, self.rows = reader.unpack("III")           # BLOCK_TABLE_FORMAT
+
+    if self.block_size == 0 or self.columns * self.rows * struct.calcsize(BLOCK_ENTRY_FORMAT) > reader.end - reader.offset:
+      raise reader.error()
+
+    self.entries = [reader.unpack("II") for i in range(self.columns * self.rows)]   ##< (offset in the section,object count) by block, ordered by x then y, None for decoded blocks
+
+    for offset, count in self.entries:
+      if offset > self.section_size or count * MIN_OBJECT_SIZE > self.section_size - offset:
+        raise reader.error()
+
+    self.remaining = len([entry for entry in self.entries if entry[1] != 0])   ##< number of blocks with objects not decoded yet
+
+  def is_decoded(self):
+    return self.remaining == 0
+
+  ## Decodes the objects of the blocks overlapping given rectangle (given by
+  #  two (x,y) corners) into given level, all the objects if no rectangle is
+  #  given. Objects outside the level are in the nearest block.
+
+  def decode(self, level, corner1=None, corner2=None):
+    if self.remaining == 0:
+      return
+
+    if corner1 == None:
+      block_range = (0,self.columns - 1,0,self.rows - 1)
+    else:
+      block_range = (
+        self.get_block(min(corner1[0],corner2[0]),self.columns),self.get_block(max(corner1[0],corner2[0]),self.columns),
+        self.get_block(min(corner1[1],corner2[1]),self.rows),self.get_block(max(corner1[1],corner2[1]),self.rows))
+
+    for block_x in range(block_range[0],block_range[1] + 1):
+      for block_y in range(block_range[2],block_range[3] + 1):
+        index = block_x * self.rows + block_y
+        entry = self.entries[index]
+
+        if entry == None:
+          continue
+
+        self.entries[index] = None
+        offset, count = entry
+
+        if count == 0:
+          continue
+
+        reader = SectionReader(self.mapped_file,self.section_offset + offset,self.section_offset + self.section_size,self.strings,self.description)
+
+        for i in range(count):
+          self.add_object(level,self.decode_object(reader))
+
+        self.remaining -= 1
+
+    if self.remaining == 0:
+      self.mapped_file = None
+
+  def get_block(self, coordinate, count):
+    return min(max(int(coordinate // self.block_size),0),count - 1)
+
+## Loads a level from a file in the binary format. The tiles are left
+#  in the memory-mapped file and only decoded when accessed.
+
+def read_level_file(filename):
+  input_file = open(filename,"rb")
+
+  try:
+    mapped_file = mmap.mmap(input_file.fileno(),0,access=mmap.ACCESS_READ)
+  except ValueError:      # empty files can't be mapped
+    raise IOError("'" + filename + "' is truncated")
+  finally:
+    input_file.close()    # the mapping stays valid
+
+  return decode_level(mapped_file,0,"'" + filename + "'")
+
+## Decodes a level stored in the binary format in given buffer (e.g. a
+#  memory-mapped file) at given offset. The buffer has to stay valid while
+#  the level is used.
+#
+#  @param description description of the data used in error messages
+#  @param model_palette model Palette the level should use (so that several
+#         levels can share one), None means a new one
+
+def decode_level(mapped_file, start, description="level data", model_palette=None):
+  if start + struct.calcsize(HEADER_FORMAT) > len(mapped_file):
+    raise IOError(description + " is truncated")
+
+  magic, version, _, width, height, section_count = struct.unpack_from(HEADER_FORMAT,mapped_file,start)
+
+  if magic != MAGIC:
+    raise IOError(description + " is not a level file")
+
+  if version > FORMAT_VERSION:
+    raise IOError(description + " has unsupported version " + str(version))
+
+  # the sections have to be inside the buffer, so that nothing is read past
+  # its end:
+
+  sections = {}     # tag => (offset in the buffer,size)
+  offset = start + struct.calcsize(HEADER_FORMAT)
+
+  if offset + section_count * struct.calcsize(SECTION_FORMAT) > len(mapped_file):
+    raise IOError(description + " is truncated")
+
+  for i in range(section_count):
+    tag, section_offset, section_size = struct.unpack_from(SECTION_FORMAT,mapped_file,offset)
+
+    if start + section_offset + section_size > len(mapped_file):
+      raise IOError(description + " is corrupted or truncated")
+
+    sections[tag] = (start + section_offset,section_size)
+    offset += struct.calcsize(SECTION_FORMAT)
+
+  for tag in REQUIRED_SECTIONS:
+    if not tag in sections:
+      raise IOError(description + " has no " + tag.decode("ascii") + " section")
+
+  tile_count = width * height
+
+  if tile_array_offsets(tile_count)[-1] + struct.calcsize("<" + TILE_ARRAYS[-1][0]) * tile_count > sections[b"TILE"][1]:
+    raise IOError(description + " is corrupted or truncated")
+
+  def make_reader(tag):
+    return SectionReader(mapped_file,sections[tag][0],sections[tag][0] + sections[tag][1],strings,description)
+
+  # strings:
+
+  strings = []
+  reader = make_reader(b"STRS")
+  string_count = reader.count(4)
+  offsets = reader.unpack("%dI" % (string_count + 1))
+  data_start = reader.offset
+
+  if list(offsets) != sorted(offsets) or data_start + offsets[-1] > reader.end:
+    raise reader.error()
+
+  try:
+    strings = [mapped_file[data_start + offsets[i]:data_start + offsets[i + 1]].decode("utf-8") for i in range(string_count)]
+  except UnicodeDecodeError:
+    raise reader.error()
+
+  # models:
+
+  reader = make_reader(b"MODL")
+  models = []
+
+  for i in range(reader.count(MIN_MODEL_SIZE)):
+    model_name = reader.string()
+    framerate = reader.number("d")
+    models.append((model_name,tuple(reader.string_list()),framerate))
+
+  result = level.Level(0,0)
+
+  if model_palette != None:
+    result.model_palette = model_palette
+
+  model_indices = [result.model_palette.intern(model) for model in models]   # file model index => level model palette index
+  default_record = result.make_tile_record(level.LevelTile())
+
+  # tiles are decoded by columns when they are accessed, the collision mask
+  # is made directly from the tile flags so that they don't have to be:
+
+  tile_offset = sections[b"TILE"][0]
+  flags = bytearray(mapped_file[tile_offset:tile_offset + tile_count])
+  collision_mask = CollisionMask(width,height,flags.translate(STEPPABLE_FLAG_TABLE))
+
+  if numpy != None:
+    result.set_layout(MappedArrayTileLayout(mapped_file,tile_offset,width,height,default_record,model_indices),collision_mask)
+  else:
+    layout = PaletteTileLayout(width,height,default_record,[])
+    layout.columns = MappedTileColumns(mapped_file,tile_offset,width,height,model_indices,layout.palette)
+    result.set_layout(layout,collision_mask)
+
+  # level properties:
+
+  reader = make_reader(b"META")
+  result.set_name(reader.string())
+  result.set_database_name(reader.string())
+  result.set_fog_distance(reader.number("d"))
+  result.set_fog_color(reader.unpack("ddd"))
+  ambient_light_amount = reader.number("d")
+  result.set_skybox_textures(reader.string_list())
+  result.set_light_properties(ambient_light_amount,[reader.unpack("ddd") for i in range(reader.count(struct.calcsize("<ddd")))])
+
+  # props and items, by blocks when they are queried (files without the
+  # block tables at once):
+
+  decode_object_functions = [
+    (b"PROP",b"PBLK",lambda reader: decode_prop(reader,models),level.Level.add_prop),
+    (b"ITEM",b"IBLK",decode_item,level.Level.add_item)]
+
+  for tag, table_tag, decode_object, add_object in decode_object_functions:
+    if table_tag in sections:
+      result.add_object_blocks(MappedObjectBlocks(mapped_file,strings,sections[tag],sections[table_tag],decode_object,add_object,description))
+    else:
+      reader = make_reader(tag)
+
+      for i in range(reader.count(MIN_OBJECT_SIZE)):
+        add_object(result,decode_object(reader))
+
+  return result
+
+def decode_prop(reader, models):
+  x, y, orientation = reader.unpack("ddd")
+  prop = level.LevelProp((x,y),orientation)
+  model_index = reader.number("I")
+
+  if model_index >= len(models):
+    raise reader.error()
+
+  prop.model = record_to_model(models[model_index])
+  prop.caption = reader.string()
+  prop.data = reader.string()
+  prop.scripts_load = reader.string_list()
+  prop.scripts_use = reader.string_list()
+  prop.scripts_examine = reader.string_list()
+  return prop
+
+def decode_item(reader):
+  x, y, orientation = reader.unpack("ddd")
+  item = level.LevelItem((x,y),orientation)
+  item.data = reader.string()
+  item.db_id = reader.number("i")
+  item.scripts_pickup = reader.string_list()
+  return item
+
+## Converts a level unpickled from the old text format to a fully
+#  initialised Level object. Attributes missing in old files get
+#  their default values.
+
+def convert_legacy_level(old_level):
+  result = level.Level(len(old_level.layout),len(old_level.layout[0]) if len(old_level.layout) > 0 else 0)
+
+  def copy_attributes(from_object, to_object):
+    for attribute in from_object.__dict__:
+      setattr(to_object,attribute,getattr(from_object,attribute))
+
+    return to_object
+
+  def convert_model(old_model):
+    return copy_attributes(old_model,AnimatedTextureModel())
+
+  for attribute in old_level.__dict__:
+    if not attribute in ["layout","props","items","width","height"]:
+      setattr(result,attribute,getattr(old_level,attribute))
+
+  for i in range(len(old_level.layout)):
+    for j in range(len(old_level.layout[i])):
+      tile = copy_attributes(old_level.layout[i][j],level.LevelTile())
+
+      for attribute in TILE_MODEL_ATTRIBUTES:
+        setattr(tile,attribute,convert_model(getattr(tile,attribute)))
+
+      result.set_tile(i,j,tile)
+
+  for old_prop in getattr(old_level,"props",[]):
+    prop = copy_attributes(old_prop,level.LevelProp())
+    prop.model = convert_model(prop.model)
+    result.add_prop(prop)
+
+  for old_item in getattr(old_level,"items",[]):
+    result.add_item(copy_attributes(old_item,level.LevelItem()))
+
+  return result
+
+## Loads a level saved with pickle by older versions of the editor.
+
+def read_legacy_level_file(filename):
+  input_file = open(filename,"r")
+  result = convert_legacy_level(pickle.load(input_file))
+  input_file.close()
+  return result
+
+## Converts old pickled level files to the binary format, usage:
+#  python level_file.py input_file output_file
+
+if __name__ == "__main__":
+  if len(sys.argv) != 3:
+    print("usage: python level_file.py input_file output_file")
+    sys.exit(1)
+
+  level.Level.save_to_file(level.Level.load_from_file(sys.argv[1]),sys.argv[2])
@@ -0,0 +1,51 @@
+## Generates big levels for tests and benchmarks out of a smaller source
+#  level: the new level is put together from square blocks copied from
+#  random places of the source level (with their props and items). Usage:
+#
+#  python level_generator.py [-s seed] source_level size output_file
+#
+#  writes a chunked level file (see chunked_level) of size x size tiles.
+
+import sys
+import random
+
+from chunked_level import *
+
+BLOCK_SIZE = 16                      ##< size of the copied blocks in tiles
+
+## Returns a new level of given size made of blocks of the source level,
+#  the same seed always gives the same level.
+
+def generate_level(source, width, height, seed=0, block_size=BLOCK_SIZE):
+  generator = random.Random(seed)
+  result = Level(width,height,array_backed=isinstance(source.layout,ArrayTileLayout))
+  result.copy_properties(source)
+  block_size = min(block_size,source.get_width(),source.get_height())
+
+  for x in range(0,width,block_size):
+    for y in range(0,height,block_size):
+      block_width = min(block_size,width - x)
+      block_height = min(block_size,height - y)
+      source_x = generator.randint(0,source.get_width() - block_width)
+      source_y = generator.randint(0,source.get_height() - block_height)
+      result.paste_region(source,(source_x,source_y,block_width,block_height),x,y)
+
+  return result
+
+def main():
+  arguments = sys.argv[1:]
+  seed = 0
+
+  if len(arguments) >= 2 and arguments[0] == "-s":
+    seed = int(arguments[1])
+    arguments = arguments[2:]
+
+  if len(arguments) != 3:
+    print("usage: python level_generator.py [-s seed] source_level size output_file")
+    sys.exit(1)
+
+  size = int(arguments[1])
+  write_chunked_level_file(generate_level(load_level(arguments[0]),size,size,seed),arguments[2])
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,205 @@
+## Streaming of level chunks around a position (the player): chunks within
+#  given radius are built (e.g. into scene nodes) and chunks that get far
+#  away are destroyed again. For ChunkedLevel the chunk data is also loaded
+#  and unloaded, so that memory depends on the radius, not the level size.
+#  Built chunks whose tiles change (see mark_tile_dirty) are rebuilt over
+#  the following updates. Built chunks that are out of sight (e.g. beyond
+#  the fog) can be hidden with update_visibility.
+
+from math import sqrt
+
+from chunked_level import *
+
+class ChunkStreamer:
+  ## Creates the streamer, no chunks are built until update is called.
+  #
+  #  @param level Level or ChunkedLevel, for ChunkedLevel its chunk size is
+  #         used instead of chunk_size
+  #  @param radius distance (in tiles) within which chunks are built
+  #  @param build_chunk function f(chunk_x,chunk_y,region) that builds a chunk
+  #         of given region (x,y,width,height) and returns anything
+  #         representing it (e.g. a NodePath)
+  #  @param destroy_chunk function f(chunk_x,chunk_y,built_chunk) called
+  #         when a built chunk gets out of range
+  #  @param max_builds_per_update maximum number of chunks built (or rebuilt)
+  #         in one update, so that moving around doesn't cause frame drops
+  #  @param rebuild_chunk optional function f(chunk_x,chunk_y,region,
+  #         built_chunk) that updates a built chunk after its tiles changed
+  #         and returns the new value representing it, if not given dirty
+  #         chunks are destroyed and built again
+  #  @param set_chunk_visible optional function f(chunk_x,chunk_y,
+  #         built_chunk,visible) that shows or hides a built chunk, see
+  #         update_visibility
+
+  def __init__(self, level, chunk_size, radius, build_chunk, destroy_chunk, max_builds_per_update=1, rebuild_chunk=None, set_chunk_visible=None):
+    self.level = level
+    self.chunked = isinstance(level,ChunkedLevel)
+    self.chunk_size = level.get_chunk_size() if self.chunked else chunk_size
+    self.chunk_columns, self.chunk_rows = get_chunk_count(level.get_width(),level.get_height(),self.chunk_size)
+    self.radius = radius
+    self.build_chunk = build_chunk
+    self.destroy_chunk = destroy_chunk
+    self.rebuild_chunk = rebuild_chunk
+    self.set_chunk_visible = set_chunk_visible
+    self.max_builds_per_update = max_builds_per_update
+    self.built_chunks = {}            ##< (chunk x,chunk y) => what build_chunk returned
+    self.dirty_chunks = set()         ##< built chunks that have to be rebuilt
+    self.hidden_chunks = set()        ##< built chunks hidden by update_visibility
+    self.visibility_position = None   ##< position of the last update_visibility
+    self.pending_chunks = []          ##< chunks in range that are not built yet, nearest last
+    self.center_chunk = None          ##< chunk the position was in at the last update
+
+  def get_chunk_region(self, chunk_x, chunk_y):
+    return get_chunk_region(self.level.get_width(),self.level.get_height(),self.chunk_size,chunk_x,chunk_y)
+
+  ## Returns the distance of given (x,y) position from given chunk (0 if the
+  #  position is inside). Tile centers are at integer positions.
+
+  def get_chunk_distance(self, position, chunk):
+    x, y, width, height = self.get_chunk_region(chunk[0],chunk[1])
+    dx = max(x - 0.5 - position[0],0,position[0] - (x + width - 0.5))
+    dy = max(y - 0.5 - position[1],0,position[1] - (y + height - 0.5))
+    return sqrt(dx * dx + dy * dy)
+
+  ## Returns the list of chunks within given distance from the position.
+
+  def get_chunks_in_range(self, position, distance):
+    chunk_size = self.chunk_size
+    x1 = max(int((position[0] - distance + 0.5) // chunk_size),0)
+    y1 = max(int((position[1] - distance + 0.5) // chunk_size),0)
+    x2 = min(int((position[0] + distance + 0.5) // chunk_size),self.chunk_columns - 1)
+    y2 = min(int((position[1] + distance + 0.5) // chunk_size),self.chunk_rows - 1)
+
+    return [(chunk_x,chunk_y) for chunk_x in range(x1,x2 + 1) for chunk_y in range(y1,y2 + 1) if self.get_chunk_distance(position,(chunk_x,chunk_y)) <= distance]
+
+  def get_built_chunks(self):
+    return self.built_chunks
+
+  ## Returns the (chunk x,chunk y) of the chunk containing given tile.
+
+  def get_tile_chunk(self, x, y):
+    return (x // self.chunk_size,y // self.chunk_size)
+
+  ## Marks the chunk containing given tile for rebuilding (if it is built),
+  #  the chunk is rebuilt by the next updates without blocking the frame.
+  #
+  #  @param neighbours if True, the chunks of the neighbour tiles are marked
+  #         too, should be used for changes that affect the neighbour tiles
+  #         (walls and wall models, which give the neighbours wall faces
+  #         and shadows)
+
+  def mark_tile_dirty(self, x, y, neighbours=True):
+    positions = [(x,y)]
+
+    if neighbours:
+      positions += [(x + offset[0],y + offset[1]) for offset in NEIGHBOUR_OFFSETS]
+
+    for position in positions:
+      if self.level.is_inside(position[0],position[1]):
+        chunk = self.get_tile_chunk(position[0],position[1])
+
+        if chunk in self.built_chunks:
+          self.dirty_chunks.add(chunk)
+
+  def is_chunk_dirty(self, chunk_x, chunk_y):
+    return (chunk_x,chunk_y) in self.dirty_chunks
+
+  ## Updates the chunks for given (x,y) position, should be called every
+  #  frame. Chunks are only rebuilt after the position moves to another
+  #  chunk, built chunks are kept until they are more than one chunk size
+  #  out of range (so that moving back and forth doesn't rebuild them).
+  #
+  #  @param build_all if True, all chunks in range are built (and dirty
+  #         chunks rebuilt) now, otherwise at most max_builds_per_update of
+  #         them, dirty chunks go first (nearest first)
+
+  def update(self, position, build_all=False):
+    center_chunk = (int((position[0] + 0.5) // self.chunk_size),int((position[1] + 0.5) // self.chunk_size))
+
+    if center_chunk != self.center_chunk:
+      self.center_chunk = center_chunk
+
+      for chunk in list(self.built_chunks):
+        if self.get_chunk_distance(position,chunk) > self.radius + self.chunk_size:
+          self.destroy_chunk(chunk[0],chunk[1],self.built_chunks.pop(chunk))
+          self.dirty_chunks.discard(chunk)
+          self.hidden_chunks.discard(chunk)
+
+      if self.chunked:       # keep the data of the neighbours of built chunks (needed for walls on chunk borders)
+        for chunk in self.level.get_loaded_chunks():
+          if self.get_chunk_distance(position,chunk) > self.radius + 2 * self.chunk_size:
+            self.level.unload_chunk(chunk[0],chunk[1])
+
+      self.pending_chunks = [chunk for chunk in self.get_chunks_in_range(position,self.radius) if not chunk in self.built_chunks]
+      self.pending_chunks.sort(key=lambda chunk: - self.get_chunk_distance(position,chunk))
+
+    builds = 0
+
+    while len(self.dirty_chunks) > 0 and (build_all or builds < self.max_builds_per_update):
+      chunk = min(self.dirty_chunks,key=lambda chunk: self.get_chunk_distance(position,chunk))
+      self.dirty_chunks.remove(chunk)
+      region = self.get_chunk_region(chunk[0],chunk[1])
+
+      if self.rebuild_chunk != None:
+        self.built_chunks[chunk] = self.rebuild_chunk(chunk[0],chunk[1],region,self.built_chunks[chunk])
+      else:
+        self.destroy_chunk(chunk[0],chunk[1],self.built_chunks.pop(chunk))
+        self.built_chunks[chunk] = self.build_chunk(chunk[0],chunk[1],region)
+
+      if chunk in self.hidden_chunks:
+        self.set_chunk_visible(chunk[0],chunk[1],self.built_chunks[chunk],False)
+
+      builds += 1
+
+    while len(self.pending_chunks) > 0 and (build_all or builds < self.max_builds_per_update):
+      chunk = self.pending_chunks.pop()
+      self.built_chunks[chunk] = self.build_chunk(chunk[0],chunk[1],self.get_chunk_region(chunk[0],chunk[1]))
+      self.visibility_position = None       # the new chunk needs a visibility check
+      builds += 1
+
+  ## Hides the built chunks that are entirely farther than given distance
+  #  from given (x,y) position and shows those that got back in range (using
+  #  the set_chunk_visible function), can be called every frame as nothing
+  #  is done if the position didn't change (see reset_visibility). New
+  #  chunks are built visible.
+  #
+  #  @param visible_chunks optional set of chunks that can be seen from the
+  #         position (e.g. from a PVS), the other chunks are hidden too
+
+  def update_visibility(self, position, distance, visible_chunks=None):
+    if self.set_chunk_visible == None or tuple(position) == self.visibility_position:
+      return
+
+    self.visibility_position = tuple(position)
+
+    for chunk in self.built_chunks:
+      hidden = self.get_chunk_distance(position,chunk) > distance or (visible_chunks != None and not chunk in visible_chunks)
+
+      if hidden != (chunk in self.hidden_chunks):
+        if hidden:
+          self.hidden_chunks.add(chunk)
+        else:
+          self.hidden_chunks.remove(chunk)
+
+        self.set_chunk_visible(chunk[0],chunk[1],self.built_chunks[chunk],not hidden)
+
+  def get_hidden_chunks(self):
+    return self.hidden_chunks
+
+  ## Makes the next update_visibility check the chunks even if the position
+  #  didn't change (e.g. after the visible chunks changed).
+
+  def reset_visibility(self):
+    self.visibility_position = None
+
+  ## Destroys all built chunks.
+
+  def clear(self):
+    for chunk in list(self.built_chunks):
+      self.destroy_chunk(chunk[0],chunk[1],self.built_chunks.pop(chunk))
+
+    self.dirty_chunks = set()
+    self.hidden_chunks = set()
+    self.pending_chunks = []
+    self.center_chunk = None
+    self.visibility_position = None
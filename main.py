@@ -9,34 +9,75 @@ from direct.filter.CommonFilters import CommonFilters
 from pandac.PandaModules import ClockObject
 from panda3d.core import ConfigVariableBool, CullBinManager
 from direct.gui.OnscreenText import OnscreenText
-from direct.interval.LerpInterval import LerpPosInterval
 from direct.gui.DirectGui import *
 from direct.gui.OnscreenImage import OnscreenImage
 
+import os
+import sys
+import atexit
+
 from general import *
 from level import *
+from chunked_level import *
+from level_streaming import *
+from scene_builder import *
+from chunk_mesher import *
+from scene_cache import *
 from game_database import *
-
-class Game(ShowBase, DirectObject.DirectObject):
+from game_settings import *
+from pvs import *
+from picking import *
+from scripting import *
+from audio import *
+from tween import *
+from simulation import *
+from camera_path import *
+from frame_profiler import *
+
+## The game: the simulation (see simulation.Simulation) presented in
+#  a window, with the scene, camera, sounds, GUI and input.
+
+class Game(ShowBase, DirectObject.DirectObject, Simulation):
   DAYTIME_UPDATE_COUNTER = 32
-  JUMP_DURATION = 0.6                    ##< jump duration in seconds
   CAMERA_HEIGHT = 0.7
   JUMP_EXTRA_HEIGHT = 0.3
   FOG_RANGE = 5
-  USE_DISTANCE = 2                       ##< distance within which objects can be used by the player                          
-  MOVEMENT_SPEED = 1.8
-  RUN_SPEED = 4.2
+  CHUNK_SIZE = 4                         ##< default size of level chunks in tiles, the tuned size from the settings file (see chunk_benchmark.py) is used if present, chunked level files use their own chunk size
+  DEFAULT_LEVEL = "test_exterior.txt"
+  SCENE_CACHE_PATH = DEFAULT_SCENE_CACHE_PATH    ##< directory of baked level geometry (see scene_cache), None turns the cache off, the game only reads it (bake with python scene_cache.py)
+  USE_CHUNK_MESHER = True                ##< build level geometry with ChunkMesher instead of flattening nodes with SceneBuilder
+  POSITIONAL_SOUND_UPDATES = 8           ##< maximum number of positional sounds whose volume is updated in one frame, see audio.PositionalAudio
+  SOUND_VOICES = 4                       ##< how many times each sound effect can play at once, see audio.SoundBank
+  MAX_TICKS_PER_FRAME = 5                ##< when frames take longer than this many ticks, the simulation slows down
+  FRAME_RATE_LIMIT = 60                  ##< maximum frames per second, None for no limit
+  USE_COLLISION_PICKER = False           ##< pick the focused object with collision boxes (picking.CollisionPicker) instead of walking the tile grid (picking.GridPicker)
+  PICKING_OCCLUDERS = True               ##< with the collision picker, add coarse wall boxes to the chunks so that objects aren't picked through walls
+  CAMERA_PATH_FILE = None                ##< file to record the camera path into (for render_benchmark.py -p, see camera_path), None doesn't record
+  PROFILER_OVERLAY_UPDATE = 30           ##< the profiler overlay is updated every this many frames
+  PROFILER_OVERLAY_LINES = 12            ##< maximum number of measured names in the profiler overlay
   
-  PROFILING = False                      ##< turn on for Panda3D profiling
-  
-  def __init__(self):
+  ## Creates the game with given level file (in any format, see
+  #  chunked_level.load_level).
+  #
+  #  @param profiler FrameProfiler measuring the frames (see
+  #         frame_profiler), None turns the measuring off
+  #  @param pstats whether to connect to the PStats server for Panda3D
+  #         profiling (the mouse is then not captured)
+
+  def __init__(self, level_filename=DEFAULT_LEVEL, profiler=None, pstats=False):
+    load_settings()
+    self.chunk_size = get_level_chunk_size(Game.CHUNK_SIZE)
+
     vsync = ConfigVariableBool("sync-video")
     vsync.setValue(False)
     
     ShowBase.__init__(self)
+    Simulation.__init__(self,level_filename)
+    self.set_profiler(profiler)
+    self.pstats = pstats
 
-    if Game.PROFILING:
-      PStatClient.connect()              # <---- uncomment for profiling
+    if pstats:
+      PStatClient.connect()
 
     self.resolution = (1024,768)
 
@@ -47,48 +88,40 @@ class Game(ShowBase, DirectObject.DirectObject):
 
     base.win.requestProperties(self.props)
     
-    FPS = 60
     globalClock = ClockObject.getGlobalClock()
-    globalClock.setMode(ClockObject.MLimited)
-    globalClock.setFrameRate(FPS)
-
-    self.daytime = 0.0                                              ##< time of day in range <0,1>
-    self.update_daytime_counter = Game.DAYTIME_UPDATE_COUNTER       ##< counts frames to update daytime effects to increase FPS
-    self.collision_mask = None                                      ##< current level collision mask (2D list of bool)
 
-    self.player_position = [0.0,0.0]                                ##< player position
-    self.player_rotation = 0.0                                      ##< player rotation in degrees
+    if Game.FRAME_RATE_LIMIT != None:
+      globalClock.setMode(ClockObject.MLimited)
+      globalClock.setFrameRate(Game.FRAME_RATE_LIMIT)
 
-    self.time_of_jump = - 0.100                                     ##< time of last player's jump
-    self.in_air = False                                             ##< if the player is in air (jumping)
-    self.use_pressed = False                                        ##< whether the use key way pressed
+    self.update_daytime_counter = Game.DAYTIME_UPDATE_COUNTER       ##< counts frames to update daytime effects to increase FPS
+    self.simulation_accumulator = 0.0                               ##< real time not simulated yet (less than SIMULATION_STEP after a frame)
 
     self.node_object_mapping = {}                                   ##< contains mapping of some node names to their corresponding objects
-    self.focused_prop = None                                        ##< references a LevelProp that the player is currently looking at
-    self.focused_item = None                                        ##< references a LevelItem that the player is currently looking at
+    self.sound_bank = SoundBank(self.loader,Game.SOUND_VOICES)     ##< preloaded sound effects
+    self.sound_scanned_scripts = set()                              ##< scripts whose sounds have been preloaded
+    self.camera_path_recorder = CameraPathRecorder(Game.CAMERA_PATH_FILE) if Game.CAMERA_PATH_FILE != None else None
 
     base.setFrameRateMeter(True)
 
-    self.head_bob_phase = 0.0                                       ##< head bob phase in <0,1> range
-
     self.filters = CommonFilters(base.win,base.cam)   
     self.filters.setBloom(size="small",desat=1)
-    
-    self.gui_active = False                                         ##< Says if the player has a GUI windows open, if True, movement will be disabled and mouse will be shown
 
     # initialise input handling:
 
-    self.camera_time_before = 0
     self.camera_rotation_speed = 0.3
 
-    if not Game.PROFILING:
+    if not pstats:
       base.disableMouse()
 
-    self.taskMgr.add(self.camera_task,"camera_task")
-    self.taskMgr.add(self.mouse_position_task,"mouse_position_task")
-    self.taskMgr.add(self.time_task,"time_task")
+    self.add_task(self.camera_task,"camera_task")
+    self.add_task(self.mouse_position_task,"mouse_position_task")
+    self.add_task(self.time_task,"time_task")
+    self.add_task(self.audio_task,"audio_task")
 
-    self.input_state = {}   # contains state of mouse and keyboard
+    if profiler != None:
+      self.taskMgr.add(self.profiler_task,"profiler_task",sort=49)   # ends the frame before it's rendered (igLoop has sort 50)
+      self.accept("f3",self.toggle_profiler_overlay)
 
     self.input_state["mx"] = 0
     self.input_state["my"] = 0
@@ -99,23 +132,44 @@ class Game(ShowBase, DirectObject.DirectObject):
     base.mouseWatcherNode.set_modifier_buttons(ModifierButtons())
     base.buttonThrowers[0].node().set_modifier_buttons(ModifierButtons())
 
-    for key in ["w","s","a","d","W","S","A","D","q","e","i","shift","space","mouse1","mouse3"]:
-      self.input_state[key] = False
+    for key in Game.INPUT_KEYS:
       self.accept(key,self.handle_input,[key,True])
       self.accept(key + "-up",self.handle_input,[key,False])
 
-    self.level = Level.load_from_file("test_exterior.txt")         ##< contains the level data
-    
-    self.database = GameDatabase.load_from_file(RESOURCE_PATH + "/" + self.level.get_database_name())
-    
-    self.collision_mask = self.level.get_collision_mask()
     self.setup_environment_scene(self.level)
     self.setup_gui()
-    
-  def reenable_usage_task(self, prop, task):
-    prop.disable_usage = False
-    return task.done
-    
+
+  ## The scripts see the globals of this module (Panda3D, the game modules
+  #  and constants) as they did when run with execfile from here.
+
+  def get_script_globals(self):
+    return globals()
+
+  ## Adds a task that is measured by the profiler (if there is one).
+
+  def add_task(self, function, name):
+    self.taskMgr.add(self.profiler.wrap(name,function) if self.profiler != None else function,name)
+
+  ## Ends the profiled frame and updates the profiler overlay.
+
+  def profiler_task(self, task):
+    self.profiler.end_frame()
+
+    if self.profiler.frames % Game.PROFILER_OVERLAY_UPDATE == 0 and not self.profiler_text.isHidden():
+      self.profiler_text.setText(self.profiler.format_text(Game.PROFILER_OVERLAY_LINES))
+
+    return task.cont
+
+  def toggle_profiler_overlay(self):
+    if self.profiler_text.isHidden():
+      self.profiler_text.show()
+    else:
+      self.profiler_text.hide()
+
+  def audio_task(self, task):
+    self.positional_audio.update()
+    return task.cont
+
   def handle_input(self,input_name,input_value):
     self.input_state[input_name] = input_value
     
@@ -150,18 +204,21 @@ class Game(ShowBase, DirectObject.DirectObject):
 
     return task.cont
 
-  ## Updates the daytime (the variable and once every DAYTIME_UPDATE_COUNTER
-  #  updates the scene accoordingly).
+  ## Once every DAYTIME_UPDATE_COUNTER frames updates the scene according
+  #  to the daytime (which the simulation advances).
 
   def time_task(self, task):
-    self.daytime = (task.time / 100) % 1
-    
     if self.update_daytime_counter > 0:
       self.update_daytime_counter -= 1
       return task.cont
     else:
       self.update_daytime_counter = Game.DAYTIME_UPDATE_COUNTER
-      self.set_daytime(self.daytime)
+
+      if self.profiler != None:
+        self.profiler.call("daytime update",self.set_daytime,self.daytime)
+      else:
+        self.set_daytime(self.daytime)
+
       return task.cont
   
   ## Returns AnimatedTextureModel object with placeholder model, for
@@ -172,207 +229,86 @@ class Game(ShowBase, DirectObject.DirectObject):
     result.model_name = "placeholder.obj"
     return result
   
-  ## Computes a new position of object in movement, respecting the
-  #  collisions with level geometry.
-  #
-  #  @param position object position ((x,y) float tuple)
-  #  @param direction object orientation in degrees, starting pointing right, going CCW
-  #  @param distance distance to be travelled
-  #  @return new position as a tuple
-  
-  def move_with_collisions(self, position, direction, distance):    
-    padding_size = 0.2
-    bias = 0.01
+  ## Returns the time the rendered frame shows: the rendered state is
+  #  interpolated between the last two simulation ticks.
+
+  def get_render_time(self):
+    return self.simulation_time - Game.SIMULATION_STEP + self.simulation_accumulator
+
+  ## Runs the simulation ticks due in this frame (at most
+  #  MAX_TICKS_PER_FRAME, the simulation slows down rather than falling
+  #  behind more and more) and places the camera between the last two
+  #  simulation states.
 
-    def position_to_tile(float_position):
-      return (int(round(float_position[0])),int(round(float_position[1])))
-    
-    def tile_is_walkable(tile_position):
-      try:
-        return self.collision_mask[tile_position[0]][tile_position[1]]
-      except Exception:
-        return False
-    
-    def position_collides(float_position):
-      # Checks if position collides taking padding into account. Returns list of
-      # collided paddings:
-      #      0
-      #    1   3    
-      #      2
-      # Empty list is returned for no collision.
-      
-      tile_position = position_to_tile(float_position)
-      
-      result = []
-      
-      if not tile_is_walkable(tile_position):
-        return [0,1,2,3]
-      
-      position_within_tile = (float_position[0] - tile_position[0] + 0.5,float_position[1] - tile_position[1] + 0.5)
-      
-      if position_within_tile[0] < padding_size and not tile_is_walkable((tile_position[0] - 1,tile_position[1])):
-        result.append(1)
-      elif position_within_tile[0] > 1.0 - padding_size and not tile_is_walkable((tile_position[0] + 1,tile_position[1])):
-        result.append(3)
-      
-      elif position_within_tile[1] < padding_size and not tile_is_walkable((tile_position[0],tile_position[1] - 1)):
-        result.append(0)
-      elif position_within_tile[1] > 1.0 - padding_size and not tile_is_walkable((tile_position[0],tile_position[1] + 1)):
-        result.append(2)
-      
-      return result
-    
-    new_position = [position[0],position[1]]
-    
-    direction = direction % 360
-    
-    new_position[0] += cos(radians(direction)) * distance
-    new_position[1] -= sin(radians(direction)) * distance
-    
-    collisions = position_collides(new_position)
-    
-    if len(collisions) == 0:   # no collision for new position => OK
-      return new_position
-    
-    current_tile = position_to_tile(position)
-    
-    if 3 in collisions:
-      new_position[0] = current_tile[0] + 0.5 - padding_size - bias
-    elif 1 in collisions:
-      new_position[0] = current_tile[0] - 0.5 + padding_size + bias
-    
-    collisions = position_collides(new_position)
-    
-    if len(collisions) == 0:   # no collision for new position => OK
-      return new_position
-    
-    if 0 in collisions:
-      new_position[1] = current_tile[1] - 0.5 + padding_size + bias
-    elif 2 in collisions:
-      new_position[1] = current_tile[1] + 0.5 - padding_size - bias
-    
-    if len(position_collides(new_position)) == 0:
-      return new_position
-    
-    return position
-  
   def camera_task(self, task):
     self.image_cursor.setPos((2 * float(self.input_state["mx"]) / self.resolution[0],0.1,float(2 * self.input_state["my"]) / self.resolution[1]))
-    
-    if self.gui_active:
-      return task.cont
-    
-    current_position = self.camera.getPos()
-   
-    camera_forward = self.camera.getRelativeVector(self.render,VBase3(0,1,0))
-    camera_right = self.camera.getRelativeVector(self.render,VBase3(1,0,0))
-
-    new_position = [self.player_position[0],self.player_position[1]]
-    time_difference = task.time - self.camera_time_before    
-    self.camera_time_before = task.time
-    distance =  (Game.RUN_SPEED if self.input_state["shift"] else Game.MOVEMENT_SPEED) * time_difference
-    self.in_air = task.time <= self.time_of_jump + Game.JUMP_DURATION
-
-    reset_head_bob = True
-
-    if self.input_state["w"]:
-      self.player_position = self.move_with_collisions(self.player_position,self.player_rotation,distance)
-      reset_head_bob = False
- 
-    if self.input_state["s"]:
-      self.player_position = self.move_with_collisions(self.player_position,self.player_rotation + 180,distance)
-      reset_head_bob = False
-
-    if self.input_state["a"]:
-      self.player_position = self.move_with_collisions(self.player_position,self.player_rotation + 90,distance)
-      reset_head_bob = False
-
-    if self.input_state["d"]:
-      self.player_position = self.move_with_collisions(self.player_position,self.player_rotation + 270,distance)
-      reset_head_bob = False
-    
-    self.head_bob_phase = 0.0 if (reset_head_bob and self.head_bob_phase < 0.2) else (self.head_bob_phase + time_difference * 2) % 1.0
-    head_bob_offset = sin(self.head_bob_phase * pi) * 0.02
-    
-    if not self.in_air and self.input_state["e"]:
-      self.time_of_jump = task.time
-    
-    if self.input_state["space"]:
-      if not self.use_pressed:
-        
-        if self.focused_prop != None and not self.focused_prop.disable_usage:
-          self.run_scripts(self.focused_prop.scripts_use,event_type="use",caller=self.focused_prop)
-          
-        self.use_pressed = True
-    else:
-      self.use_pressed = False
-    
-    current_rotation = self.camera.getHpr()
-    current_position = self.camera.getPos()
+
+    if not self.gui_active:
+      window_center = (base.win.getXSize() / 2, base.win.getYSize() / 2)
       
-    self.player_rotation = current_rotation[0] % 360
-    new_rotation = [current_rotation.getX(),current_rotation.getY(),current_rotation.getZ()] 
-    window_center = (base.win.getXSize() / 2, base.win.getYSize() / 2)
-    
-    if base.mouseWatcherNode.hasMouse() and not Game.PROFILING:
-      base.win.movePointer(0, window_center[0], window_center[1])
-      mouse_difference = (self.input_state["mx"],self.input_state["my"])
-      new_rotation[0] -= mouse_difference[0] * self.camera_rotation_speed
-      new_rotation[1] += mouse_difference[1] * self.camera_rotation_speed  
-      self.camera.setHpr(new_rotation[0],max(min(new_rotation[1],90),-90),new_rotation[2])
+      if base.mouseWatcherNode.hasMouse() and not self.pstats:
+        base.win.movePointer(0, window_center[0], window_center[1])
+        mouse_difference = (self.input_state["mx"],self.input_state["my"])
+        self.player_rotation = (self.player_rotation - mouse_difference[0] * self.camera_rotation_speed) % 360
+        self.player_pitch = max(min(self.player_pitch + mouse_difference[1] * self.camera_rotation_speed,90),-90)
+
+    self.camera.setHpr(self.player_rotation,self.player_pitch,0.0)
 
+    self.simulation_accumulator += globalClock.getDt()
+    ticks = 0
+
+    while self.simulation_accumulator >= Game.SIMULATION_STEP and ticks < Game.MAX_TICKS_PER_FRAME:
+      self.simulation_tick()
+      self.simulation_accumulator -= Game.SIMULATION_STEP
+      ticks += 1
+
+    self.simulation_accumulator = min(self.simulation_accumulator,Game.SIMULATION_STEP)   # drop the time of the ticks that didn't fit
+
+    # interpolate between the last two ticks:
+
+    alpha = self.simulation_accumulator / Game.SIMULATION_STEP
+    render_position = [self.previous_player_position[i] + (self.player_position[i] - self.previous_player_position[i]) * alpha for i in (0,1)]
+    render_time = self.get_render_time()
     camera_height = Game.CAMERA_HEIGHT
-    
-    if self.in_air:
-      jump_phase = (task.time - self.time_of_jump) / Game.JUMP_DURATION
+
+    if render_time <= self.time_of_jump + Game.JUMP_DURATION:
+      jump_phase = max(render_time - self.time_of_jump,0.0) / Game.JUMP_DURATION
       camera_height += Game.JUMP_EXTRA_HEIGHT * (1 - (jump_phase * 2 - 1) ** 2)
       
-    camera_height += head_bob_offset
+    camera_height += self.previous_head_bob_offset + (self.head_bob_offset - self.previous_head_bob_offset) * alpha
 
-    self.camera.setPos(self.player_position[1],self.player_position[0],camera_height)
+    self.camera.setPos(render_position[1],render_position[0],camera_height)
 
-    # handle ray picking:
+    if self.camera_path_recorder != None:
+      self.camera_path_recorder.record((render_position[0],render_position[1],camera_height,self.player_rotation,self.player_pitch))
 
-    self.picker_ray.setFromLens(base.camNode,0,0)
- 
-    self.collission_traverser.traverse(self.level_node_path)
-    self.focused_prop = None
-    self.focused_item = None
-    
-    caption = ""
-    
-    if self.collission_handler.getNumEntries() > 0:
-      self.collission_handler.sortEntries()
-      picked_object = self.collission_handler.getEntry(0).getIntoNodePath()
-      picked_node = picked_object.getNodes()[2]
-      
-      distance = self.camera.getDistance(picked_object)
-      
-      if distance > Game.USE_DISTANCE:
-        picked_object = None
-        picked_node = None
-      
-      try:
-        picked_name = picked_node.getName()
-        
-        if picked_name[0] == "p":    # prop
-          self.focused_prop = self.node_object_mapping[picked_name]
-          caption = self.focused_prop.caption
-        elif picked_name[0] == "i":  # item
-          self.focused_item = self.node_object_mapping[picked_name]
-          caption = self.database.get_item_types()[self.focused_item.db_id].name
-          
-      except Exception:
-        pass
-      
-    if caption != self.description_text.getText():        
-      self.description_text.setText(caption)
+    self.chunk_streamer.update(self.player_position)
+    visible_chunks = None
+
+    if self.pvs != None:
+      visible_chunks = self.pvs.get_visible_chunks(self.chunk_streamer.get_tile_chunk(int(self.player_position[0] + 0.5),int(self.player_position[1] + 0.5)))
+
+    self.chunk_streamer.update_visibility(self.player_position,self.level.get_fog_distance() + Game.FOG_RANGE,visible_chunks)   # hide the chunks hidden by the fog or walls (saves culling them)
+
+    # pick the object the player looks at (only needed when the camera or the objects changed):
+
+    camera_state = (self.camera.getPos(),self.camera.getHpr())
+
+    if camera_state != self.picked_camera_state:
+      self.picked_camera_state = camera_state
+
+      if self.profiler != None:
+        self.profiler.call("picking",self.update_focus)
+      else:
+        self.update_focus()
       
     return task.cont
 
   ## Sets the time of the day as a value in interval <0,1> to affect the scene (lighting, skybox texture, ...).
 
   def set_daytime(self, daytime):    
+    Simulation.set_daytime(self,daytime)
+
     # TODO: OPTIMISE THIS as it will be run frequently
 
     try:
@@ -443,95 +379,17 @@ class Game(ShowBase, DirectObject.DirectObject):
     self.image_cursor.setTransparency(TransparencyAttrib.MAlpha)
     self.image_cursor.hide()
 
+    if self.profiler != None:
+      self.profiler_text = OnscreenText(text="",parent=base.a2dTopLeft,pos=(0.05,-0.1),scale=0.04,align=TextNode.ALeft,fg=(1,1,1,1),shadow=(0,0,0,0.5),mayChange=True)
+
   ## Sets up the 3D scene (including camera, lights etc.) provided on provided level layout.
 
   def setup_environment_scene(self, level):
-    models = {}      # model cache
-    textures = {}    # texture cache
-    self.overlay_texture_stage = TextureStage("ts")
-    
-    def load_model(model_name):                # loads model into 'models' cache (only if it hasn't been loaded laready)
-      if not model_name in models:
-        models[model_name] = self.loader.loadModel(RESOURCE_PATH + model_name)
-    
-    def load_texture(texture_name):            # loads texture into 'textures' cache (only if it hasn't been loaded laready)
-      if not texture_name in textures:
-        textures[texture_name] = self.loader.loadTexture(RESOURCE_PATH + texture_name)
-        textures[texture_name].setMinfilter(Texture.FTLinearMipmapLinear)  
-        textures[texture_name].setWrapU(Texture.WM_clamp)
-        textures[texture_name].setWrapV(Texture.WM_clamp)
-        
-    def make_npc_node(name, texture_name):
-      result = Actor(RESOURCE_PATH + name + ".egg")
-      
-      load_texture(texture_name)
-      result.setTexture(textures[texture_name])
-      
-      return result
-        
-    def make_node(animated_texture_model,name="node"):     # makes a node out of AnimatedTextureModel object, handles loading models and textures and caches
-      load_model(animated_texture_model.model_name)
-      
-      model = models[animated_texture_model.model_name]
-      
-      textures_for_node = []
-      
-      for texture_name in animated_texture_model.texture_names:
-        if len(texture_name) != 0:
-          load_texture(texture_name)
-          textures_for_node.append(textures[texture_name])
-      
-      framerate = animated_texture_model.framerate
-      
-      if len(textures_for_node) in [0,1]:
-        node = PandaNode(name)
-        node_path = NodePath(node)
-        result = NodePath(node_path)
-        model.instanceTo(node_path)
-        
-        if len(textures_for_node) == 1:
-          node_path.setTexture(textures_for_node[0])
-        
-        node_path.set_bin("opaque",1)
-        
-        return node
-      else:  # node with animated texture
-        sequence_node = SequenceNode(name)
-        sequence_node.setFrameRate(framerate)
-        node_path = NodePath(sequence_node)
-      
-        for texture in textures_for_node:
-          helper_node = node_path.attachNewNode("frame")
-          model.instanceTo(helper_node)
-          helper_node.setTexture(texture)
-        
-        node_path.set_bin("opaque",1)
-        
-        sequence_node.loop(True)
-      
-        return sequence_node
-
-    def add_overlay_texture(node_path,texture_name):
-      load_texture(texture_name)
-      
-      new_texture = textures[texture_name]
-      node_path.setTexture(self.overlay_texture_stage,new_texture)
+    self.scene_builder = SceneBuilder(self.loader)
+    self.tile_builder = ChunkMesher(self.scene_builder) if Game.USE_CHUNK_MESHER else self.scene_builder
+    self.scene_cache = SceneCache(self.tile_builder,Game.SCENE_CACHE_PATH,write_missing=False) if Game.SCENE_CACHE_PATH != None else None   # chunks not baked are built, nothing is written during the game
+    self.overlay_texture_stage = self.scene_builder.overlay_texture_stage
 
-    def tile_is_shadowed(x,y):
-      if y > 0 and not level.get_tile(x,y - 1).is_empty() and level.get_tile(x,y - 1).wall:
-        return True
-      
-      if x < level.get_width() - 1 and not level.get_tile(x + 1,y).is_empty() and level.get_tile(x + 1,y).wall:
-        return True
-      
-      if y < level.get_height() - 1 and not level.get_tile(x,y + 1).is_empty() and level.get_tile(x,y + 1).wall:
-        return True
-      
-      if x > 0 and not level.get_tile(x - 1,y).is_empty() and level.get_tile(x - 1,y).wall:
-        return True
-      
-      return False
-     
     cull_bin_manager = CullBinManager.getGlobalPtr()
     cull_bin_manager.setBinType(name="opaque",type=cull_bin_manager.BT_state_sorted)
       
@@ -549,95 +407,23 @@ class Game(ShowBase, DirectObject.DirectObject):
     self.level_node_path = NodePath("level")
     self.level_node_path.reparentTo(self.render)
 
-    # make helper nodes for dividing the level into subnodes for optimization:
-    
-    subdivision = 4
-    level_subnodes = [[self.level_node_path.attachNewNode(PandaNode("sublevel " + str(x) + " " + str(y))) for x in range(int(ceil(level.get_width() / float(subdivision))))] for y in range(int(ceil(level.get_height() / float(subdivision))))]
-    
-    # make the level:
-
-    for j in range(level.get_height()):
-      for i in range(level.get_width()):
-        tile = level.get_tile(i,j)
-        node_parent = level_subnodes[i / subdivision][j / subdivision]
-        coordinate_string = str(i) + " " + str(j)
-        
-        if not tile.is_empty():
-          if not tile.wall: # floor tile
-            tile_node_path = node_parent.attachNewNode(make_node(level.get_tile(i,j).floor_model,"tile " + coordinate_string))
-            tile_node_path.setPos(j,i,0)
-            tile_node_path.setHpr(90,90,level.get_tile(i,j).floor_orientation * 90)
-            
-            # add wall shadows to the tile:
-            
-            if tile_is_shadowed(i,j):
-              add_overlay_texture(tile_node_path,"tile_shadow.png")
-            
-          else:             # wall
-            offsets = [[0,0.5], [0.5,0], [-0.5,0], [0,-0.5]] # down, right, left, up
-            rotations = [-90, 0, 180, 90]
-            neighbours = [[0,1], [1,0], [-1,0], [0,-1]]
-
-            for k in range(4):  # 4 walls (one for each direction)
-              # check if the wall needs to be created:
-
-              if level.is_wall(i + neighbours[k][0],j + neighbours[k][1]):
-                continue
-
-              tile_node_path = node_parent.attachNewNode(make_node(level.get_tile(i,j).wall_model,"wall " + coordinate_string))
-              tile_node_path.setPos(j + offsets[k][1],i + offsets[k][0],0)
-              tile_node_path.setHpr(90,90,rotations[k])
-
-        if level.get_tile(i,j).ceiling:
-          tile_node_path = node_parent.attachNewNode(make_node(level.get_tile(i,j).ceiling_model,"ceiling " + coordinate_string))
-          tile_node_path.setPos(j,i,level.get_tile(i,j).ceiling_height)
-          tile_node_path.setHpr(90,90,level.get_tile(i,j).floor_orientation * 90)
-
-    # optimisation: group the sublevel nodes together:
-
-    for j in range(len(level_subnodes)):
-      for i in range(len(level_subnodes[0])):
-        level_subnodes[i][j].flattenStrong()
-        
-    # add props to the level:
-
-    prop_counter = 0
-
-    for prop in level.get_props():
-      prop_node_path = self.level_node_path.attachNewNode(make_node(prop.model))
-      name = "p" + str(prop_counter)              # 'p' for prop
-      prop_node_path.getNodes()[0].setName(name)
-      self.node_object_mapping[name] = prop
-      prop.node_path = prop_node_path             # add new property to the prop: node path reference (for later dynamic modifications)
-      prop.disable_usage = False                  # helper property
-      
-      prop_counter += 1
-      
-      prop_node_path.setPos(prop.position[1] - 0.5,prop.position[0] - 0.5,0)
-      prop_node_path.setHpr(90,90,prop.orientation)
+    # the level is built by chunks around the player (see build_chunk):
+
+    self.chunk_object_names = {}                                    # (chunk x,chunk y) => names of the chunk's prop and item nodes
+    self.object_counter = 0
+    self.chunk_streamer = ChunkStreamer(level,self.chunk_size,level.get_fog_distance() + Game.FOG_RANGE,self.build_chunk,self.destroy_chunk,rebuild_chunk=self.rebuild_chunk,set_chunk_visible=self.set_chunk_visible)
+    self.pvs = load_level_pvs(self.level_filename,level,self.chunk_streamer.chunk_size)   # potentially visible sets of chunks, made by pvs.py
+    level.add_tile_listener(self.on_tile_change)     # tile changes (e.g. by scripts) rebuild the chunks
+    level.add_object_listener(self.on_object_move)   # objects moved to other chunks move to their nodes
       
     skybox_texture_names = level.get_skybox_textures()
     
     self.level_node_path.setFog(fog)
+
+    self.positional_audio = PositionalAudio(self.sound_bank,self.camera,self.render,level.get_fog_distance() + Game.FOG_RANGE,Game.POSITIONAL_SOUND_UPDATES)   # sounds in the fog aren't heard
     self.level_node_path.setTransparency(TransparencyAttrib.MBinary,1)
     self.level_node_path.set_bin("opaque",1)
     
-    # add items to the scene:
-    
-    item_counter = 0
-    
-    for item in level.get_items():
-      item_node_path = self.level_node_path.attachNewNode(make_node(self.database.get_item_types()[item.db_id].model))
-      name = "i" + str(item_counter)              # 'i' for item
-      self.node_object_mapping[name] = item
-      item_node_path.getNodes()[0].setName(name)
-      item.node_path = item_node_path
-      
-      item_counter += 1
-      
-      item_node_path.setPos(item.position[1] - 0.5,item.position[0] - 0.5,0)
-      item_node_path.setHpr(90,90,item.orientation)
-    
     # setup the skybox (if there are any textures, otherwise don't create it at all)
     
     if len(skybox_texture_names) > 0:
@@ -669,8 +455,7 @@ class Game(ShowBase, DirectObject.DirectObject):
       self.skybox_textures = []
     
       for skybox_texture_name in skybox_texture_names:
-        load_texture(skybox_texture_name)
-        self.skybox_textures.append(textures[skybox_texture_name])
+        self.skybox_textures.append(self.scene_builder.load_texture(skybox_texture_name))
 
     self.level_node_path.reparentTo(self.render)
 
@@ -706,144 +491,303 @@ class Game(ShowBase, DirectObject.DirectObject):
     self.render.setShaderAuto()
     self.set_daytime(0.5)
     
-    # setup ray picker:
-    
-    self.collission_traverser = CollisionTraverser()
-    self.collission_handler = CollisionHandlerQueue()
-    picker_node = CollisionNode('ray')
-    picker_node_path = self.camera.attachNewNode(picker_node)
-    picker_node.setFromCollideMask(GeomNode.getDefaultCollideMask())
-    self.picker_ray = CollisionRay()
-    picker_node.addSolid(self.picker_ray)
-    self.collission_traverser.addCollider(picker_node_path,self.collission_handler)
-
-    # run the init scripts:
- 
-    for prop in level.get_props():
-      try:
-        self.run_scripts(prop.scripts_load,event_type="load",caller=prop)
-      except Exception:
-        pass
-       
-    self.rat = make_npc_node("rat","rat.png")
+    # setup the picker of the objects the player looks at:
+
+    if Game.USE_COLLISION_PICKER:
+      self.picker = CollisionPicker(self.render,Game.PICKING_OCCLUDERS)
+    else:
+      self.picker = GridPicker(level,self.get_object_box)
+
+    self.picked_camera_state = None                                 # camera (position,rotation) of the last picking, None forces picking
+
+    # build the chunks around the player (this also runs the init scripts):
+
+    self.chunk_streamer.update(self.player_position,True)
+
+    self.rat = self.scene_builder.make_npc_node("rat","rat.png")
     self.level_node_path.attachNewNode(self.rat.getNode(0))
     self.rat.loop("idle",True)
-     
-  ## Runs given game script in the current context.
-  #  @param filename name of the script (including extension but without the resource path)
-  #  @param caller object that caused the script to be run
-  #  @param event_type event type as a string
-  #  @param params optional additional parameters
-
-  def run_script(self, filename, caller=None, event_type=None, params=None):
-    # set the local variables for the script:
-    
-    game = self        
-    parameters = params
-    source = caller
-    event_type = event_type
-    
-    try:
-      execfile(RESOURCE_PATH + filename)
-    except Exception as e:
-      print("error running script '" + filename + "':")
-      print(e)
-   
-  ## Runs all scripts in a list.
-   
-  def run_scripts(self, filenames, caller=None, event_type=None, params=None):
-    for filename in filenames:
-      self.run_script(filename,caller,event_type,params)
-  
-  # ==================================== SCRIP API ====================================
-  # The following functions are intended to be called from the game scripts, but can also
-  # be called from the core source as well. Core functions however should never be called
-  # from the scripts. The following local variables are available withing the script:
-  #
-  # game - reference to this Game object (self)
-  # source - object that caused the script to be called
-  # event_type - type of the event that caused the script to be called as a string
-  # parameters - additional parameters
-  
-  def script_print(self, what):
-    print(what)
-    
-  ## Gets the player position.
-  #  @return player position as (x,y) tuple, note that this differs from
-  #    the internal player position by half a square to match other
-  #    positions
-    
-  def script_get_player_position(self):
-    position = self.player_position    
-    return (position[0] + 0.5,position[1] + 0.5)
 
-  def script_set_player_position(self, new_x, new_y):
-    self.player_position = (new_x,new_y)
+  ## Builds the scene node of a level chunk (tiles, props and items) for
+  #  the chunk streamer. Init scripts of props are run when the props get
+  #  to the scene for the first time.
 
-  ## Return a tuple (horizontal_rotation, vertical_rotation) in angles.
+  def build_chunk(self, chunk_x, chunk_y, region):
+    if self.scene_cache != None:
+      chunk_node_path = self.scene_cache.get_tiles(self.level,region)
+    else:
+      chunk_node_path = self.tile_builder.build_tiles(self.level,region)
 
-  def script_get_player_rotation(self):
-    rotation = self.camera.getHpr()
-    return (rotation[0],rotation[1])
+    chunk_node_path.reparentTo(self.level_node_path)
+    self.add_picking_occluders(chunk_node_path,region)
+    names = []
+    props = self.level.get_objects_in_region(region,items=False)
 
-  ## Sets the player rotation.
+    for what in props + self.level.get_objects_in_region(region,props=False):
+      names.append(self.add_object_node(what,chunk_node_path))
 
-  def script_set_player_rotation(self, new_rotation_horizontal, new_rotation_vertical):
-    self.camera.setHpr(new_rotation_horizontal,new_rotation_vertical,0.0)
+    self.chunk_object_names[(chunk_x,chunk_y)] = names
+    self.invalidate_focus()
 
-  def script_get_level_size(self):
-    return (self.level.get_width(),self.level.get_height())
+    # run the init scripts (of the props new in the scene):
 
-  def script_get_daytime(self):
-    return self.daytime
-  
-  def script_set_daytime(self, new_daytime):
-    self.set_daytime(new_daytime)
-    
-  ## Gets position of given object, which can be prop, NPC etc.
-  #  For player position see script_get_player_position.
-  #  @return (x,y) float tuple
-    
-  def script_get_position(self, what):
-    return what.position
-    
-  ## Gets the data of the object as a string.
-    
-  def script_get_data(self, what):
-    return what.data
-    
-  def script_set_position(self, what, new_x, new_y):
-    what.position = (new_x,new_y)
-    # change the corresponding node path position:
-    what.node_path.setPos(new_y - 0.5,new_x - 0.5,0)
-    
-  ## Gradually moves given game object to a new position. 
-   
-  def script_move(self, what, new_x, new_y, duration):
-    what.position = (new_x,new_y)
-    what.disable_usage = True        # disable usage for the time of the movement
-    move_interval = LerpPosInterval(what.node_path,duration,(new_y - 0.5,new_x - 0.5,0))
-    taskMgr.doMethodLater(duration,self.reenable_usage_task,"reenable_task", extraArgs=[what],appendTask=True)  # this will re-enable the usage
-    move_interval.start()
-    
-  def script_get_tile_steppable(self, x, y):
-    try:
-      return self.collision_mask[x][y]
-    except Exception:
-      return False
-    
-  def script_set_tile_steppable(self, x, y, steppable):
-    try:
-      self.level.get_tile(x,y).steppable = steppable
-      # get the new collision mask:
-      self.collision_mask = self.level.get_collision_mask()
-    except Exception:
-      pass
-    
-  def script_play_sound(self, filename, volume=1.0):
-    sound = base.loader.loadSfx(RESOURCE_PATH + filename)
-    sound.setVolume(volume)
-    sound.play()
-    
-app = Game()
-app.run()
\ No newline at end of file
+    self.preload_script_sounds([prop for prop in props if not hasattr(prop,"disable_usage")])
+    self.activate_props(props)
+
+    return chunk_node_path
+
+  ## Adds the scene node of a prop or item under given chunk node, returns
+  #  the name of the node (see node_object_mapping).
+
+  def add_object_node(self, what, chunk_node_path):
+    is_prop = isinstance(what,LevelProp)
+    model = self.get_object_model(what)
+    node_path = chunk_node_path.attachNewNode(self.scene_builder.make_node(model))
+    name = ("p" if is_prop else "i") + str(self.object_counter)   # 'p' for prop, 'i' for item
+    node_path.getNodes()[0].setName(name)
+    self.node_object_mapping[name] = what
+    what.node_path = node_path                 # add new property to the object: node path reference (for later dynamic modifications)
+
+    self.object_counter += 1
+
+    node_path.setPos(what.position[1] - 0.5,what.position[0] - 0.5,0)
+    node_path.setHpr(90,90,what.orientation)
+
+    if Game.USE_COLLISION_PICKER:
+      self.scene_builder.add_collision_box(node_path,model.model_name,PROP_COLLIDE_MASK if is_prop else ITEM_COLLIDE_MASK)
+      node_path.setPythonTag(PICKED_OBJECT_TAG,what)
+
+    return name
+
+  ## Object listener of the level, moves the node of a prop or item that
+  #  moved to another chunk under that chunk's node. If that chunk isn't
+  #  built, the node is removed (and made when the chunk gets built). An
+  #  object moved from a chunk that isn't built to a built one gets a node.
+
+  def on_object_move(self, what, old_position):
+    old_chunk = self.get_object_chunk(old_position)
+    new_chunk = self.get_object_chunk(what.position)
+
+    if old_chunk == new_chunk:
+      return
+
+    built_chunks = self.chunk_streamer.get_built_chunks()
+    node_path = getattr(what,"node_path",None)
+
+    if node_path != None:
+      name = node_path.getName()
+      self.chunk_object_names[old_chunk].remove(name)
+
+      if new_chunk in built_chunks:
+        node_path.wrtReparentTo(built_chunks[new_chunk])
+        self.chunk_object_names[new_chunk].append(name)
+      else:
+        self.tween_engine.stop(node_path)
+        node_path.removeNode()
+        del self.node_object_mapping[name]
+        what.node_path = None
+    elif new_chunk in built_chunks:
+      self.chunk_object_names[new_chunk].append(self.add_object_node(what,built_chunks[new_chunk]))
+
+      if isinstance(what,LevelProp) and not hasattr(what,"disable_usage"):   # a prop new in the scene
+        self.preload_script_sounds([what])
+        self.activate_props([what])
+
+    self.invalidate_focus()
+
+  ## Returns the (chunk x,chunk y) of the streamed chunk whose region
+  #  contains given object position (see Level.get_objects_in_region).
+
+  def get_object_chunk(self, position):
+    return (int(position[0] // self.chunk_streamer.chunk_size),int(position[1] // self.chunk_streamer.chunk_size))
+
+  ## Preloads the sounds used by the scripts of given props.
+
+  def preload_script_sounds(self, props):
+    for prop in props:
+      for filename in prop.scripts_load + prop.scripts_use + prop.scripts_examine:
+        if filename in self.sound_scanned_scripts:
+          continue
+
+        self.sound_scanned_scripts.add(filename)
+
+        try:
+          script_file = open(RESOURCE_PATH + filename,"r")
+          source = script_file.read()
+          script_file.close()
+          self.sound_bank.preload(find_script_sounds(source))
+        except (IOError,SyntaxError):
+          pass           # reported when the script is run
+
+  ## Rebuilds the tile geometry of a built chunk after its tiles changed,
+  #  the prop and item nodes are moved to the new chunk node. The cache is
+  #  not used as runtime changes are usually temporary.
+
+  def rebuild_chunk(self, chunk_x, chunk_y, region, chunk_node_path):
+    new_chunk_node_path = self.tile_builder.build_tiles(self.level,region)
+    new_chunk_node_path.reparentTo(self.level_node_path)
+    self.add_picking_occluders(new_chunk_node_path,region)
+
+    for name in self.chunk_object_names[(chunk_x,chunk_y)]:
+      self.node_object_mapping[name].node_path.reparentTo(new_chunk_node_path)
+
+    chunk_node_path.removeNode()
+    return new_chunk_node_path
+
+  ## Adds the coarse wall boxes of given region to a chunk node if the
+  #  collision picker uses them.
+
+  def add_picking_occluders(self, chunk_node_path, region):
+    if Game.USE_COLLISION_PICKER and Game.PICKING_OCCLUDERS:
+      self.scene_builder.build_occluders(self.level,region).reparentTo(chunk_node_path)
+
+  def destroy_chunk(self, chunk_x, chunk_y, chunk_node_path):
+    for name in self.chunk_object_names.pop((chunk_x,chunk_y)):
+      self.node_object_mapping.pop(name).node_path = None
+
+    chunk_node_path.removeNode()
+    self.invalidate_focus()
+
+  ## Returns the AnimatedTextureModel of given prop or item.
+
+  def get_object_model(self, what):
+    if isinstance(what,LevelProp):
+      return what.model
+
+    return self.database.get_item_types()[what.db_id].model
+
+  ## Returns the bounding box of a prop or item in the scene as
+  #  ((x1,y1,z1),(x2,y2,z2)) in level coordinates (see picking), None if the
+  #  object isn't in the scene.
+
+  def get_object_box(self, what):
+    if getattr(what,"node_path",None) == None:
+      return None
+
+    bounds = self.scene_builder.get_model_bounds(self.get_object_model(what).model_name)
+
+    if bounds == None:
+      return None
+
+    matrix = what.node_path.getMat(self.render)
+    corners = [matrix.xformPoint(Point3(x,y,z)) for x in (bounds[0][0],bounds[1][0]) for y in (bounds[0][1],bounds[1][1]) for z in (bounds[0][2],bounds[1][2])]
+
+    # scene x and y are swapped in the level coordinates:
+
+    return ((min(corner[1] for corner in corners),min(corner[0] for corner in corners),min(corner[2] for corner in corners)),
+            (max(corner[1] for corner in corners),max(corner[0] for corner in corners),max(corner[2] for corner in corners)))
+
+  ## Picks the prop or item the player is looking at (within USE_DISTANCE)
+  #  and shows its name.
+
+  def update_focus(self):
+    camera_position = self.camera.getPos(self.render)
+    camera_direction = self.render.getRelativeVector(self.camera,Vec3(0,1,0))
+    camera_direction.normalize()
+
+    picked = self.picker.pick((camera_position[1],camera_position[0],camera_position[2]),(camera_direction[1],camera_direction[0],camera_direction[2]),Game.USE_DISTANCE)
+
+    self.focused_prop = None
+    self.focused_item = None
+    caption = ""
+
+    if picked != None:
+      if isinstance(picked[0],LevelProp):
+        self.focused_prop = picked[0]
+        caption = self.focused_prop.caption
+      else:
+        self.focused_item = picked[0]
+        caption = self.database.get_item_types()[self.focused_item.db_id].name
+
+    if caption != self.description_text.getText():
+      self.description_text.setText(caption)
+
+  ## Makes the next frame pick the focused object again, has to be called
+  #  when objects are added, removed or moved.
+
+  def invalidate_focus(self):
+    self.picked_camera_state = None
+
+  ## Hides (stashes) or shows a built chunk, for the chunk streamer.
+
+  def set_chunk_visible(self, chunk_x, chunk_y, chunk_node_path, visible):
+    if visible:
+      chunk_node_path.unstash()
+    else:
+      chunk_node_path.stash()
+
+  ## Tile listener of the level, marks the chunks whose geometry depends on
+  #  the tile for rebuilding.
+
+  def on_tile_change(self, x, y, attribute_index):
+    if attribute_index != STEPPABLE:     # steppability only affects the collision mask
+      self.chunk_streamer.mark_tile_dirty(x,y,attribute_index in (None,WALL,WALL_MODEL))
+
+    if self.pvs != None and attribute_index in (None,WALL,WALL_MODEL):   # the walls don't match the PVS anymore
+      self.pvs = None
+      self.chunk_streamer.reset_visibility()
+     
+  ## Plays given sound effect, sounds with lower priority are stopped if
+  #  too many sounds play.
+
+  def script_play_sound(self, filename, volume=1.0, priority=0):
+    self.sound_bank.play(filename,volume,priority)
+
+  ## Plays given sound effect at given source, a prop or item (the sound
+  #  follows it) or (x,y) position. The sound gets quieter with the
+  #  distance and isn't played at all in the fog.
+
+  def script_play_sound_at(self, filename, source, volume=1.0, priority=0):
+    if isinstance(source,(LevelProp,LevelItem)):
+      if getattr(source,"node_path",None) != None:
+        self.positional_audio.play(filename,source.node_path,volume,priority)
+        return
+
+      source = source.position
+
+    self.positional_audio.play(filename,Point3(source[1] - 0.5,source[0] - 0.5,0),volume,priority)
+    
+## Runs the game. Usage:
+#
+#  python main.py [-p] [-o profile_file] [-s] [level_file]
+#
+#  -p  measure the frame parts (see frame_profiler), F3 shows and hides the
+#      statistics overlay
+#  -o  measure and save the statistics into given file at exit (as JSON for
+#      .json files, otherwise as CSV)
+#  -s  connect to the PStats server (Panda3D profiling)
+#
+#  The options can also be set by the environment variables GAME_PROFILE=1,
+#  GAME_PROFILE_OUTPUT=profile_file and GAME_PSTATS=1.
+
+def main():
+  arguments = sys.argv[1:]
+  profile = os.environ.get("GAME_PROFILE","0") != "0"
+  profile_filename = os.environ.get("GAME_PROFILE_OUTPUT")
+  pstats = os.environ.get("GAME_PSTATS","0") != "0"
+
+  while len(arguments) > 0 and arguments[0] in ("-p","-o","-s"):
+    if arguments[0] == "-p":
+      profile = True
+    elif arguments[0] == "-s":
+      pstats = True
+    else:
+      if len(arguments) < 2:
+        print("usage: python main.py [-p] [-o profile_file] [-s] [level_file]")
+        sys.exit(1)
+
+      profile_filename = arguments[1]
+      arguments = arguments[1:]
+
+    arguments = arguments[1:]
+
+  profiler = FrameProfiler() if profile or profile_filename != None else None
+
+  if profile_filename != None:
+    atexit.register(profiler.save,profile_filename)
+
+  app = Game(arguments[0] if len(arguments) > 0 else Game.DEFAULT_LEVEL,profiler,pstats)
+  app.run()
+
+if __name__ == "__main__":
+  main()
\ No newline at end of file
@@ -0,0 +1,82 @@
+## Computes what the map editor draws for the level tiles, as a list of
+#  shapes, without Tk (so that it can be measured and tested without
+#  a display). Each shape is a tuple (kind,coordinates,options) drawn as
+#  canvas.create_<kind>(*coordinates,**options). The colors are computed
+#  once per model in the level's model palette instead of once per tile.
+
+import math
+
+from level import *
+
+## Returns the color representing given model (AnimatedTextureModel) as
+#  a "#rrggbb" string.
+
+def compute_model_color(model):
+  textures = ""
+
+  for texture_name in model.texture_names:
+    textures += texture_name
+
+  red = hash(model.model_name) % 256
+  green = hash(textures) % 256
+  blue = hash(model.model_name + textures) % 256
+
+  return ("#%0.2x" % red) + ("%0.2x" % green) + ("%0.2x" % blue)
+
+## Returns the list of shapes of the level tiles.
+#
+#  @param tile_size size of a tile in pixels
+#  @param small_tile_size size of the ceiling square in pixels
+#  @param selected_tile (x,y) of the tile to be marked or None
+
+def get_tile_shapes(level, tile_size, small_tile_size, display_orientation=True, display_ceiling=True, selected_tile=None):
+  colors = [compute_model_color(record_to_model(record)) for record in level.model_palette.values]   # model palette index => color
+  wall_index, ceiling_index, orientation_index, wall_model_index, floor_model_index, ceiling_model_index = [TILE_ATTRIBUTE_INDICES[name] for name in
+    ("wall","ceiling","floor_orientation","wall_model","floor_model","ceiling_model")]
+
+  small_tile_offset = math.floor((tile_size - small_tile_size) / 2)
+  half_tile_size = tile_size / 2
+  result = []
+
+  for y in range(level.get_height()):
+    for x in range(level.get_width()):
+      corner1 = (x * tile_size, y * tile_size)
+      corner2 = (corner1[0] + tile_size - 1, corner1[1] + tile_size - 1)
+
+      record = level.layout.get_record(x,y)
+
+      if record[wall_index]:       # wall
+        fill_color = colors[record[wall_model_index]]
+        result.append(("rectangle",(corner1[0],corner1[1],corner2[0],corner2[1]),{"outline": "black","fill": fill_color}))
+      else:                        # floor
+        fill_color = colors[record[floor_model_index]]
+        result.append(("rectangle",(corner1[0],corner1[1],corner2[0],corner2[1]),{"outline": fill_color,"fill": fill_color}))
+
+        if display_orientation:
+          floor_orientation = record[orientation_index]
+
+          if floor_orientation == 0:
+            p1 = (corner1[0] + 1,corner2[1] - 1)
+            p2 = (corner2[0] + 1,corner2[1] - 1)
+          elif floor_orientation == 1:
+            p1 = (corner1[0] + 1,corner1[1] - 1)
+            p2 = (corner1[0] + 1,corner2[1] - 1)
+          elif floor_orientation == 2:
+            p1 = (corner1[0] + 1,corner1[1] - 1)
+            p2 = (corner2[0] + 1,corner1[1] - 1)
+          else:
+            p1 = (corner2[0] + 1,corner1[1] - 1)
+            p2 = (corner2[0] + 1,corner2[1] - 1)
+
+          p3 = (corner1[0] + half_tile_size,corner1[1] + half_tile_size)
+
+          result.append(("polygon",(p1[0],p1[1],p2[0],p2[1],p3[0],p3[1]),{"outline": "white","fill": "green"}))
+
+      if record[ceiling_index] and display_ceiling:
+        ceiling_color = colors[record[ceiling_model_index]]
+        result.append(("rectangle",(corner1[0] + small_tile_offset,corner1[1] + small_tile_offset,corner2[0] - small_tile_offset,corner2[1] - small_tile_offset),{"outline": ceiling_color,"fill": ceiling_color}))
+
+      if selected_tile != None and selected_tile[0] == x and selected_tile[1] == y:
+        result.append(("rectangle",(corner1[0],corner1[1],corner2[0],corner2[1]),{"outline": "red"}))
+
+  return result
@@ -1,5 +1,8 @@
 import math
+import tkMessageBox
 from general_gui import *
+from map_drawing import *
+from chunked_level import *
 
 ## Frame that can be scrolled.
 class ScrolledFrame(Frame):
@@ -48,6 +51,7 @@ class MapEditor(ScrolledFrame):
   PADDING_X = 3
   PADDING_Y = 1
   BORDER_COLOR = "white"       # border color of non selected objects on the map
+  CLICK_DISTANCE = 0.7         # max distance of a prop/item from the click for it to be selected
   
   def __init__(self, parent):
     ScrolledFrame.__init__(self, parent)   
@@ -77,7 +81,7 @@ class MapEditor(ScrolledFrame):
     if len(filename) == 0:
       return
     
-    self.level = Level.load_from_file(filename)
+    self.level = load_level(filename)
     self.selected_tile = None
     self.redraw_level()
     self.update_gui_info()
@@ -86,6 +90,13 @@ class MapEditor(ScrolledFrame):
     self.set_check("is steppable", not self.get_check("is wall"))
    
   def on_set_map_info_click(self):
+    width = int(self.get_text("width"))
+    height = int(self.get_text("height"))
+
+    if isinstance(self.level,ChunkedLevel) and (width,height) != (self.level.get_width(),self.level.get_height()):
+      tkMessageBox.showerror("Map info","Chunked levels can't be resized, the size has to stay " + str(self.level.get_width()) + " x " + str(self.level.get_height()) + ".")
+      return
+
     self.level.set_name(self.get_text("name"))
     self.level.set_skybox_textures(string_to_list(self.get_text("skybox textures")))
     self.level.set_database_name(self.get_text("database"))
@@ -97,7 +108,7 @@ class MapEditor(ScrolledFrame):
       
     self.level.set_light_properties(float(self.get_text("ambient light amount")),diffuse_lights)
     
-    self.level.set_size(int(self.get_text("width")),int(self.get_text("height")))
+    self.level.set_size(width,height)
     self.level.set_fog_distance(float(self.get_text("fog distance")))
     
     fog_color = self.get_text("fog color").replace(" ", "")[1:-1].split(",")
@@ -124,7 +135,7 @@ class MapEditor(ScrolledFrame):
       return
 
     helper_list = self.get_text("item position").split(";")
-    self.selected_item.position = (float(helper_list[0]),float(helper_list[1]))
+    self.level.set_object_position(self.selected_item,(float(helper_list[0]),float(helper_list[1])))
     self.selected_item.orientation = float(self.get_text("item orientation"))
     self.selected_item.data = self.get_text("item data")
     self.selected_item.db_id = self.get_text("item DB ID")
@@ -135,19 +146,12 @@ class MapEditor(ScrolledFrame):
     return
     
   def on_delete_prop_item_click(self):
-    props = self.level.get_props()
-    items = self.level.get_items()
-    
-    for i in range(len(props)):
-      if props[i] == self.selected_prop:
-        del props[i]
-        break
-      
-    for i in range(len(items)):
-      if items[i] == self.selected_item:
-        del items[i]
-        break
-      
+    if self.selected_prop != None:
+      self.level.remove_prop(self.selected_prop)
+
+    if self.selected_item != None:
+      self.level.remove_item(self.selected_item)
+
     self.selected_prop = None
     self.selected_item = None
     self.redraw_level()
@@ -170,7 +174,7 @@ class MapEditor(ScrolledFrame):
       return
     
     helper_list = self.get_text("prop position").split(";")
-    self.selected_prop.position = (float(helper_list[0]),float(helper_list[1]))
+    self.level.set_object_position(self.selected_prop,(float(helper_list[0]),float(helper_list[1])))
     self.model_widgets["prop model"].fill_model(self.selected_prop.model)
     self.selected_prop.orientation = float(self.get_text("prop orientation"))
     self.selected_prop.caption = self.get_text("caption")
@@ -182,36 +186,16 @@ class MapEditor(ScrolledFrame):
     self.redraw_level()
     self.update_gui_info()
     
-  ## Checks if clicked coordinates are near given point, for selection by clicking.
-    
-  def clicked_near(self, clicked_where_coords, near_where_coords):
-    dx = clicked_where_coords[0] - near_where_coords[0]
-    dy = clicked_where_coords[1] - near_where_coords[1]
-    
-    distance = math.sqrt(dx * dx + dy * dy)
-    
-    return distance < 0.7
-    
   def on_canvas_click(self, event):   # left click
+    coordinates = self.pixel_to_world_coordinates(event.x,event.y)
     prop_clicked = None
     item_clicked = None
-    
-    if self.get_check("display props"):
-      for prop in self.level.get_props():
-        coordinates = self.pixel_to_world_coordinates(event.x,event.y)
-        
-        if self.clicked_near(coordinates,prop.position):
-          prop_clicked = prop
-          break
-        
+
     if self.get_check("display items"):
-      for item in self.level.get_items():
-        coordinates = self.pixel_to_world_coordinates(event.x,event.y)
-        
-        if self.clicked_near(coordinates,item.position):
-          item_clicked = item
-          prop_clicked = None
-          break
+      item_clicked = self.level.get_nearest_object(coordinates,MapEditor.CLICK_DISTANCE,props=False)
+
+    if item_clicked == None and self.get_check("display props"):
+      prop_clicked = self.level.get_nearest_object(coordinates,MapEditor.CLICK_DISTANCE,items=False)
       
     if prop_clicked != None:
       self.selected_prop = prop_clicked
@@ -247,10 +231,12 @@ class MapEditor(ScrolledFrame):
         selected_thing = self.selected_prop if self.selected_prop != None else selected_thing
         selected_thing = self.selected_item if self.selected_item != None else selected_thing
             
-        selected_thing.position = self.pixel_to_world_coordinates(event.x,event.y)
+        new_position = self.pixel_to_world_coordinates(event.x,event.y)
         
         if self.get_check("stick to grid"):
-          selected_thing.position = (round(selected_thing.position[0] * 2) / 2.0,round(selected_thing.position[1] * 2) / 2.0)
+          new_position = (round(new_position[0] * 2) / 2.0,round(new_position[1] * 2) / 2.0)
+
+        self.level.set_object_position(selected_thing,new_position)
         
       self.redraw_level()
       self.update_gui_info()
@@ -374,67 +360,14 @@ class MapEditor(ScrolledFrame):
   #  in GUI (display texture, display model etc.). Returns tkinter color string.
    
   def compute_model_color(self, model):
-    textures = ""
-  
-    for texture_name in model.texture_names:
-      textures += texture_name
-  
-    red = hash(model.model_name) % 256
-    green = hash(textures) % 256
-    blue = hash(model.model_name + textures) % 256
-    
-    return ("#%0.2x" % red) + ("%0.2x" % green) + ("%0.2x" % blue)
+    return compute_model_color(model)
    
   def redraw_level(self):
     self.canvas.config(width=self.level.get_width() * MapEditor.TILE_SIZE, height=self.level.get_height() * MapEditor.TILE_SIZE)
     self.canvas.delete("all")
-    
-    small_tile_offset = math.floor((MapEditor.TILE_SIZE - MapEditor.SMALL_TILE_SIZE) / 2)
-    
-    half_tile_size = MapEditor.TILE_SIZE / 2
-    
-    for y in range(self.level.get_height()):
-      for x in range(self.level.get_width()):
-        corner1 = (x * MapEditor.TILE_SIZE, y * MapEditor.TILE_SIZE)
-        corner2 = (corner1[0] + MapEditor.TILE_SIZE - 1, corner1[1] + MapEditor.TILE_SIZE - 1)
-        
-        tile = self.level.get_tile(x,y)
-        
-        if tile.wall:
-          fill_color = self.compute_model_color(self.level.get_tile(x,y).wall_model)
-        else:
-          fill_color = self.compute_model_color(self.level.get_tile(x,y).floor_model)
-        
-        ceiling_color = self.compute_model_color(self.level.get_tile(x,y).ceiling_model)
-           
-        if tile.wall:       # wall
-          self.canvas.create_rectangle(corner1[0], corner1[1], corner2[0], corner2[1], outline="black", fill=fill_color)
-        else:               # floor
-          self.canvas.create_rectangle(corner1[0], corner1[1], corner2[0], corner2[1], outline=fill_color, fill=fill_color)
-
-          if self.get_check("display orientation"):
-            if tile.floor_orientation == 0:
-              p1 = (corner1[0] + 1,corner2[1] - 1)
-              p2 = (corner2[0] + 1,corner2[1] - 1)
-            elif tile.floor_orientation == 1:
-              p1 = (corner1[0] + 1,corner1[1] - 1)
-              p2 = (corner1[0] + 1,corner2[1] - 1)
-            elif tile.floor_orientation == 2:
-              p1 = (corner1[0] + 1,corner1[1] - 1)
-              p2 = (corner2[0] + 1,corner1[1] - 1)
-            else:
-              p1 = (corner2[0] + 1,corner1[1] - 1)
-              p2 = (corner2[0] + 1,corner2[1] - 1)
-              
-            p3 = (corner1[0] + half_tile_size,corner1[1] + half_tile_size)
-            
-            self.canvas.create_polygon(p1[0],p1[1],p2[0],p2[1],p3[0],p3[1],outline="white",fill="green")
-
-        if tile.ceiling and self.get_check("display ceiling"):
-          self.canvas.create_rectangle(corner1[0] + small_tile_offset, corner1[1] + small_tile_offset, corner2[0] - + small_tile_offset, corner2[1] - + small_tile_offset, outline=ceiling_color, fill=ceiling_color)
 
-        if self.selected_tile != None and self.selected_tile[0] == x and self.selected_tile[1] == y:
-          self.canvas.create_rectangle(corner1[0], corner1[1], corner2[0], corner2[1], outline="red")
+    for shape, coordinates, options in get_tile_shapes(self.level,MapEditor.TILE_SIZE,MapEditor.SMALL_TILE_SIZE,self.get_check("display orientation"),self.get_check("display ceiling"),self.selected_tile):
+      getattr(self.canvas,"create_" + shape)(*coordinates,**options)
 
     # draw props:
     
@@ -0,0 +1,70 @@
+## Reports the memory taken by level tiles, comparing the tile layouts
+#  (see tile_layout) with the previous representation (one LevelTile with
+#  three AnimatedTextureModel objects per tile). Usage:
+#
+#  python memory_report.py [level_file ...]
+
+import sys
+from level import *
+
+DEFAULT_FILES = ["test_exterior.txt","test_interior.txt"]
+
+## Computes the size of given object including everything it references,
+#  objects in already_counted (set of ids) are not counted again.
+
+def deep_size(what, already_counted):
+  if id(what) in already_counted:
+    return 0
+
+  already_counted.add(id(what))
+  result = sys.getsizeof(what)
+
+  if isinstance(what,dict):
+    for key in what:
+      result += deep_size(key,already_counted) + deep_size(what[key],already_counted)
+  elif isinstance(what,(list,tuple,set)):
+    for value in what:
+      result += deep_size(value,already_counted)
+  elif hasattr(what,"__dict__") and not isinstance(what,array):
+    result += deep_size(what.__dict__,already_counted)
+
+  return result
+
+## Returns a copy of the level tiles stored in given layout type.
+
+def copy_tiles(level, array_backed):
+  result = Level(level.get_width(),level.get_height(),array_backed=array_backed)
+
+  for i in range(level.get_width()):
+    for j in range(level.get_height()):
+      result.set_tile(i,j,level.get_tile(i,j))
+
+  return result
+
+## Returns the size of the tiles of given level in its current layout.
+
+def measure_tiles(level):
+  return deep_size([level.layout,level.model_palette],set())
+
+## Returns the size the tiles of given level would take as separate objects.
+
+def measure_tile_objects(level):
+  return deep_size([[level.get_tile(i,j).copy() for j in range(level.get_height())] for i in range(level.get_width())],set())
+
+def main():
+  filenames = sys.argv[1:] if len(sys.argv) > 1 else DEFAULT_FILES
+  layouts = [("palette",False)] + ([("arrays",True)] if numpy != None else [])
+
+  print("%-24s %8s %-9s %12s %12s %10s %10s %8s" % ("level","tiles","layout","before (B)","after (B)","B/tile old","B/tile new","ratio"))
+
+  for filename in filenames:
+    level = Level.load_from_file(filename)
+    tile_count = level.get_width() * level.get_height()
+    before = measure_tile_objects(level)
+
+    for layout_name, array_backed in layouts:
+      after = measure_tiles(copy_tiles(level,array_backed))
+      print("%-24s %8d %-9s %12d %12d %10.1f %10.1f %7.1fx" % (filename,tile_count,layout_name,before,after,before / float(tile_count),after / float(tile_count),before / float(after)))
+
+if __name__ == "__main__":
+  main()
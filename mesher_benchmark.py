@@ -0,0 +1,89 @@
+## Compares building level chunk geometry with ChunkMesher against
+#  SceneBuilder (instanced nodes flattened with flattenStrong): build time,
+#  vertex count and geom count of all chunks of the level. Usage:
+#
+#  python mesher_benchmark.py [-c chunk_size] [level_file ...]
+
+import sys
+import time
+
+from direct.showbase.ShowBase import ShowBase
+
+from chunked_level import *
+from scene_builder import *
+from chunk_mesher import *
+
+DEFAULT_FILES = ["test_exterior.txt","test_interior.txt"]
+DEFAULT_CHUNK_SIZE = 16
+
+## Returns (vertex count,triangle count,geom count,geom node count) of the
+#  geometry under given NodePath.
+
+def measure_geometry(node_path):
+  vertices = 0
+  triangles = 0
+  geoms = 0
+  geom_node_paths = node_path.findAllMatches("**/+GeomNode")
+
+  for geom_node_path in geom_node_paths:
+    geom_node = geom_node_path.node()
+
+    for i in range(geom_node.getNumGeoms()):
+      geom = geom_node.getGeom(i)
+      vertices += geom.getVertexData().getNumRows()
+      geoms += 1
+
+      for j in range(geom.getNumPrimitives()):
+        triangles += geom.getPrimitive(j).decompose().getNumPrimitives()
+
+  return (vertices,triangles,geoms,geom_node_paths.getNumPaths())
+
+## Builds all chunks of the level with given builder, returns (build time in
+#  seconds,vertex count,triangle count,geom count,geom node count).
+
+def benchmark_builder(builder, level, chunk_size):
+  chunk_columns, chunk_rows = get_chunk_count(level.get_width(),level.get_height(),chunk_size)
+  build_time = 0.0
+  totals = [0,0,0,0]
+
+  for chunk_x in range(chunk_columns):
+    for chunk_y in range(chunk_rows):
+      region = get_chunk_region(level.get_width(),level.get_height(),chunk_size,chunk_x,chunk_y)
+      start = time.time()
+      node_path = builder.build_tiles(level,region)
+      build_time += time.time() - start
+
+      for i, value in enumerate(measure_geometry(node_path)):
+        totals[i] += value
+
+      node_path.removeNode()
+
+  return tuple([build_time] + totals)
+
+def main():
+  arguments = sys.argv[1:]
+  chunk_size = DEFAULT_CHUNK_SIZE
+
+  if len(arguments) >= 2 and arguments[0] == "-c":
+    chunk_size = int(arguments[1])
+    arguments = arguments[2:]
+
+  filenames = arguments if len(arguments) > 0 else DEFAULT_FILES
+
+  base = ShowBase(windowType="none")
+  scene_builder = SceneBuilder(base.loader)
+  builders = [("builder",scene_builder),("mesher",ChunkMesher(scene_builder))]
+
+  print("chunk size: " + str(chunk_size))
+  print("%-24s %-8s %10s %10s %10s %8s %10s" % ("level","path","time (ms)","vertices","triangles","geoms","geom nodes"))
+
+  for filename in filenames:
+    level = load_level(filename)
+
+    for name, builder in builders:
+      benchmark_builder(builder,level,chunk_size)     # warm up the model and texture caches
+      result = benchmark_builder(builder,level,chunk_size)
+      print("%-24s %-8s %10.1f %10d %10d %8d %10d" % (filename,name,result[0] * 1000,result[1],result[2],result[3],result[4]))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,262 @@
+## Measures the CPU-side hot paths of the engine (no display is needed) on
+#  generated levels of increasing size (see level_generator) and compares
+#  the results with stored baselines. A benchmark slower than its baseline
+#  or using more memory than it by more than the tolerance is reported as
+#  a regression and makes the script exit with 1. The baselines depend on
+#  the machine, so they are not kept in the repository: without the
+#  baseline file nothing is compared (with a warning) and the script exits
+#  with 0. The memory is the peak memory allocated by one call of the
+#  measured function (with tracemalloc, i.e. Python 3), otherwise the growth
+#  of the peak resident memory of the process it caused (0 if it stayed
+#  under an earlier peak). Usage:
+#
+#  python micro_benchmark.py [-s sizes] [-f baseline_file] [-t tolerance] [-w]
+#
+#  -s  comma separated level sizes, default 32,128,512,2048
+#  -f  baseline file, default micro_benchmark_baseline.json
+#  -t  allowed slowdown and memory growth as a fraction, default 0.3
+#  -w  save the results as the new baselines (instead of comparing), on the
+#      machine that runs the comparisons
+
+import os
+import atexit
+import sys
+import time
+import json
+import copy
+import random
+import pickle
+import tempfile
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+from level import *
+from game_database import *
+import level_file
+from map_drawing import get_tile_shapes
+from level_generator import generate_level
+from simulation import move_with_collisions
+
+SOURCE_LEVEL = "test_exterior.txt"
+DEFAULT_SIZES = [32,128,512,2048]
+DEFAULT_BASELINE_FILE = "micro_benchmark_baseline.json"
+DEFAULT_TOLERANCE = 0.3
+MIN_TIME = 0.2                       ##< each benchmark is repeated for at least this many seconds
+MOVES = 1000                         ##< number of moves in one move_with_collisions run
+MAX_DRAWING_SIZE = 512               ##< bigger levels are not drawn (the map editor canvas would be too big anyway)
+MAX_LEGACY_SIZE = 128                ##< bigger levels are not saved in the legacy format (the pickle files would be too big)
+MEMORY_SLACK = 1024 * 1024           ##< memory growth in bytes that is never a regression (the resident memory grows by whole pages and allocator blocks)
+
+## The benchmarks, each one is a function f(level) that prepares the data
+#  and returns a tuple (function to measure,number of operations one call
+#  of the function makes), or None if the benchmark is skipped for the
+#  level.
+
+def benchmark_load_from_file(level):
+  handle, filename = tempfile.mkstemp(".lvl")
+  os.close(handle)
+  atexit.register(os.remove,filename)
+  Level.save_to_file(level,filename)
+  return (lambda: Level.load_from_file(filename),1)
+
+def benchmark_collision_mask(level):
+  return (lambda: CollisionMask.from_grid(level.layout.get_grid(STEPPABLE)),1)
+
+def benchmark_move_with_collisions(level):
+  generator = random.Random(0)
+  collision_mask = level.get_collision_mask()
+  moves = [((generator.uniform(0,level.get_width() - 1),generator.uniform(0,level.get_height() - 1)),generator.uniform(0,360)) for i in range(MOVES)]
+
+  def move():
+    for position, direction in moves:
+      move_with_collisions(collision_mask,position,direction,0.1)
+
+  return (move,MOVES)
+
+def benchmark_shadowed_tiles(level):
+  return (level.get_shadowed_tiles,1)
+
+## A level in the legacy pickled format (as the sample levels are) of the
+#  level size, made of the source level's tiles, loaded and converted.
+
+def benchmark_read_legacy_level(level):
+  if level.get_width() > MAX_LEGACY_SIZE:
+    return None
+
+  input_file = open(SOURCE_LEVEL,"r")
+  legacy_level = pickle.load(input_file)        # the old objects, not converted
+  input_file.close()
+
+  source_layout = legacy_level.layout
+  legacy_level.layout = [[copy.deepcopy(source_layout[x % len(source_layout)][y % len(source_layout[0])]) for y in range(level.get_height())] for x in range(level.get_width())]
+
+  handle, filename = tempfile.mkstemp(".txt")
+  os.close(handle)
+  atexit.register(os.remove,filename)
+  output_file = open(filename,"w")
+  pickle.dump(legacy_level,output_file,0)
+  output_file.close()
+  return (lambda: level_file.read_legacy_level_file(filename),1)
+
+def benchmark_new_item_type(level):
+  def new_item_types():
+    database = GameDatabase()
+
+    for i in range(level.get_width()):
+      database.new_item_type()
+
+    return database
+
+  return (new_item_types,level.get_width())
+
+def benchmark_map_drawing(level):
+  if level.get_width() > MAX_DRAWING_SIZE:
+    return None
+
+  return (lambda: get_tile_shapes(level,20,14),1)
+
+BENCHMARKS = [
+  ("Level.load_from_file",benchmark_load_from_file),
+  ("collision mask from grid",benchmark_collision_mask),
+  ("move_with_collisions",benchmark_move_with_collisions),
+  ("Level.get_shadowed_tiles",benchmark_shadowed_tiles),
+  ("read_legacy_level_file",benchmark_read_legacy_level),
+  ("GameDatabase.new_item_type",benchmark_new_item_type),
+  ("map_drawing.get_tile_shapes",benchmark_map_drawing)]
+
+## Calls given function once and returns the memory in bytes it
+#  allocated at most (see the module description), None if it can't be
+#  measured.
+
+def measure_memory(function):
+  if tracemalloc != None:
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+  if resource != None:
+    unit = 1 if sys.platform == "darwin" else 1024      # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    function()
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) * unit
+
+  return None
+
+## Calls given function repeatedly for at least MIN_TIME seconds (after
+#  a call measuring its memory), returns a tuple (calls per second,memory
+#  in bytes or None).
+
+def measure(function):
+  memory = measure_memory(function)
+  calls = 0
+  start = time.time()
+
+  while True:
+    function()
+    calls += 1
+    elapsed = time.time() - start
+
+    if elapsed >= MIN_TIME:
+      break
+
+  return (calls / elapsed,memory)
+
+def main():
+  arguments = sys.argv[1:]
+  sizes = DEFAULT_SIZES
+  baseline_filename = DEFAULT_BASELINE_FILE
+  tolerance = DEFAULT_TOLERANCE
+  save = False
+
+  while len(arguments) > 0:
+    if arguments[0] == "-w":
+      save = True
+      arguments = arguments[1:]
+      continue
+
+    if len(arguments) < 2 or not arguments[0] in ("-s","-f","-t"):
+      print("usage: python micro_benchmark.py [-s sizes] [-f baseline_file] [-t tolerance] [-w]")
+      sys.exit(1)
+
+    if arguments[0] == "-s":
+      sizes = [int(size) for size in arguments[1].split(",")]
+    elif arguments[0] == "-f":
+      baseline_filename = arguments[1]
+    else:
+      tolerance = float(arguments[1])
+
+    arguments = arguments[2:]
+
+  baselines = {}
+  baseline_found = os.path.isfile(baseline_filename)
+
+  if baseline_found:
+    input_file = open(baseline_filename,"r")
+    baselines = json.load(input_file)
+    input_file.close()
+  elif not save:
+    print("warning: baseline file " + baseline_filename + " not found, nothing is compared (save the baselines with -w)")
+
+  source = Level.load_from_file(SOURCE_LEVEL)
+  regressions = 0
+
+  print("%-32s %6s %14s %14s %12s %12s %s" % ("benchmark","size","ops/s","baseline ops/s","peak (KB)","baseline (KB)","change"))
+
+  for size in sizes:
+    level = generate_level(source,size,size)
+
+    for name, benchmark in BENCHMARKS:
+      prepared = benchmark(level)
+
+      if prepared == None:
+        continue
+
+      function, operations = prepared
+      calls_per_second, memory = measure(function)
+      ops_per_second = calls_per_second * operations
+      key = name + " " + str(size)
+      baseline = baselines.get(key)
+      change = ""
+
+      if save:
+        baselines[key] = {"ops_per_second": ops_per_second,"memory": memory}
+      elif baseline != None:
+        change = "%+.0f %%" % ((ops_per_second / baseline["ops_per_second"] - 1) * 100)
+
+        if ops_per_second < baseline["ops_per_second"] * (1 - tolerance):
+          change += " REGRESSION"
+          regressions += 1
+
+        if memory != None and baseline["memory"] != None:
+          change += ", memory %+.1f KB" % ((memory - baseline["memory"]) / 1024.0)
+
+          if memory > baseline["memory"] * (1 + tolerance) + MEMORY_SLACK:
+            change += " MEMORY REGRESSION"
+            regressions += 1
+
+      print("%-32s %6d %14.1f %14s %12s %12s %s" % (name,size,ops_per_second,"%.1f" % baseline["ops_per_second"] if baseline != None else "-",
+        "%.1f" % (memory / 1024.0) if memory != None else "-","%.1f" % (baseline["memory"] / 1024.0) if baseline != None and baseline["memory"] != None else "-",change))
+
+  if save:
+    output_file = open(baseline_filename,"w")
+    json.dump(baselines,output_file,indent=2,sort_keys=True,separators=(",",": "))
+    output_file.close()
+    print("baselines saved to " + baseline_filename)
+  elif not baseline_found:
+    print("warning: no baselines compared, " + baseline_filename + " not found (save the baselines with -w)")
+  elif regressions > 0:
+    print(str(regressions) + " regression(s) against " + baseline_filename)
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
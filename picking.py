@@ -0,0 +1,188 @@
+## Picking of the prop or item the player is looking at. Instead of
+#  traversing the whole scene with a collision ray, GridPicker walks the ray
+#  through the tile grid (as a DDA) up to the maximum distance, stops at the
+#  first wall tile and only tests the props and items standing around the
+#  crossed tiles (found with the spatial index of the level), each one as
+#  a bounding box. CollisionPicker is the alternative that does use Panda3D
+#  collisions, but only against the collision boxes of the objects and
+#  (optionally) coarse wall boxes, see scene_builder collide masks.
+#
+#  Positions are in level coordinates: (x,y) with tile centers at integer
+#  coordinates (as the player position) and z up.
+
+from math import floor
+
+from panda3d.core import *
+
+from level import *
+from scene_builder import PROP_COLLIDE_MASK, ITEM_COLLIDE_MASK, OCCLUDER_COLLIDE_MASK
+
+PICKED_OBJECT_TAG = "object"      ##< python tag of the object node paths holding the prop or item (for CollisionPicker)
+
+class GridPicker:
+  OBJECT_MARGIN = 1.0        ##< objects standing up to this far from a crossed tile are tested too (they reach over their tile)
+
+  ## Creates the picker.
+  #
+  #  @param level level whose tiles and objects are picked
+  #  @param get_object_box function f(prop or item) returning the bounding
+  #         box of the object as ((x1,y1,z1),(x2,y2,z2)) (in level
+  #         coordinates) or None if the object can't be picked
+
+  def __init__(self, level, get_object_box):
+    self.level = level
+    self.get_object_box = get_object_box
+
+  ## Walks the tiles crossed by the ray (looking at x and y only) up to given
+  #  distance. Returns a tuple (list of crossed (x,y) tiles,distance at which
+  #  the ray enters a wall tile or None).
+
+  def get_crossed_tiles(self, origin, direction, max_distance):
+    x = int(floor(origin[0] + 0.5))
+    y = int(floor(origin[1] + 0.5))
+    step_x = 1 if direction[0] > 0 else -1
+    step_y = 1 if direction[1] > 0 else -1
+
+    # ray distances of the next tile borders and between two borders:
+
+    next_x = (x + 0.5 * step_x - origin[0]) / direction[0] if direction[0] != 0 else float("inf")
+    next_y = (y + 0.5 * step_y - origin[1]) / direction[1] if direction[1] != 0 else float("inf")
+    delta_x = abs(1.0 / direction[0]) if direction[0] != 0 else float("inf")
+    delta_y = abs(1.0 / direction[1]) if direction[1] != 0 else float("inf")
+
+    tiles = []
+    distance = 0.0
+
+    while self.level.is_inside(x,y):
+      if self.level.is_wall(x,y) and len(tiles) > 0:
+        return (tiles,distance)
+
+      tiles.append((x,y))
+
+      if next_x < next_y:
+        distance = next_x
+        x += step_x
+        next_x += delta_x
+      else:
+        distance = next_y
+        y += step_y
+        next_y += delta_y
+
+      if distance > max_distance:
+        break
+
+    return (tiles,None)
+
+  ## Returns the props and items standing around given tiles.
+
+  def get_candidates(self, tiles):
+    result = set()
+    margin = GridPicker.OBJECT_MARGIN
+
+    for x, y in tiles:   # object positions have tile corners at integer coordinates
+      result.update(self.level.get_objects_in_rectangle((x - margin,y - margin),(x + 1 + margin,y + 1 + margin)))
+
+    return result
+
+  ## Returns the distance at which the ray hits given box, None if it doesn't
+  #  hit it (or starts inside it).
+
+  @staticmethod
+  def intersect_box(origin, direction, box):
+    near = 0.0
+    far = float("inf")
+
+    for axis in range(3):
+      if direction[axis] == 0:
+        if origin[axis] < box[0][axis] or origin[axis] > box[1][axis]:
+          return None
+
+        continue
+
+      distance1 = (box[0][axis] - origin[axis]) / direction[axis]
+      distance2 = (box[1][axis] - origin[axis]) / direction[axis]
+
+      near = max(near,min(distance1,distance2))
+      far = min(far,max(distance1,distance2))
+
+      if near > far:
+        return None
+
+    return near if near > 0 else None
+
+  ## Picks the object hit first by a ray.
+  #
+  #  @param origin ray origin (x,y,z)
+  #  @param direction normalized ray direction (x,y,z)
+  #  @param max_distance maximum distance of the hit
+  #  @return tuple (prop or item,distance) or None if nothing is hit
+
+  def pick(self, origin, direction, max_distance):
+    tiles, wall_distance = self.get_crossed_tiles(origin,direction,max_distance)
+
+    if wall_distance != None:
+      max_distance = min(max_distance,wall_distance)
+
+    result = None
+
+    for what in self.get_candidates(tiles):
+      box = self.get_object_box(what)
+
+      if box == None:
+        continue
+
+      distance = GridPicker.intersect_box(origin,direction,box)
+
+      if distance != None and distance <= max_distance and (result == None or distance < result[1]):
+        result = (what,distance)
+
+    return result
+
+## Picks objects with a collision segment traversing the scene. Only the
+#  collision solids with the prop, item and occluder collide masks are
+#  tested, the level geometry has its collide mask turned off. Object node
+#  paths have to carry the prop or item as python tag PICKED_OBJECT_TAG,
+#  hitting anything else (an occluder) blocks the picking.
+
+class CollisionPicker:
+  ## Creates the picker.
+  #
+  #  @param root node path of the scene to pick in (the render node, as the
+  #         positions are converted to it)
+  #  @param use_occluders whether the occluder boxes block the picking
+
+  def __init__(self, root, use_occluders=True):
+    self.root = root
+    self.traverser = CollisionTraverser("picker")
+    self.handler = CollisionHandlerQueue()
+    self.segment = CollisionSegment()
+
+    collision_node = CollisionNode("picker segment")
+    collision_node.addSolid(self.segment)
+    collision_node.setFromCollideMask(PROP_COLLIDE_MASK | ITEM_COLLIDE_MASK | (OCCLUDER_COLLIDE_MASK if use_occluders else BitMask32.allOff()))
+    collision_node.setIntoCollideMask(BitMask32.allOff())
+
+    self.segment_node_path = root.attachNewNode(collision_node)
+    self.traverser.addCollider(self.segment_node_path,self.handler)
+
+  ## Same as GridPicker.pick.
+
+  def pick(self, origin, direction, max_distance):
+    # scene x and y are swapped in the level coordinates:
+
+    start = Point3(origin[1],origin[0],origin[2])
+    self.segment.setPointA(start)
+    self.segment.setPointB(start + Vec3(direction[1],direction[0],direction[2]) * max_distance)
+    self.traverser.traverse(self.root)
+
+    if self.handler.getNumEntries() == 0:
+      return None
+
+    self.handler.sortEntries()
+    entry = self.handler.getEntry(0)
+    object_node_path = entry.getIntoNodePath().findNetPythonTag(PICKED_OBJECT_TAG)
+
+    if object_node_path.isEmpty():      # an occluder
+      return None
+
+    return (object_node_path.getPythonTag(PICKED_OBJECT_TAG),(entry.getSurfacePoint(self.root) - start).length())
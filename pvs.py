@@ -0,0 +1,276 @@
+## Potentially visible sets (PVS) of level chunks, computed offline from
+#  the tile grid: chunk B is potentially visible from chunk A if a straight
+#  line from some point of a non-wall tile of A reaches a tile of B without
+#  passing through a (solid) wall tile. The game then only shows the chunks
+#  visible from the player's chunk. This only makes sense for levels in
+#  which walls block the view completely (interiors), in exteriors things
+#  behind walls can be seen over them.
+#
+#  The sets are saved next to the level file (see get_pvs_filename), usage:
+#
+#  python pvs.py level_file [chunk_size]
+
+import os
+import struct
+import sys
+import zlib
+from math import sqrt
+
+from level import *
+from chunked_level import *
+
+PVS_MAGIC = b"PVS1"
+PVS_HEADER_FORMAT = "<4sIIII"          ##< magic, level width, level height, chunk size, occluder checksum
+PVS_SAMPLE_OFFSETS = [(0.0,0.0),(-0.4,-0.4),(0.4,-0.4),(-0.4,0.4),(0.4,0.4)]   ##< points of a tile the lines are cast between, relative to the tile center
+
+## Returns the name of the PVS file of given level file.
+
+def get_pvs_filename(level_filename):
+  return level_filename + ".pvs"
+
+## Returns the grid of tiles that block the view (walls with a model) as
+#  a list of columns of bools.
+
+def get_occluder_grid(level):
+  grid = level.layout.get_solid_wall_grid(level.model_palette)
+
+  if numpy != None and isinstance(grid,numpy.ndarray):
+    return grid.tolist()
+
+  return grid
+
+## Returns a checksum of the occluder grid, used to detect PVS files that
+#  don't match the level anymore.
+
+def get_occluder_checksum(occluders):
+  return zlib.crc32(bytes(bytearray(1 if value else 0 for column in occluders for value in column))) & 0xffffffff
+
+## Checks if a straight line between two points (tile centers are at
+#  integer coordinates) only passes through tiles that aren't occluders,
+#  the tiles of the end points are not checked. The tiles are walked as in
+#  a DDA.
+
+def is_line_clear(occluders, start, end):
+  x = int(start[0] + 0.5)
+  y = int(start[1] + 0.5)
+  end_x = int(end[0] + 0.5)
+  end_y = int(end[1] + 0.5)
+  dx = end[0] - start[0]
+  dy = end[1] - start[1]
+  step_x = 1 if dx > 0 else -1
+  step_y = 1 if dy > 0 else -1
+
+  # line parameters (0 = start, 1 = end) of the next tile borders and between two borders:
+
+  next_x = (x + 0.5 * step_x - start[0]) / dx if dx != 0 else 2.0
+  next_y = (y + 0.5 * step_y - start[1]) / dy if dy != 0 else 2.0
+  delta_x = abs(1.0 / dx) if dx != 0 else 2.0
+  delta_y = abs(1.0 / dy) if dy != 0 else 2.0
+
+  while x != end_x or y != end_y:
+    if next_x < next_y:
+      if next_x > 1.0:
+        break
+
+      x += step_x
+      next_x += delta_x
+    else:
+      if next_y > 1.0:
+        break
+
+      y += step_y
+      next_y += delta_y
+
+    if (x != end_x or y != end_y) and occluders[x][y]:
+      return False
+
+  return True
+
+## Returns the list of sample points of the tiles in given region, if
+#  open_only is True, only tiles that aren't occluders are sampled.
+#  Occluders that don't neighbour with a free tile can't be seen and are
+#  skipped.
+
+def get_sample_points(occluders, region, open_only):
+  x, y, width, height = region
+  level_width = len(occluders)
+  level_height = len(occluders[0])
+  result = []
+
+  for i in range(x,x + width):
+    for j in range(y,y + height):
+      if occluders[i][j]:
+        if open_only:
+          continue
+
+        if not any(0 <= i + offset[0] < level_width and 0 <= j + offset[1] < level_height and not occluders[i + offset[0]][j + offset[1]] for offset in NEIGHBOUR_OFFSETS):
+          continue
+
+      result.append([(i + offset[0],j + offset[1]) for offset in PVS_SAMPLE_OFFSETS])
+
+  return result
+
+## Checks if any line between the source and target sample points (see
+#  get_sample_points) is clear, tile centers are tried first.
+
+def is_any_line_clear(occluders, source_points, target_points):
+  for source_tile in source_points:
+    for target_tile in target_points:
+      if is_line_clear(occluders,source_tile[0],target_tile[0]):
+        return True
+
+  for source_tile in source_points:
+    for target_tile in target_points:
+      for source in source_tile:
+        for target in target_tile:
+          if is_line_clear(occluders,source,target):
+            return True
+
+  return False
+
+## Returns the distance between two tile regions (0 if they touch).
+
+def get_region_distance(region1, region2):
+  dx = max(region1[0] - (region2[0] + region2[2]),region2[0] - (region1[0] + region1[2]),0)
+  dy = max(region1[1] - (region2[1] + region2[3]),region2[1] - (region1[1] + region1[3]),0)
+  return sqrt(dx * dx + dy * dy)
+
+## Computes the PVS of all chunks of given level.
+#
+#  @param max_distance chunks farther than this (in tiles) are never
+#         considered visible (e.g. the fog end distance)
+#  @param progress optional function f(chunks done,chunk count)
+
+def compute_pvs(level, chunk_size, max_distance, progress=None):
+  width = level.get_width()
+  height = level.get_height()
+  occluders = get_occluder_grid(level)
+  chunk_columns, chunk_rows = get_chunk_count(width,height,chunk_size)
+  chunks = [(chunk_x,chunk_y) for chunk_x in range(chunk_columns) for chunk_y in range(chunk_rows)]
+  regions = dict((chunk,get_chunk_region(width,height,chunk_size,chunk[0],chunk[1])) for chunk in chunks)
+  target_points = dict((chunk,get_sample_points(occluders,regions[chunk],False)) for chunk in chunks)
+  visible_chunks = {}
+
+  for chunk_index, chunk in enumerate(chunks):
+    source_points = get_sample_points(occluders,regions[chunk],True)
+
+    if len(source_points) != 0:
+      visible = set([chunk])
+
+      for other in chunks:
+        if other != chunk and get_region_distance(regions[chunk],regions[other]) <= max_distance and is_any_line_clear(occluders,source_points,target_points[other]):
+          visible.add(other)
+
+      visible_chunks[chunk] = visible
+
+    if progress != None:
+      progress(chunk_index + 1,len(chunks))
+
+  return PotentiallyVisibleSets(width,height,chunk_size,get_occluder_checksum(occluders),visible_chunks)
+
+## Potentially visible sets of all chunks of a level.
+
+class PotentiallyVisibleSets:
+  def __init__(self, width, height, chunk_size, checksum, visible_chunks):
+    self.width = width
+    self.height = height
+    self.chunk_size = chunk_size
+    self.checksum = checksum                 ##< occluder checksum of the level the sets were computed for
+    self.visible_chunks = visible_chunks     ##< (chunk x,chunk y) => set of chunks visible from it
+
+  def get_chunk_size(self):
+    return self.chunk_size
+
+  ## Returns the set of chunks potentially visible from given chunk
+  #  (including the chunk itself), None if nothing is known (all chunks
+  #  should be considered visible).
+
+  def get_visible_chunks(self, chunk):
+    return self.visible_chunks.get(chunk)
+
+  ## Checks if the sets were computed for given level and chunk size (with
+  #  the same walls).
+
+  def matches(self, level, chunk_size):
+    return (self.width,self.height,self.chunk_size) == (level.get_width(),level.get_height(),chunk_size) and self.checksum == get_occluder_checksum(get_occluder_grid(level))
+
+  def save(self, filename):
+    chunk_columns, chunk_rows = get_chunk_count(self.width,self.height,self.chunk_size)
+    output_file = open(filename,"wb")
+    output_file.write(struct.pack(PVS_HEADER_FORMAT,PVS_MAGIC,self.width,self.height,self.chunk_size,self.checksum))
+
+    for chunk_x in range(chunk_columns):
+      for chunk_y in range(chunk_rows):
+        visible = sorted(self.visible_chunks.get((chunk_x,chunk_y),[]))
+        indices = [visible_chunk[0] * chunk_rows + visible_chunk[1] for visible_chunk in visible]
+        output_file.write(struct.pack("<I" + str(len(indices)) + "I",len(indices),*indices))
+
+    output_file.close()
+
+  @staticmethod
+  def load(filename):
+    input_file = open(filename,"rb")
+    data = input_file.read()
+    input_file.close()
+
+    magic, width, height, chunk_size, checksum = struct.unpack_from(PVS_HEADER_FORMAT,data,0)
+
+    if magic != PVS_MAGIC:
+      raise IOError("'" + filename + "' is not a PVS file")
+
+    chunk_columns, chunk_rows = get_chunk_count(width,height,chunk_size)
+    offset = struct.calcsize(PVS_HEADER_FORMAT)
+    visible_chunks = {}
+
+    for chunk_x in range(chunk_columns):
+      for chunk_y in range(chunk_rows):
+        count = struct.unpack_from("<I",data,offset)[0]
+        indices = struct.unpack_from("<" + str(count) + "I",data,offset + 4)
+        offset += 4 + 4 * count
+
+        if count != 0:
+          visible_chunks[(chunk_x,chunk_y)] = set((index // chunk_rows,index % chunk_rows) for index in indices)
+
+    return PotentiallyVisibleSets(width,height,chunk_size,checksum,visible_chunks)
+
+## Loads the PVS of given level file if it exists and matches the level
+#  and chunk size, otherwise returns None. Chunked levels are not supported
+#  (the whole level would have to be loaded).
+
+def load_level_pvs(level_filename, level, chunk_size):
+  if isinstance(level,ChunkedLevel) or not os.path.isfile(get_pvs_filename(level_filename)):
+    return None
+
+  result = PotentiallyVisibleSets.load(get_pvs_filename(level_filename))
+
+  if not result.matches(level,chunk_size):
+    print("PVS file '" + get_pvs_filename(level_filename) + "' doesn't match the level, not using it")
+    return None
+
+  return result
+
+if __name__ == "__main__":
+  if len(sys.argv) not in (2,3):
+    print("usage: python pvs.py level_file [chunk_size]")
+    sys.exit(1)
+
+  from game_settings import *
+  from main import Game
+
+  load_settings()
+  level = load_level(sys.argv[1])
+
+  if isinstance(level,ChunkedLevel):
+    print("chunked levels are not supported")
+    sys.exit(1)
+  chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else get_level_chunk_size(Game.CHUNK_SIZE)
+
+  def print_progress(done, count):
+    if done % 64 == 0 or done == count:
+      print("computed " + str(done) + "/" + str(count) + " chunks")
+
+  sets = compute_pvs(level,chunk_size,level.get_fog_distance() + Game.FOG_RANGE,print_progress)
+  sets.save(get_pvs_filename(sys.argv[1]))
+
+  visible_counts = [len(visible) for visible in sets.visible_chunks.values()]
+  print("saved " + get_pvs_filename(sys.argv[1]) + ", visible chunks on average: " + str(sum(visible_counts) / float(max(len(visible_counts),1))))
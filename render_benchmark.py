@@ -0,0 +1,280 @@
+## Compares frame times of rendering a level along a camera path with and
+#  without the PVS (see pvs), in an offscreen buffer without any frame rate
+#  limit. The path is either recorded (see camera_path) or walks over
+#  steppable tiles through sample positions spread over the level, the
+#  level geometry is streamed and hidden the same way as in the game. Frame
+#  time percentiles and the time spent in the cull and draw traversals are
+#  reported, optionally also as JSON that can be compared across commits.
+#  Usage:
+#
+#  python render_benchmark.py [options] [level_file]
+#
+#  -c chunk_size  size of the level chunks
+#  -g size        benchmark a generated level of size x size tiles made of
+#                 the level (see level_generator)
+#  -p path_file   replay a recorded camera path
+#  -w path_file   save the camera path (to be replayed later)
+#  -f frames      render at most this many frames of the path
+#  -j json_file   write the results as JSON
+#
+#  The PVS comparison is only made for level files that aren't chunked (or
+#  generated).
+
+import sys
+import time
+import json
+from math import atan2, degrees
+from collections import deque
+
+from panda3d.core import *
+from direct.showbase.ShowBase import ShowBase
+
+from chunked_level import *
+from scene_builder import *
+from chunk_mesher import *
+from game_settings import *
+from pvs import *
+from camera_path import *
+from level_generator import generate_level
+from chunk_benchmark import get_sample_positions, make_scene_streamer, setup_lens
+from main import Game
+
+DEFAULT_LEVEL = "test_interior.txt"
+PATH_STEP = Game.MOVEMENT_SPEED / 60.0       ##< distance the camera moves in one frame (walking at 60 FPS)
+LOOK_AHEAD = 8                               ##< the camera looks at the path point this many steps ahead
+PRELOAD_SIZE = 64                            ##< models and textures are loaded by building a region of this size before the measuring
+PERCENTILES = [0.5,0.95,0.99]
+WARMUP_FRAMES = 3                            ##< frames rendered from the first pose before each run without being measured (the first frames upload the textures and vertex buffers)
+
+## Returns the shortest list of tiles from start to end going over
+#  steppable tiles (4-neighbourhood), None if there is no such path.
+
+def find_tile_path(level, start, end):
+  previous = {start: None}
+  queue = deque([start])
+
+  while len(queue) > 0:
+    tile = queue.popleft()
+
+    if tile == end:
+      result = []
+
+      while tile != None:
+        result.append(tile)
+        tile = previous[tile]
+
+      return result[::-1]
+
+    for offset in NEIGHBOUR_OFFSETS:
+      neighbour = (tile[0] + offset[0],tile[1] + offset[1])
+
+      if not neighbour in previous and level.is_inside(neighbour[0],neighbour[1]) and level.get_tile(neighbour[0],neighbour[1]).steppable:
+        previous[neighbour] = tile
+        queue.append(neighbour)
+
+  return None
+
+## Makes the camera path as a list of (x,y) positions PATH_STEP apart,
+#  going through the reachable ones of given waypoints in order.
+
+def make_camera_path(level, waypoints):
+  tiles = [waypoints[0]]
+
+  for waypoint in waypoints[1:]:
+    tile_path = find_tile_path(level,tiles[-1],waypoint)
+
+    if tile_path != None:
+      tiles += tile_path[1:]
+
+  result = []
+
+  for i in range(len(tiles) - 1):
+    steps = int(round(1.0 / PATH_STEP))
+
+    for step in range(steps):
+      t = step / float(steps)
+      result.append((tiles[i][0] + (tiles[i + 1][0] - tiles[i][0]) * t,tiles[i][1] + (tiles[i + 1][1] - tiles[i][1]) * t))
+
+  return result + [tiles[-1]]
+
+## Makes the camera poses (see camera_path) for a path made by
+#  make_camera_path, the camera looks at the path point LOOK_AHEAD steps
+#  ahead.
+
+def make_camera_poses(path):
+  result = []
+  heading = 0.0
+
+  for i, position in enumerate(path):
+    target = path[min(i + LOOK_AHEAD,len(path) - 1)]
+
+    if target != position:     # the heading of the camera looking along +x is 0, see Simulation.move_with_collisions
+      heading = degrees(atan2(-(target[1] - position[1]),target[0] - position[0])) % 360
+
+    result.append((position[0],position[1],Game.CAMERA_HEIGHT,heading,0.0))
+
+  return result
+
+def get_percentile(sorted_values, fraction):
+  return sorted_values[min(int(fraction * len(sorted_values)),len(sorted_values) - 1)]
+
+## Measures the time the cull and draw traversals of a display region take,
+#  using the cull and draw callbacks of the region (which then do the
+#  traversals themselves). Only meaningful with the single threaded
+#  pipeline (the default).
+
+class TraversalTimer:
+  def __init__(self, display_region):
+    self.cull_times = []
+    self.draw_times = []
+    display_region.setCullCallback(PythonCallbackObject(self.cull))
+    display_region.setDrawCallback(PythonCallbackObject(self.draw))
+
+  def cull(self, callback_data):
+    start = time.time()
+    callback_data.upcall()
+    self.cull_times.append(time.time() - start)
+
+  def draw(self, callback_data):
+    start = time.time()
+    callback_data.upcall()
+    self.draw_times.append(time.time() - start)
+
+  def clear(self):
+    self.cull_times = []
+    self.draw_times = []
+
+## Renders the level along the path (list of camera poses), returns a tuple
+#  (frame times,cull times,draw times,average number of shown chunks),
+#  times in seconds. WARMUP_FRAMES frames are rendered from the first pose
+#  before the measuring.
+
+def benchmark_path(base, builder, level, chunk_size, poses, pvs=None):
+  radius = level.get_fog_distance() + Game.FOG_RANGE
+  level_node_path = base.render.attachNewNode("level")
+  streamer = make_scene_streamer(builder,level,chunk_size,radius,level_node_path,[])
+  timer = TraversalTimer(base.cam.node().getDisplayRegion(0))
+  frame_times = []
+  shown_chunks = 0
+
+  setup_lens(base,level)
+
+  def set_pose(pose):
+    position = pose[:2]
+    streamer.update(position,True)
+    visible_chunks = pvs.get_visible_chunks(streamer.get_tile_chunk(int(position[0] + 0.5),int(position[1] + 0.5))) if pvs != None else None
+    streamer.update_visibility(position,radius,visible_chunks)
+    base.camera.setPos(position[1],position[0],pose[2])
+    base.camera.setHpr(pose[3],pose[4],0)
+
+  set_pose(poses[0])
+
+  for i in range(WARMUP_FRAMES):
+    base.graphicsEngine.renderFrame()
+
+  timer.clear()
+
+  for pose in poses:
+    set_pose(pose)
+    shown_chunks += len(streamer.get_built_chunks()) - len(streamer.get_hidden_chunks())
+
+    start = time.time()
+    base.graphicsEngine.renderFrame()
+    frame_times.append(time.time() - start)
+
+  streamer.clear()
+  level_node_path.removeNode()
+  return (frame_times,timer.cull_times,timer.draw_times,shown_chunks / float(len(poses)))
+
+## Returns the statistics of given times in seconds as a dict name =>
+#  value in milliseconds.
+
+def get_time_statistics(times):
+  sorted_times = sorted(times)
+  result = {"avg": sum(sorted_times) / max(len(sorted_times),1) * 1000,"max": sorted_times[-1] * 1000 if len(sorted_times) > 0 else 0.0}
+
+  for fraction in PERCENTILES:
+    result["p" + str(int(fraction * 100))] = get_percentile(sorted_times,fraction) * 1000 if len(sorted_times) > 0 else 0.0
+
+  return result
+
+def main():
+  arguments = sys.argv[1:]
+  load_settings()
+  chunk_size = get_level_chunk_size(Game.CHUNK_SIZE)
+  generated_size = None
+  path_filename = None
+  save_path_filename = None
+  max_frames = None
+  json_filename = None
+
+  while len(arguments) >= 2 and arguments[0] in ("-c","-g","-p","-w","-f","-j"):
+    option, value = arguments[:2]
+    arguments = arguments[2:]
+
+    if option == "-c":
+      chunk_size = int(value)
+    elif option == "-g":
+      generated_size = int(value)
+    elif option == "-p":
+      path_filename = value
+    elif option == "-w":
+      save_path_filename = value
+    elif option == "-f":
+      max_frames = int(value)
+    else:
+      json_filename = value
+
+  level_filename = arguments[0] if len(arguments) > 0 else DEFAULT_LEVEL
+  level = load_level(level_filename)
+  pvs = None
+
+  if generated_size != None:
+    level = generate_level(level,generated_size,generated_size)
+  elif not isinstance(level,ChunkedLevel):
+    pvs = load_level_pvs(level_filename,level,chunk_size)
+
+    if pvs == None:
+      print("computing the PVS (save it with: python pvs.py " + level_filename + " " + str(chunk_size) + ")")
+      pvs = compute_pvs(level,chunk_size,level.get_fog_distance() + Game.FOG_RANGE)
+
+  if isinstance(level,ChunkedLevel):
+    chunk_size = level.get_chunk_size()
+
+  poses = load_camera_path(path_filename) if path_filename != None else make_camera_poses(make_camera_path(level,get_sample_positions(level)))
+
+  if max_frames != None:
+    poses = poses[:max_frames]
+
+  if save_path_filename != None:
+    save_camera_path(save_path_filename,poses)
+
+  loadPrcFileData("","sync-video false")         # no frame rate limit, the frames are rendered directly (no ClockObject limiter)
+  base = ShowBase(windowType="offscreen")
+  ClockObject.getGlobalClock().setMode(ClockObject.MNormal)
+  scene_builder = SceneBuilder(base.loader)
+  builder = ChunkMesher(scene_builder) if Game.USE_CHUNK_MESHER else scene_builder
+
+  builder.build_tiles(level,(0,0,min(level.get_width(),PRELOAD_SIZE),min(level.get_height(),PRELOAD_SIZE))).removeNode()   # load the models and textures
+
+  level_name = level_filename + (" generated " + str(generated_size) + "x" + str(generated_size) if generated_size != None else "")
+  results = {"level": level_name,"chunk_size": chunk_size,"frames": len(poses),"runs": {}}
+
+  print("level " + level_name + ", chunk size " + str(chunk_size) + ", " + str(len(poses)) + " frames")
+  print("%-8s %14s %14s %14s %14s %14s %14s %12s" % ("PVS","frame avg (ms)","median (ms)","95 % (ms)","99 % (ms)","cull avg (ms)","draw avg (ms)","chunks shown"))
+
+  for name, used_pvs in [("off",None)] + ([("on",pvs)] if pvs != None else []):
+    frame_times, cull_times, draw_times, shown_chunks = benchmark_path(base,builder,level,chunk_size,poses,used_pvs)
+    frame_statistics = get_time_statistics(frame_times)
+    cull_statistics = get_time_statistics(cull_times)
+    draw_statistics = get_time_statistics(draw_times)
+    results["runs"]["pvs " + name] = {"frame_ms": frame_statistics,"cull_ms": cull_statistics,"draw_ms": draw_statistics,"chunks_shown": shown_chunks}
+    print("%-8s %14.2f %14.2f %14.2f %14.2f %14.2f %14.2f %12.1f" % (name,frame_statistics["avg"],frame_statistics["p50"],frame_statistics["p95"],frame_statistics["p99"],cull_statistics["avg"],draw_statistics["avg"],shown_chunks))
+
+  if json_filename != None:
+    output_file = open(json_filename,"w")
+    json.dump(results,output_file,indent=2,sort_keys=True,separators=(",",": "))
+    output_file.close()
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,197 @@
+## Building of the level scene nodes (see Game.setup_environment_scene).
+#  Models and textures are cached, level geometry is built by chunks so
+#  that it can be streamed (see level_streaming).
+
+from panda3d.core import *
+from direct.actor.Actor import Actor
+
+from general import *
+from level import *
+
+PROP_COLLIDE_MASK = BitMask32.bit(1)                       ##< collide mask of prop collision solids (see add_collision_box)
+ITEM_COLLIDE_MASK = BitMask32.bit(2)                       ##< collide mask of item collision solids
+OCCLUDER_COLLIDE_MASK = BitMask32.bit(3)                   ##< collide mask of wall boxes (see build_occluders)
+
+class SceneBuilder:
+  OCCLUDER_HEIGHT = 2.0                                    ##< height of the wall boxes made by build_occluders
+  WALL_OFFSETS = [[0,0.5], [0.5,0], [-0.5,0], [0,-0.5]]    ##< positions of wall faces, down, right, left, up (as NEIGHBOUR_OFFSETS)
+  WALL_ROTATIONS = [-90, 0, 180, 90]
+
+  def __init__(self, loader):
+    self.loader = loader
+    self.models = {}                                       ##< model cache
+    self.textures = {}                                     ##< texture cache
+    self.model_bounds = {}                                 ##< model name => bounding box, see get_model_bounds
+    self.overlay_texture_stage = TextureStage("ts")
+
+  ## Loads model into the cache (only if it hasn't been loaded already) and returns it.
+
+  def load_model(self, model_name):
+    if not model_name in self.models:
+      self.models[model_name] = self.loader.loadModel(RESOURCE_PATH + model_name)
+
+    return self.models[model_name]
+
+  ## Loads texture into the cache (only if it hasn't been loaded already) and returns it.
+
+  def load_texture(self, texture_name):
+    if not texture_name in self.textures:
+      self.textures[texture_name] = self.loader.loadTexture(RESOURCE_PATH + texture_name)
+      self.textures[texture_name].setMinfilter(Texture.FTLinearMipmapLinear)
+      self.textures[texture_name].setWrapU(Texture.WM_clamp)
+      self.textures[texture_name].setWrapV(Texture.WM_clamp)
+
+    return self.textures[texture_name]
+
+  ## Returns the bounding box of given model as a tuple (min point,max
+  #  point) in the model coordinates, None for an empty model.
+
+  def get_model_bounds(self, model_name):
+    if not model_name in self.model_bounds:
+      self.model_bounds[model_name] = self.load_model(model_name).getTightBounds()
+
+    return self.model_bounds[model_name]
+
+  def make_npc_node(self, name, texture_name):
+    result = Actor(RESOURCE_PATH + name + ".egg")
+    result.setTexture(self.load_texture(texture_name))
+    return result
+
+  ## Makes a node out of AnimatedTextureModel object, handles loading models
+  #  and textures and caches.
+
+  def make_node(self, animated_texture_model, name="node"):
+    model = self.load_model(animated_texture_model.model_name)
+
+    textures_for_node = []
+
+    for texture_name in animated_texture_model.texture_names:
+      if len(texture_name) != 0:
+        textures_for_node.append(self.load_texture(texture_name))
+
+    framerate = animated_texture_model.framerate
+
+    if len(textures_for_node) in [0,1]:
+      node = PandaNode(name)
+      node_path = NodePath(node)
+      model.instanceTo(node_path)
+
+      if len(textures_for_node) == 1:
+        node_path.setTexture(textures_for_node[0])
+
+      node_path.set_bin("opaque",1)
+
+      return node
+    else:  # node with animated texture
+      sequence_node = SequenceNode(name)
+      sequence_node.setFrameRate(framerate)
+      node_path = NodePath(sequence_node)
+
+      for texture in textures_for_node:
+        helper_node = node_path.attachNewNode("frame")
+        model.instanceTo(helper_node)
+        helper_node.setTexture(texture)
+
+      node_path.set_bin("opaque",1)
+
+      sequence_node.loop(True)
+
+      return sequence_node
+
+  def add_overlay_texture(self, node_path, texture_name):
+    node_path.setTexture(self.overlay_texture_stage,self.load_texture(texture_name))
+
+  ## Makes the geometry under given node path (e.g. of a prop) not
+  #  collidable and adds a collision box made from the bounds of given model
+  #  with given collide mask instead, so that collision rays only test one
+  #  box per object. Nothing is added for empty models.
+
+  def add_collision_box(self, node_path, model_name, collide_mask):
+    node_path.setCollideMask(BitMask32.allOff())
+    bounds = self.get_model_bounds(model_name)
+
+    if bounds != None:
+      collision_node = CollisionNode("collision")
+      collision_node.addSolid(CollisionBox(bounds[0],bounds[1]))
+      collision_node.setIntoCollideMask(collide_mask)
+      node_path.attachNewNode(collision_node)
+
+  ## Builds a coarse collision layer of the (solid) walls in given region
+  #  of the level: one box for each run of wall tiles in a tile row, with
+  #  OCCLUDER_COLLIDE_MASK. Returns the node path.
+
+  def build_occluders(self, level, region):
+    x, y, width, height = region
+    walls = crop_grid(level.get_wall_grids(region)[1],1,1,width,height,False)
+    collision_node = CollisionNode("occluders " + str(x) + " " + str(y))
+
+    for j in range(height):
+      i = 0
+
+      while i < width:
+        if not walls[i][j]:
+          i += 1
+          continue
+
+        run_start = i
+
+        while i < width and walls[i][j]:
+          i += 1
+
+        # tiles are placed with x and y swapped, tile centers at integers:
+
+        collision_node.addSolid(CollisionBox(Point3(y + j - 0.5,x + run_start - 0.5,0),Point3(y + j + 0.5,x + i - 0.5,SceneBuilder.OCCLUDER_HEIGHT)))
+
+    collision_node.setIntoCollideMask(OCCLUDER_COLLIDE_MASK)
+    return NodePath(collision_node)
+
+  ## Builds the geometry of the tiles in given region (x,y,width,height) of
+  #  the level and returns it as a flattened NodePath.
+
+  def build_tiles(self, level, region):
+    x, y, width, height = region
+    result = NodePath(PandaNode("sublevel " + str(x) + " " + str(y)))
+
+    exposed_wall_faces = level.get_exposed_wall_faces(region)
+    shadowed_tiles = level.get_shadowed_tiles(region)
+
+    for j in range(y,y + height):
+      for i in range(x,x + width):
+        tile = level.get_tile(i,j)
+        coordinate_string = str(i) + " " + str(j)
+
+        if not tile.is_empty():
+          if not tile.wall: # floor tile
+            tile_node_path = result.attachNewNode(self.make_node(tile.floor_model,"tile " + coordinate_string))
+            tile_node_path.setPos(j,i,0)
+            tile_node_path.setHpr(90,90,tile.floor_orientation * 90)
+
+            # add wall shadows to the tile:
+
+            if shadowed_tiles[i - x][j - y]:
+              self.add_overlay_texture(tile_node_path,"tile_shadow.png")
+
+          else:             # wall
+            offsets = SceneBuilder.WALL_OFFSETS
+            rotations = SceneBuilder.WALL_ROTATIONS
+
+            for k in range(4):  # 4 walls (one for each direction)
+              # check if the wall needs to be created:
+
+              if not exposed_wall_faces[k][i - x][j - y]:
+                continue
+
+              tile_node_path = result.attachNewNode(self.make_node(tile.wall_model,"wall " + coordinate_string))
+              tile_node_path.setPos(j + offsets[k][1],i + offsets[k][0],0)
+              tile_node_path.setHpr(90,90,rotations[k])
+
+        if tile.ceiling:
+          tile_node_path = result.attachNewNode(self.make_node(tile.ceiling_model,"ceiling " + coordinate_string))
+          tile_node_path.setPos(j,i,tile.ceiling_height)
+          tile_node_path.setHpr(90,90,tile.floor_orientation * 90)
+
+    # optimisation: group the nodes together:
+
+    result.flattenStrong()
+    result.setCollideMask(BitMask32.allOff())     # level geometry is never picked, see add_collision_box
+    return result
@@ -0,0 +1,199 @@
+## Cache of baked level geometry. The flattened tile geometry of each chunk
+#  (see SceneBuilder.build_tiles and ChunkMesher.build_tiles) is saved into a BAM file named by a hash
+#  of everything it depends on: the tiles of the chunk and its neighbour
+#  tiles, the model definitions and the content of the model and texture
+#  files. When the hash matches, the chunk is loaded from the file instead
+#  of being built. Old files are never used (a changed level or resource
+#  gives a different hash), the whole cache directory can be deleted any
+#  time.
+#
+#  The game only reads the cache (a chunk that isn't cached is built), the
+#  cache is filled in advance (e.g. when a level is released) with:
+#
+#  python scene_cache.py level_file [chunk_size]
+
+import hashlib
+import os
+import sys
+
+from panda3d.core import *
+
+from chunked_level import *
+from scene_builder import *
+from chunk_mesher import *
+
+SCENE_CACHE_VERSION = 2                  ##< has to be increased when the way the geometry is built changes
+DEFAULT_SCENE_CACHE_PATH = "scene_cache/"
+
+class SceneCache:
+  ## Creates the cache.
+  #
+  #  @param builder SceneBuilder or ChunkMesher used to build the chunks that
+  #         are not cached
+  #  @param path directory of the cached files
+  #  @param write_missing whether chunks that had to be built are saved to
+  #         the cache
+
+  def __init__(self, builder, path=DEFAULT_SCENE_CACHE_PATH, write_missing=True):
+    self.builder = builder
+    self.path = path
+    self.write_missing = write_missing
+    self.resource_hashes = {}            ##< resource file name => hash of its content
+    self.hits = 0                        ##< number of chunks loaded from the cache
+    self.misses = 0                      ##< number of chunks that had to be built
+
+  ## Returns a hash of the content of given resource file.
+
+  def get_resource_hash(self, filename):
+    try:
+      return self.resource_hashes[filename]
+    except KeyError:
+      pass
+
+    digest = hashlib.sha1(filename.encode("utf-8"))
+
+    try:
+      resource_file = open(RESOURCE_PATH + filename,"rb")
+      digest.update(resource_file.read())
+      resource_file.close()
+    except IOError:
+      pass             # missing files are hashed by name only
+
+    self.resource_hashes[filename] = digest.hexdigest()
+    return self.resource_hashes[filename]
+
+  ## Computes the cache key of the tile geometry of given region of the level.
+
+  def get_chunk_key(self, level, region):
+    x, y, width, height = region
+    left = max(x - 1,0)
+    top = max(y - 1,0)
+    padded_region = (left,top,min(x + width + 1,level.get_width()) - left,min(y + height + 1,level.get_height()) - top)
+
+    grids = [level.layout.get_grid(attribute_index,padded_region) for attribute_index in range(len(TILE_ATTRIBUTES))]
+    model_attributes = [TILE_ATTRIBUTE_INDICES[attribute] for attribute in TILE_MODEL_ATTRIBUTES]
+    models = level.model_palette.values
+    used_models = set()
+
+    for attribute_index in model_attributes:
+      if numpy != None and isinstance(grids[attribute_index],numpy.ndarray):
+        used_models.update(numpy.unique(grids[attribute_index]).tolist())
+      else:
+        used_models.update(value for column in grids[attribute_index] for value in column)
+
+    # model palette indices depend on the order in which things were loaded, number the models by their definitions instead:
+
+    used_models = sorted(used_models,key=lambda model_index: models[model_index])
+    model_numbers = dict((model_index,number) for number, model_index in enumerate(used_models))
+
+    digest = hashlib.sha1(repr((SCENE_CACHE_VERSION,self.builder.__class__.__name__,region,padded_region)).encode("utf-8"))
+    digest.update(repr([models[model_index] for model_index in used_models]).encode("utf-8"))
+
+    for attribute_index, grid in enumerate(grids):
+      if numpy != None and isinstance(grid,numpy.ndarray):
+        if attribute_index in model_attributes:
+          numbers = numpy.zeros(len(models),dtype="uint32")
+          numbers[used_models] = numpy.arange(len(used_models),dtype="uint32")
+          grid = numbers[grid]
+
+        digest.update(numpy.ascontiguousarray(grid).tobytes())
+      else:
+        if attribute_index in model_attributes:
+          grid = [[model_numbers[value] for value in column] for column in grid]
+
+        digest.update(repr(grid).encode("utf-8"))
+
+    for model_index in used_models:
+      for filename in [models[model_index][0]] + list(models[model_index][1]):
+        if len(filename) != 0:
+          digest.update(self.get_resource_hash(filename).encode("utf-8"))
+
+    digest.update(self.get_resource_hash("tile_shadow.png").encode("utf-8"))   # overlay texture used by the builder
+    return digest.hexdigest()
+
+  def get_filename(self, key):
+    return os.path.join(self.path,key + ".bam")
+
+  ## Returns the tile geometry of given region of the level as a NodePath,
+  #  loaded from the cache if possible, otherwise built (and saved to the
+  #  cache if write_missing is True).
+
+  def get_tiles(self, level, region):
+    filename = self.get_filename(self.get_chunk_key(level,region))
+
+    if os.path.isfile(filename):
+      result = self.builder.loader.loadModel(Filename.fromOsSpecific(filename),noCache=True,okMissing=True)
+
+      if result != None:
+        self.hits += 1
+        result.setName("sublevel " + str(region[0]) + " " + str(region[1]))
+        return result
+
+    self.misses += 1
+    result = self.builder.build_tiles(level,region)
+
+    if self.write_missing:
+      try:
+        self.save(result,filename)
+      except (IOError,OSError):
+        self.write_missing = False       # e.g. a read-only directory, don't try again
+
+    return result
+
+  def save(self, node_path, filename):
+    if not os.path.isdir(self.path):
+      os.makedirs(self.path)
+
+    node_path.writeBamFile(Filename.fromOsSpecific(filename))
+
+  ## Builds and saves all the chunks of given level that aren't cached yet.
+  #  Chunks of ChunkedLevel are unloaded when done.
+  #
+  #  @param chunk_size chunk size, ignored for ChunkedLevel
+  #  @param progress optional function f(chunks done,chunk count)
+
+  def bake_level(self, level, chunk_size, progress=None):
+    chunked = isinstance(level,ChunkedLevel)
+
+    if chunked:
+      chunk_size = level.get_chunk_size()
+
+    chunk_columns, chunk_rows = get_chunk_count(level.get_width(),level.get_height(),chunk_size)
+
+    for chunk_x in range(chunk_columns):
+      for chunk_y in range(chunk_rows):
+        region = get_chunk_region(level.get_width(),level.get_height(),chunk_size,chunk_x,chunk_y)
+        filename = self.get_filename(self.get_chunk_key(level,region))
+
+        if not os.path.isfile(filename):
+          node_path = self.builder.build_tiles(level,region)
+          self.save(node_path,filename)
+          node_path.removeNode()
+
+        if progress != None:
+          progress(chunk_x * chunk_rows + chunk_y + 1,chunk_columns * chunk_rows)
+
+      if chunked:            # only the previous column is still needed (for the walls on the chunk border)
+        for chunk in level.get_loaded_chunks():
+          if chunk[0] < chunk_x:
+            level.unload_chunk(chunk[0],chunk[1])
+
+if __name__ == "__main__":
+  if len(sys.argv) not in (2,3):
+    print("usage: python scene_cache.py level_file [chunk_size]")
+    sys.exit(1)
+
+  from direct.showbase.ShowBase import ShowBase
+  from game_settings import *
+  import main
+
+  base = ShowBase(windowType="none")
+
+  def print_progress(done, count):
+    if done % 64 == 0 or done == count:
+      print("baked " + str(done) + "/" + str(count) + " chunks")
+
+  builder = SceneBuilder(base.loader)
+  cache = SceneCache(ChunkMesher(builder) if main.Game.USE_CHUNK_MESHER else builder)
+  load_settings()
+  cache.bake_level(load_level(sys.argv[1]),int(sys.argv[2]) if len(sys.argv) > 2 else get_level_chunk_size(main.Game.CHUNK_SIZE),print_progress)
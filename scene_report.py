@@ -0,0 +1,286 @@
+## Statistics of the level scene graph: walks the level node (as
+#  Game.level_node_path after Game.setup_environment_scene, each child of
+#  it being a chunk) and counts the nodes, geoms (draw calls), vertices and
+#  distinct render states per chunk, per model and per texture. The geom
+#  count of a chunk shows how well its geometry got merged (by
+#  flattenStrong or ChunkMesher). Chunks over the budgets are flagged. The
+#  script builds whole levels offscreen the same way as the game does
+#  (tiles, props and items by chunks) and exits with 1 if any chunk is over
+#  budget, so that it can check the sample levels in CI. Usage:
+#
+#  python scene_report.py [-c chunk_size] [-b budgets] [-n lines] [-j json_file] [level_file ...]
+#
+#  -c chunk_size  size of the level chunks, default Game.CHUNK_SIZE (the
+#                 settings file is not used so that the results don't
+#                 depend on the machine)
+#  -b budgets     comma separated budgets of one chunk overriding the
+#                 default ones (see DEFAULT_BUDGETS), e.g. geoms=32,states=16
+#  -n lines       show at most this many models and textures, default 10
+#  -j json_file   write the reports as JSON
+#
+#  Without level files the sample levels are reported.
+
+import sys
+import json
+
+from panda3d.core import *
+from direct.showbase.ShowBase import ShowBase
+
+from general import *
+from chunked_level import *
+from scene_builder import *
+from chunk_mesher import *
+from game_database import *
+from main import Game
+
+SAMPLE_LEVELS = ["test_interior.txt","test_exterior.txt"]
+DEFAULT_BUDGETS = {"nodes": 100,"geoms": 24,"vertices": 4000,"states": 12}   ##< maximum counts in one chunk of the default chunk size, bigger chunks need bigger budgets (-b)
+DEFAULT_LINES = 10
+COUNTS = ["nodes","geoms","vertices","states"]
+
+## Counts of a part of the scene (a chunk, a model or a texture).
+
+class SceneStatistics:
+  def __init__(self):
+    self.nodes = 0
+    self.geoms = 0
+    self.vertices = 0
+    self.states = set()              ##< distinct net render states of the geoms
+
+  def add_geom(self, state, vertices):
+    self.geoms += 1
+    self.vertices += vertices
+    self.states.add(state)
+
+  ## Returns the counts as a dict name => value (see COUNTS).
+
+  def get_counts(self):
+    return {"nodes": self.nodes,"geoms": self.geoms,"vertices": self.vertices,"states": len(self.states)}
+
+## Returns the names of the textures in given RenderState.
+
+def get_texture_names(state):
+  texture_attrib = state.getAttrib(TextureAttrib.getClassType())
+
+  if texture_attrib == None:
+    return []
+
+  result = []
+
+  for i in range(texture_attrib.getNumOnStages()):
+    texture = texture_attrib.getOnTexture(texture_attrib.getOnStage(i))
+    result.append(texture.getFilename().getBasename() if not texture.getFilename().empty() else texture.getName())
+
+  return result
+
+## Statistics of the scene under a level node.
+
+class SceneReport:
+  ## Walks given level node, each of its children (including the stashed,
+  #  i.e. hidden, ones) is taken as a chunk.
+
+  def __init__(self, level_node_path):
+    self.chunks = []                 ##< list of (chunk node name,SceneStatistics) in the order of the children
+    self.models = {}                 ##< model name => SceneStatistics, geometry not coming from a model (e.g. made by ChunkMesher) goes under its GeomNode name
+    self.textures = {}               ##< texture name => SceneStatistics
+
+    net_state = level_node_path.getNetState()
+
+    for chunk_node_path in list(level_node_path.getChildren()) + list(level_node_path.getStashedChildren()):
+      statistics = SceneStatistics()
+      self.walk(chunk_node_path.node(),net_state,None,statistics)
+      self.chunks.append((chunk_node_path.getName(),statistics))
+
+  def get_statistics(self, dictionary, name):
+    if not name in dictionary:
+      dictionary[name] = SceneStatistics()
+
+    return dictionary[name]
+
+  def walk(self, node, parent_state, model_name, chunk_statistics):
+    state = parent_state.compose(node.getState())
+
+    if node.isOfType(ModelRoot.getClassType()):
+      model_name = node.getName()
+
+    chunk_statistics.nodes += 1
+    model_statistics = None
+
+    if model_name != None or node.isGeomNode():
+      model_statistics = self.get_statistics(self.models,model_name if model_name != None else node.getName())
+      model_statistics.nodes += 1
+
+    if node.isGeomNode():
+      for i in range(node.getNumGeoms()):
+        geom_state = state.compose(node.getGeomState(i))
+        vertices = node.getGeom(i).getVertexData().getNumRows()
+        chunk_statistics.add_geom(geom_state,vertices)
+        model_statistics.add_geom(geom_state,vertices)
+
+        for texture_name in get_texture_names(geom_state) or ["(no texture)"]:
+          self.get_statistics(self.textures,texture_name).add_geom(geom_state,vertices)
+
+    for i in range(node.getNumChildren()):
+      self.walk(node.getChild(i),state,model_name,chunk_statistics)
+
+  ## Returns the total counts of all chunks (the states are distinct over
+  #  the whole scene).
+
+  def get_total(self):
+    result = SceneStatistics()
+
+    for name, statistics in self.chunks:
+      result.nodes += statistics.nodes
+      result.geoms += statistics.geoms
+      result.vertices += statistics.vertices
+      result.states |= statistics.states
+
+    return result
+
+  ## Returns a list of (chunk name,list of the names of the counts over
+  #  budget) of the chunks over given budgets (dict name => maximum).
+
+  def get_chunks_over_budget(self, budgets):
+    result = []
+
+    for name, statistics in self.chunks:
+      counts = statistics.get_counts()
+      over = [count_name for count_name in COUNTS if count_name in budgets and counts[count_name] > budgets[count_name]]
+
+      if len(over) > 0:
+        result.append((name,over))
+
+    return result
+
+  ## Returns the report as lines of text.
+  #
+  #  @param max_lines maximum number of shown models and textures (the ones
+  #         with the most vertices)
+
+  def format_text(self, budgets, max_lines=DEFAULT_LINES):
+    over_budget = dict(self.get_chunks_over_budget(budgets))
+    lines = ["%-24s %8s %8s %10s %8s" % ("chunk","nodes","geoms","vertices","states")]
+
+    for name, statistics in self.chunks:
+      counts = statistics.get_counts()
+      lines.append("%-24s %8d %8d %10d %8d%s" % (name[:24],counts["nodes"],counts["geoms"],counts["vertices"],counts["states"],
+        "  OVER BUDGET (" + ", ".join(over_budget[name]) + ")" if name in over_budget else ""))
+
+    counts = self.get_total().get_counts()
+    lines.append("%-24s %8d %8d %10d %8d" % ("total (" + str(len(self.chunks)) + " chunks)",counts["nodes"],counts["geoms"],counts["vertices"],counts["states"]))
+    lines.append("")
+    lines.append("%-24s %8s %8s %10s %8s" % ("model","nodes","geoms","vertices","states"))
+
+    for name, statistics in sorted(self.models.items(),key=lambda item: - item[1].vertices)[:max_lines]:
+      counts = statistics.get_counts()
+      lines.append("%-24s %8d %8d %10d %8d" % (name[:24],counts["nodes"],counts["geoms"],counts["vertices"],counts["states"]))
+
+    lines.append("")
+    lines.append("%-24s %8s %8s %10s %8s" % ("texture","","geoms","vertices","states"))
+
+    for name, statistics in sorted(self.textures.items(),key=lambda item: - item[1].vertices)[:max_lines]:
+      counts = statistics.get_counts()
+      lines.append("%-24s %8s %8d %10d %8d" % (name[:24],"",counts["geoms"],counts["vertices"],counts["states"]))
+
+    return lines
+
+  ## Returns the report as a dict (to be saved as JSON).
+
+  def to_dict(self, budgets):
+    return {"chunks": [dict(statistics.get_counts(),name=name) for name, statistics in self.chunks],
+      "total": self.get_total().get_counts(),
+      "models": dict((name,statistics.get_counts()) for name, statistics in self.models.items()),
+      "textures": dict((name,statistics.get_counts()) for name, statistics in self.textures.items()),
+      "over_budget": dict(self.get_chunks_over_budget(budgets))}
+
+## Builds the nodes of all chunks of the level under given level node the
+#  same way as Game.build_chunk (without the picking data and scripts).
+
+def build_level_scene(scene_builder, tile_builder, level, database, chunk_size, level_node_path):
+  if isinstance(level,ChunkedLevel):
+    chunk_size = level.get_chunk_size()
+
+  chunk_columns, chunk_rows = get_chunk_count(level.get_width(),level.get_height(),chunk_size)
+
+  for chunk_y in range(chunk_rows):
+    for chunk_x in range(chunk_columns):
+      region = get_chunk_region(level.get_width(),level.get_height(),chunk_size,chunk_x,chunk_y)
+      chunk_node_path = tile_builder.build_tiles(level,region)
+      chunk_node_path.reparentTo(level_node_path)
+
+      objects = [(prop,prop.model) for prop in level.get_objects_in_region(region,items=False)]
+
+      if database != None:
+        objects += [(item,database.get_item_types()[item.db_id].model) for item in level.get_objects_in_region(region,props=False)]
+
+      for what, model in objects:
+        object_node_path = chunk_node_path.attachNewNode(scene_builder.make_node(model))
+        object_node_path.setPos(what.position[1] - 0.5,what.position[0] - 0.5,0)
+        object_node_path.setHpr(90,90,what.orientation)
+
+      if isinstance(level,ChunkedLevel):
+        level.unload_chunk(chunk_x,chunk_y)
+
+def main():
+  arguments = sys.argv[1:]
+  chunk_size = Game.CHUNK_SIZE
+  budgets = dict(DEFAULT_BUDGETS)
+  max_lines = DEFAULT_LINES
+  json_filename = None
+
+  while len(arguments) >= 2 and arguments[0] in ("-c","-b","-n","-j"):
+    option, value = arguments[:2]
+    arguments = arguments[2:]
+
+    if option == "-c":
+      chunk_size = int(value)
+    elif option == "-b":
+      for budget in value.split(","):
+        name, maximum = budget.split("=")
+
+        if not name in COUNTS:
+          print("unknown budget " + name + ", use one of: " + ", ".join(COUNTS))
+          sys.exit(1)
+
+        budgets[name] = int(maximum)
+    elif option == "-n":
+      max_lines = int(value)
+    else:
+      json_filename = value
+
+  level_filenames = arguments if len(arguments) > 0 else SAMPLE_LEVELS
+
+  base = ShowBase(windowType="offscreen")
+  scene_builder = SceneBuilder(base.loader)
+  tile_builder = ChunkMesher(scene_builder) if Game.USE_CHUNK_MESHER else scene_builder
+  results = {"chunk_size": chunk_size,"budgets": budgets,"levels": {}}
+  chunks_over_budget = 0
+
+  for level_filename in level_filenames:
+    level = load_level(level_filename)
+    database = GameDatabase.load_from_file(RESOURCE_PATH + "/" + level.get_database_name()) if level.get_database_name() != "" else None   # without a database the items are left out
+    level_node_path = base.render.attachNewNode("level")
+    level_node_path.set_bin("opaque",1)      # as in Game.setup_environment_scene (the fog and transparency don't change the counts)
+
+    build_level_scene(scene_builder,tile_builder,level,database,chunk_size,level_node_path)
+    report = SceneReport(level_node_path)
+    level_node_path.removeNode()
+
+    print("level " + level_filename + ", chunk size " + str(level.get_chunk_size() if isinstance(level,ChunkedLevel) else chunk_size))
+    print("\n".join(report.format_text(budgets,max_lines)))
+    print("")
+
+    chunks_over_budget += len(report.get_chunks_over_budget(budgets))
+    results["levels"][level_filename] = report.to_dict(budgets)
+
+  if json_filename != None:
+    output_file = open(json_filename,"w")
+    json.dump(results,output_file,indent=2,sort_keys=True,separators=(",",": "))
+    output_file.close()
+
+  if chunks_over_budget > 0:
+    print(str(chunks_over_budget) + " chunk(s) over budget (" + ", ".join(name + " " + str(budgets[name]) for name in COUNTS if name in budgets) + ")")
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
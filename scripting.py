@@ -0,0 +1,377 @@
+## Loading and running of the game scripts (Python files in the resource
+#  directory). Each script is compiled only once into a code object, which
+#  is kept for as long as the modification time of the file stays the same,
+#  so that scripts run on every use of a prop (or once per prop when it's
+#  loaded) are not read and compiled again each time. The code objects can
+#  also be saved (marshalled) into a cache directory to skip the compiling
+#  in the next runs, the cached files are named by a hash of the script file
+#  name and hold its modification time and the interpreter magic number, a
+#  file that doesn't match is compiled again. The cache directory can be
+#  deleted any time.
+#
+#  Scripts can run over several frames: a script that uses yield at its top
+#  level is compiled as a generator function and run as a coroutine by
+#  ScriptScheduler. The yielded values say what to wait for before the
+#  script continues (see ScriptScheduler.schedule), e.g.:
+#
+#  game.script_move(source,x,y + 1,1.0)
+#  yield game.script_wait(5.0)
+#  game.script_move(source,x,y,1.0)
+
+import ast
+import hashlib
+import heapq
+import marshal
+import os
+import struct
+import time
+from collections import deque
+
+try:
+  from importlib.util import MAGIC_NUMBER
+except ImportError:
+  import imp
+  MAGIC_NUMBER = imp.get_magic()
+
+from general import *
+
+DEFAULT_SCRIPT_CACHE_PATH = "script_cache/"
+SCRIPT_CACHE_HEADER_FORMAT = "<4sd"      ##< magic number of the interpreter, modification time of the script file
+SCRIPT_FUNCTION_NAME = "__script__"      ##< name of the generator function scripts with yield are compiled into
+
+## Checks if given AST nodes contain yield outside of nested functions and
+#  classes.
+
+def contains_yield(nodes):
+  for node in nodes:
+    if isinstance(node,(ast.Yield,getattr(ast,"YieldFrom",ast.Yield))):
+      return True
+
+    if not isinstance(node,(ast.FunctionDef,ast.Lambda,ast.ClassDef)) and contains_yield(ast.iter_child_nodes(node)):
+      return True
+
+  return False
+
+## Compiles the source of a script into a code object. If the script yields
+#  at its top level, its body is put into a generator function named
+#  SCRIPT_FUNCTION_NAME, which the code only defines.
+
+def compile_script(source, filename):
+  module = ast.parse(source,filename)
+
+  if contains_yield(module.body):
+    # the function node is taken from a parsed template so that it's valid in any Python version:
+
+    wrapper = ast.parse("def " + SCRIPT_FUNCTION_NAME + "():\n  pass\n",filename)
+    wrapper.body[0].body = module.body
+    module = ast.fix_missing_locations(wrapper)
+
+  return compile(module,filename,"exec")
+
+class ScriptManager:
+  ## Creates the manager.
+  #
+  #  @param path directory of the scripts
+  #  @param cache_path directory of the saved code objects, None means the
+  #         code is only kept in memory
+  #  @param script_globals dict of the global variables the scripts see
+  #         (e.g. globals() of the game module), each script run gets its
+  #         own copy of it
+
+  def __init__(self, path=RESOURCE_PATH, cache_path=None, script_globals=None):
+    self.path = path
+    self.cache_path = cache_path
+    self.script_globals = script_globals if script_globals != None else {}
+    self.scripts = {}                    ##< script file name => (modification time,code object)
+    self.hits = 0                        ##< number of scripts run with already loaded code
+    self.misses = 0                      ##< number of scripts whose code had to be loaded or compiled
+    self.cache_loads = 0                 ##< number of misses loaded from the cache directory
+    self.compile_time = 0.0              ##< total time spent compiling scripts, in seconds
+
+  def get_cache_filename(self, filename):
+    return os.path.join(self.cache_path,hashlib.sha1(filename.encode("utf-8")).hexdigest() + ".pyc")
+
+  ## Loads the saved code of given script if it matches the modification
+  #  time, otherwise returns None.
+
+  def load_cached_code(self, filename, modification_time):
+    try:
+      input_file = open(self.get_cache_filename(filename),"rb")
+      data = input_file.read()
+      input_file.close()
+    except IOError:
+      return None
+
+    header_size = struct.calcsize(SCRIPT_CACHE_HEADER_FORMAT)
+
+    if len(data) < header_size or struct.unpack_from(SCRIPT_CACHE_HEADER_FORMAT,data,0) != (MAGIC_NUMBER,modification_time):
+      return None
+
+    try:
+      return marshal.loads(data[header_size:])
+    except (EOFError,ValueError,TypeError):
+      return None
+
+  def save_cached_code(self, filename, modification_time, code):
+    if not os.path.isdir(self.cache_path):
+      os.makedirs(self.cache_path)
+
+    output_file = open(self.get_cache_filename(filename),"wb")
+    output_file.write(struct.pack(SCRIPT_CACHE_HEADER_FORMAT,MAGIC_NUMBER,modification_time))
+    output_file.write(marshal.dumps(code))
+    output_file.close()
+
+  ## Returns the code object of given script (file name relative to the
+  #  script path), compiling it if needed. Raises the usual exceptions for
+  #  missing files and syntax errors.
+
+  def get_code(self, filename):
+    modification_time = os.path.getmtime(self.path + filename)
+    script = self.scripts.get(filename)
+
+    if script != None and script[0] == modification_time:
+      self.hits += 1
+      return script[1]
+
+    self.misses += 1
+    code = self.load_cached_code(filename,modification_time) if self.cache_path != None else None
+
+    if code != None:
+      self.cache_loads += 1
+    else:
+      start = time.time()
+      script_file = open(self.path + filename,"r")
+      source = script_file.read()
+      script_file.close()
+      code = compile_script(source,self.path + filename)
+      self.compile_time += time.time() - start
+
+      if self.cache_path != None:
+        try:
+          self.save_cached_code(filename,modification_time,code)
+        except (IOError,OSError):
+          pass           # the cache is only an optimisation
+
+    self.scripts[filename] = (modification_time,code)
+    return code
+
+  ## Runs given script with a copy of the script globals and given variables
+  #  (dict name => value) as its global variables. For scripts that yield, nothing is run yet and the
+  #  coroutine (generator) is returned, to be started by ScriptScheduler,
+  #  otherwise None is returned.
+
+  def run(self, filename, variables):
+    namespace = self.script_globals.copy()
+    namespace["__builtins__"] = __builtins__
+    namespace["__name__"] = "__script__"
+    namespace.update(variables)
+    exec(self.get_code(filename),namespace)
+
+    if SCRIPT_FUNCTION_NAME in namespace:
+      return namespace[SCRIPT_FUNCTION_NAME]()
+
+    return None
+
+## Waits for given time in seconds.
+
+class WaitSeconds:
+  def __init__(self, seconds):
+    self.seconds = seconds
+
+## Waits for given number of frames (1 = continue in the next frame).
+
+class WaitFrames:
+  def __init__(self, frames):
+    self.frames = frames
+
+## Waits until given Panda3D interval stops playing.
+
+class WaitInterval:
+  def __init__(self, interval):
+    self.interval = interval
+
+  def is_done(self):
+    return not self.interval.isPlaying()
+
+## Waits until given event is sent (see ScriptScheduler.notify_event).
+
+class WaitEvent:
+  def __init__(self, event_name):
+    self.event_name = event_name
+
+## Resumes the coroutine scripts when what they wait for happens, all from
+#  one place called once a frame (update). The waits are kept so that
+#  waiting scripts cost (almost) nothing: timed waits in heaps, event waits
+#  by event name, only the objects with is_done (e.g. WaitInterval) are
+#  polled. The number of scripts resumed in one update is limited, the rest
+#  continue in the next updates. The limit is a count and not a time, so
+#  that which scripts run in which update doesn't depend on the machine's
+#  load (the simulation stays deterministic), updates in which the scripts
+#  take longer than the time budget are only reported.
+
+class ScriptScheduler:
+  ## Creates the scheduler.
+  #
+  #  @param get_time function returning the current (game) time in seconds
+  #  @param max_resumes maximum number of scripts resumed in one update,
+  #         None for no limit
+  #  @param listen_event optional function f(event name) called when
+  #         a script waits for an event no other script waits for, so that
+  #         the event can be forwarded to notify_event
+  #  @param budget time in seconds the scripts should run in one update at
+  #         most, longer updates are counted in overruns and reported to the
+  #         profiler, None for no budget
+
+  def __init__(self, get_time, max_resumes, listen_event=None, budget=None):
+    self.get_time = get_time
+    self.max_resumes = max_resumes
+    self.budget = budget
+    self.listen_event = listen_event
+    self.frame = 0                       ##< number of updates so far
+    self.counter = 0                     ##< for ordering heap entries with the same time
+    self.timed = []                      ##< heap of (time,counter,script)
+    self.framed = []                     ##< heap of (frame,counter,script)
+    self.polled = []                     ##< list of (object with is_done,script)
+    self.event_waits = {}                ##< event name => list of scripts
+    self.listened_events = set()
+    self.ready = deque()                 ##< scripts to be resumed
+    self.resumed = 0                     ##< number of resumed scripts in total
+    self.postponed = 0                   ##< number of times a ready script had to wait for the next update because of max_resumes
+    self.overruns = 0                    ##< number of updates in which the scripts ran longer than the budget
+    self.profiler = None                 ##< FrameProfiler measuring the resumed scripts by name (see frame_profiler) or None
+
+  ## Returns the number of running (waiting or ready) scripts.
+
+  def get_script_count(self):
+    return len(self.timed) + len(self.framed) + len(self.polled) + sum(len(scripts) for scripts in self.event_waits.values()) + len(self.ready)
+
+  ## Starts given coroutine script: runs it to its first yield right away.
+  #
+  #  @param name name for error messages (e.g. the script file name)
+
+  def start(self, coroutine, name):
+    self.resume((coroutine,name))
+
+  ## Runs the script to its next yield and schedules what it waits for.
+
+  def resume(self, script):
+    self.resumed += 1
+
+    try:
+      wait = next(script[0])
+    except StopIteration:
+      return
+    except Exception as e:
+      print("error running script '" + script[1] + "':")
+      print(e)
+      return
+
+    self.schedule(script,wait)
+
+  ## Schedules a script to be resumed after given wait, which can be one of
+  #  the wait classes, a number (of seconds), None (next frame) or any
+  #  object with method is_done() returning True when the script should
+  #  continue.
+
+  def schedule(self, script, wait):
+    self.counter += 1
+
+    if wait == None:
+      wait = WaitFrames(1)
+    elif isinstance(wait,(int,float)):
+      wait = WaitSeconds(wait)
+
+    if isinstance(wait,WaitSeconds):
+      heapq.heappush(self.timed,(self.get_time() + wait.seconds,self.counter,script))
+    elif isinstance(wait,WaitFrames):
+      heapq.heappush(self.framed,(self.frame + max(wait.frames,1),self.counter,script))
+    elif isinstance(wait,WaitEvent):
+      self.event_waits.setdefault(wait.event_name,[]).append(script)
+
+      if self.listen_event != None and not wait.event_name in self.listened_events:
+        self.listened_events.add(wait.event_name)
+        self.listen_event(wait.event_name)
+    elif hasattr(wait,"is_done"):
+      self.polled.append((wait,script))
+    else:
+      print("script '" + script[1] + "' yielded an unknown wait: " + repr(wait))
+
+  ## Makes the scripts waiting for given event ready (they're resumed in the
+  #  next update). Extra arguments (as sent with events) are ignored.
+
+  def notify_event(self, event_name, *args):
+    self.ready.extend(self.event_waits.pop(event_name,[]))
+
+  ## Resumes the scripts whose waits are over, at most max_resumes of them.
+
+  def update(self):
+    self.frame += 1
+    current_time = self.get_time()
+
+    while len(self.timed) > 0 and self.timed[0][0] <= current_time:
+      self.ready.append(heapq.heappop(self.timed)[2])
+
+    while len(self.framed) > 0 and self.framed[0][0] <= self.frame:
+      self.ready.append(heapq.heappop(self.framed)[2])
+
+    if len(self.polled) > 0:
+      waiting = []
+
+      for wait, script in self.polled:
+        if wait.is_done():
+          self.ready.append(script)
+        else:
+          waiting.append((wait,script))
+
+      self.polled = waiting
+
+    start = time.time()
+    resumes = 0
+
+    while len(self.ready) > 0 and (self.max_resumes == None or resumes < self.max_resumes):
+      script = self.ready.popleft()
+      script_start = time.time()
+      self.resume(script)
+      resumes += 1
+
+      if self.profiler != None:
+        self.profiler.add("script " + script[1],time.time() - script_start)
+
+    self.postponed += len(self.ready)
+
+    if self.budget != None and resumes > 0:
+      overrun = time.time() - start - self.budget
+
+      if overrun > 0:
+        self.overruns += 1
+
+        if self.profiler != None:
+          self.profiler.add("script budget overrun",overrun)
+
+## Mutations made by scripts inside a batch (see Game.script_batch), used
+#  as a context manager. The mutations are applied together when the
+#  outermost batch ends, or dropped if it ends with an exception.
+
+class ScriptBatch:
+  ## Creates the batch.
+  #
+  #  @param end function f(batch,commit) called when the outermost batch
+  #         ends, commit says whether the mutations should be applied
+
+  def __init__(self, end):
+    self.end = end
+    self.depth = 0                       ##< number of nested batches open
+    self.steppable = {}                  ##< (x,y) => new steppable value of the tile
+    self.placements = {}                 ##< prop or item => new (x,y,duration), duration None means no gradual movement
+
+  def __enter__(self):
+    self.depth += 1
+    return self
+
+  def __exit__(self, exception_type, exception, traceback):
+    self.depth -= 1
+
+    if self.depth == 0:
+      self.end(self,exception_type == None)
+
+    return False
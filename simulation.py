@@ -0,0 +1,484 @@
+## The game simulation: level state, player movement with collisions,
+#  scripts (with their API), moved objects and daytime, advanced in fixed
+#  ticks of SIMULATION_STEP seconds (see simulation_tick). It needs no
+#  window or renderer, so it can run on its own faster than real time (see
+#  headless.py), Game adds the presentation (scene, camera, sounds, GUI,
+#  input events) on top of it.
+
+import time
+from math import *
+from direct.showbase import DirectObject
+from direct.showbase.MessengerGlobal import messenger
+
+from general import *
+from level import *
+from chunked_level import *
+from game_database import *
+from scripting import *
+from tween import *
+
+## Computes a new position of object in movement, respecting the
+#  collisions with level geometry.
+#
+#  @param collision_mask CollisionMask of the level
+#  @param position object position ((x,y) float tuple)
+#  @param direction object orientation in degrees, starting pointing right, going CCW
+#  @param distance distance to be travelled
+#  @return new position as a tuple
+
+def move_with_collisions(collision_mask, position, direction, distance):    
+  padding_size = 0.2
+  bias = 0.01
+
+  def position_to_tile(float_position):
+    return (int(round(float_position[0])),int(round(float_position[1])))
+  
+  def tile_is_walkable(tile_position):
+    return collision_mask.is_steppable(tile_position[0],tile_position[1])
+  
+  def position_collides(float_position):
+    # Checks if position collides taking padding into account. Returns list of
+    # collided paddings:
+    #      0
+    #    1   3    
+    #      2
+    # Empty list is returned for no collision.
+    
+    tile_position = position_to_tile(float_position)
+    
+    result = []
+    
+    if not tile_is_walkable(tile_position):
+      return [0,1,2,3]
+    
+    position_within_tile = (float_position[0] - tile_position[0] + 0.5,float_position[1] - tile_position[1] + 0.5)
+    
+    if position_within_tile[0] < padding_size and not tile_is_walkable((tile_position[0] - 1,tile_position[1])):
+      result.append(1)
+    elif position_within_tile[0] > 1.0 - padding_size and not tile_is_walkable((tile_position[0] + 1,tile_position[1])):
+      result.append(3)
+    
+    elif position_within_tile[1] < padding_size and not tile_is_walkable((tile_position[0],tile_position[1] - 1)):
+      result.append(0)
+    elif position_within_tile[1] > 1.0 - padding_size and not tile_is_walkable((tile_position[0],tile_position[1] + 1)):
+      result.append(2)
+    
+    return result
+  
+  new_position = [position[0],position[1]]
+  
+  direction = direction % 360
+  
+  new_position[0] += cos(radians(direction)) * distance
+  new_position[1] -= sin(radians(direction)) * distance
+  
+  collisions = position_collides(new_position)
+  
+  if len(collisions) == 0:   # no collision for new position => OK
+    return new_position
+  
+  current_tile = position_to_tile(position)
+  
+  if 3 in collisions:
+    new_position[0] = current_tile[0] + 0.5 - padding_size - bias
+  elif 1 in collisions:
+    new_position[0] = current_tile[0] - 0.5 + padding_size + bias
+  
+  collisions = position_collides(new_position)
+  
+  if len(collisions) == 0:   # no collision for new position => OK
+    return new_position
+  
+  if 0 in collisions:
+    new_position[1] = current_tile[1] - 0.5 + padding_size + bias
+  elif 2 in collisions:
+    new_position[1] = current_tile[1] + 0.5 - padding_size - bias
+  
+  if len(position_collides(new_position)) == 0:
+    return new_position
+  
+  return position
+
+class Simulation:
+  JUMP_DURATION = 0.6                    ##< jump duration in seconds
+  USE_DISTANCE = 2                       ##< distance within which objects can be used by the player                          
+  MOVEMENT_SPEED = 1.8
+  RUN_SPEED = 4.2
+  SIMULATION_STEP = 1.0 / 60.0           ##< duration of one simulation tick in seconds (see simulation_tick), the game speed doesn't depend on the frame rate
+  SCRIPT_RESUMES_PER_TICK = 64           ##< maximum number of waiting (coroutine) scripts resumed in one tick, see scripting.ScriptScheduler
+  SCRIPT_TIME_BUDGET = 0.002             ##< time in seconds the resumed scripts should run in one tick, longer ticks are reported to the profiler
+  SCRIPT_CACHE_PATH = DEFAULT_SCRIPT_CACHE_PATH  ##< directory of compiled game scripts (see scripting), None keeps them in memory only
+  INPUT_KEYS = ["w","s","a","d","W","S","A","D","q","e","i","shift","space","mouse1","mouse3"]   ##< keys in the input state
+
+  ## Loads given level file (in any format, see chunked_level.load_level)
+  #  and its database.
+
+  def __init__(self, level_filename):
+    self.simulation_time = 0.0                                      ##< time of the simulation in seconds, advanced by simulation_tick
+    self.daytime = 0.0                                              ##< time of day in range <0,1>
+    self.daytime_offset = 0.0                                       ##< daytime at simulation time 0 (see set_daytime)
+
+    self.player_position = [0.0,0.0]                                ##< player position
+    self.previous_player_position = [0.0,0.0]                       ##< player position in the previous tick, for interpolating
+    self.player_rotation = 0.0                                      ##< player rotation in degrees
+    self.player_pitch = 0.0                                         ##< vertical rotation of the player's view in degrees
+    self.time_of_jump = - 0.100 - Simulation.JUMP_DURATION          ##< simulation time of last player's jump
+    self.in_air = False                                             ##< if the player is in air (jumping)
+    self.use_pressed = False                                        ##< whether the use key way pressed
+    self.head_bob_phase = 0.0                                       ##< head bob phase in <0,1> range
+    self.head_bob_offset = 0.0                                      ##< camera height offset of the head bob
+    self.previous_head_bob_offset = 0.0
+    self.gui_active = False                                         ##< Says if the player has a GUI windows open, if True, movement will be disabled and mouse will be shown
+
+    self.input_state = {}                                           ##< contains state of mouse and keyboard, set by the presentation or a bot
+
+    for key in Simulation.INPUT_KEYS:
+      self.input_state[key] = False
+
+    self.focused_prop = None                                        ##< references a LevelProp that the player is currently looking at
+    self.focused_item = None                                        ##< references a LevelItem that the player is currently looking at
+
+    self.script_manager = ScriptManager(RESOURCE_PATH,Simulation.SCRIPT_CACHE_PATH,self.get_script_globals())     ##< compiles and runs the game scripts
+    self.script_scheduler = ScriptScheduler(self.get_simulation_time,Simulation.SCRIPT_RESUMES_PER_TICK,self.listen_script_event,Simulation.SCRIPT_TIME_BUDGET)   ##< resumes the scripts that wait
+    self.script_event_listener = DirectObject.DirectObject()       ##< accepts the events scripts wait for (separately from the game's own events)
+    self.open_script_batch = None                                   ##< ScriptBatch buffering script mutations (see script_batch) or None
+    self.tween_engine = TweenEngine(self.get_simulation_time)       ##< moves the nodes of objects moved by scripts
+    self.profiler = None                                            ##< FrameProfiler measuring the scripts (see set_profiler) or None
+
+    self.level_filename = level_filename
+    self.level = load_level(level_filename)                         ##< contains the level data
+    self.database = GameDatabase.load_from_file(RESOURCE_PATH + "/" + self.level.get_database_name()) if self.level.get_database_name() != "" else GameDatabase()   # levels without a database have no items
+    self.collision_mask = self.level.get_collision_mask()           ##< current level CollisionMask (owned and updated by the level)
+
+  def get_simulation_time(self):
+    return self.simulation_time
+
+  ## Forwards given event to the script scheduler (for the scripts waiting
+  #  for it).
+
+  def listen_script_event(self, event_name):
+    self.script_event_listener.accept(event_name,self.script_scheduler.notify_event,[event_name])
+    
+  ## Computes a new position of the player (or other object) in movement,
+  #  see move_with_collisions.
+
+  def move_with_collisions(self, position, direction, distance):
+    return move_with_collisions(self.collision_mask,position,direction,distance)
+
+  ## Advances the simulation by one tick of SIMULATION_STEP seconds: player
+  #  movement and actions, scripts and moved objects. Everything here only
+  #  depends on the input and the simulation state, not on the frame rate.
+
+  def simulation_tick(self):
+    self.simulation_time += Simulation.SIMULATION_STEP
+    self.previous_player_position = list(self.player_position)
+    self.previous_head_bob_offset = self.head_bob_offset
+
+    if not self.gui_active:
+      self.update_player(Simulation.SIMULATION_STEP)
+
+    self.script_scheduler.update()
+    self.tween_engine.update()
+    self.daytime = (self.simulation_time / 100 + self.daytime_offset) % 1
+
+  ## Moves the player according to the input, handles jumping and using.
+
+  def update_player(self, time_difference):
+    distance =  (Simulation.RUN_SPEED if self.input_state["shift"] else Simulation.MOVEMENT_SPEED) * time_difference
+    self.in_air = self.simulation_time <= self.time_of_jump + Simulation.JUMP_DURATION
+
+    reset_head_bob = True
+
+    if self.input_state["w"]:
+      self.player_position = self.move_with_collisions(self.player_position,self.player_rotation,distance)
+      reset_head_bob = False
+ 
+    if self.input_state["s"]:
+      self.player_position = self.move_with_collisions(self.player_position,self.player_rotation + 180,distance)
+      reset_head_bob = False
+
+    if self.input_state["a"]:
+      self.player_position = self.move_with_collisions(self.player_position,self.player_rotation + 90,distance)
+      reset_head_bob = False
+
+    if self.input_state["d"]:
+      self.player_position = self.move_with_collisions(self.player_position,self.player_rotation + 270,distance)
+      reset_head_bob = False
+    
+    self.head_bob_phase = 0.0 if (reset_head_bob and self.head_bob_phase < 0.2) else (self.head_bob_phase + time_difference * 2) % 1.0
+    self.head_bob_offset = sin(self.head_bob_phase * pi) * 0.02
+    
+    if not self.in_air and self.input_state["e"]:
+      self.time_of_jump = self.simulation_time
+    
+    if self.input_state["space"]:
+      if not self.use_pressed:
+        
+        if self.focused_prop != None and not self.focused_prop.disable_usage:
+          self.run_scripts(self.focused_prop.scripts_use,event_type="use",caller=self.focused_prop)
+          
+        self.use_pressed = True
+    else:
+      self.use_pressed = False
+
+  ## Sets the time of the day as a value in interval <0,1>, the daytime
+  #  then goes on from it.
+
+  def set_daytime(self, daytime):
+    self.daytime = daytime
+    self.daytime_offset = daytime - self.simulation_time / 100
+
+  ## Sets the FrameProfiler (see frame_profiler) that measures the scripts
+  #  (each script file under its name), None turns the measuring off.
+
+  def set_profiler(self, profiler):
+    self.profiler = profiler
+    self.script_scheduler.profiler = profiler
+
+  ## Called when objects are added, removed or moved (e.g. to update what
+  #  the player looks at), does nothing in the simulation alone.
+
+  def invalidate_focus(self):
+    pass
+
+  ## Makes given props active (as when they get to the scene), runs the
+  #  load scripts of those that get active for the first time.
+
+  def activate_props(self, props):
+    new_props = [prop for prop in props if not hasattr(prop,"disable_usage")]
+
+    for prop in new_props:
+      prop.disable_usage = False                # helper property
+
+    for prop in new_props:
+      try:
+        self.run_scripts(prop.scripts_load,event_type="load",caller=prop)
+      except Exception:
+        pass
+
+  ## Returns the global variables the game scripts run with (copied for each
+  #  run, see ScriptManager), the scripts also get the game, source,
+  #  event_type and parameters variables.
+
+  def get_script_globals(self):
+    return globals()
+
+  ## Runs given game script in the current context.
+  #  @param filename name of the script (including extension but without the resource path)
+  #  @param caller object that caused the script to be run
+  #  @param event_type event type as a string
+  #  @param params optional additional parameters
+
+  def run_script(self, filename, caller=None, event_type=None, params=None):
+    start = time.time()
+
+    try:
+      coroutine = self.script_manager.run(filename,{"game": self,"source": caller,"event_type": event_type,"parameters": params})
+
+      if coroutine != None:
+        self.script_scheduler.start(coroutine,filename)
+    except Exception as e:
+      print("error running script '" + filename + "':")
+      print(e)
+
+    if self.profiler != None:
+      self.profiler.add("script " + filename,time.time() - start)
+   
+  ## Runs all scripts in a list.
+   
+  def run_scripts(self, filenames, caller=None, event_type=None, params=None):
+    for filename in filenames:
+      self.run_script(filename,caller,event_type,params)
+  
+  # ==================================== SCRIP API ====================================
+  # The following functions are intended to be called from the game scripts, but can also
+  # be called from the core source as well. Core functions however should never be called
+  # from the scripts. The following local variables are available withing the script:
+  #
+  # game - reference to this Simulation (Game) object (self)
+  # source - object that caused the script to be called
+  # event_type - type of the event that caused the script to be called as a string
+  # parameters - additional parameters
+  
+  def script_print(self, what):
+    print(what)
+    
+  ## Gets the player position.
+  #  @return player position as (x,y) tuple, note that this differs from
+  #    the internal player position by half a square to match other
+  #    positions
+    
+  def script_get_player_position(self):
+    position = self.player_position    
+    return (position[0] + 0.5,position[1] + 0.5)
+
+  def script_set_player_position(self, new_x, new_y):
+    self.player_position = [new_x,new_y]
+    self.previous_player_position = [new_x,new_y]     # a teleport, not interpolated
+
+  ## Return a tuple (horizontal_rotation, vertical_rotation) in angles.
+
+  def script_get_player_rotation(self):
+    return (self.player_rotation,self.player_pitch)
+
+  ## Sets the player rotation.
+
+  def script_set_player_rotation(self, new_rotation_horizontal, new_rotation_vertical):
+    self.player_rotation = new_rotation_horizontal
+    self.player_pitch = new_rotation_vertical
+
+  def script_get_level_size(self):
+    return (self.level.get_width(),self.level.get_height())
+
+  def script_get_daytime(self):
+    return self.daytime
+  
+  def script_set_daytime(self, new_daytime):
+    self.set_daytime(new_daytime)
+    
+  ## Gets position of given object, which can be prop, NPC etc.
+  #  For player position see script_get_player_position.
+  #  @return (x,y) float tuple
+    
+  def script_get_position(self, what):
+    if self.open_script_batch != None and what in self.open_script_batch.placements:
+      return self.open_script_batch.placements[what][:2]
+
+    return what.position
+    
+  ## Gets the data of the object as a string.
+    
+  def script_get_data(self, what):
+    return what.data
+    
+  def script_set_position(self, what, new_x, new_y):
+    self.place_objects({what: (new_x,new_y,None)})
+    
+  ## Gradually moves given game object to a new position. Returns a wait
+  #  for the end of the movement (a script can yield it).
+   
+  def script_move(self, what, new_x, new_y, duration):
+    self.place_objects({what: (new_x,new_y,duration)})
+    return WaitSeconds(duration)
+
+  ## Sets the positions of props and items (in the level and the scene),
+  #  inside a script batch only remembers them.
+  #
+  #  @param placements dict object => (x,y,duration), the objects with
+  #         a duration move there gradually and can't be used meanwhile
+
+  def place_objects(self, placements):
+    if self.open_script_batch != None:
+      self.open_script_batch.placements.update(placements)
+      return
+
+    for what, (new_x,new_y,duration) in placements.items():
+      self.level.set_object_position(what,(new_x,new_y))
+      node_path = getattr(what,"node_path",None)   # None if the object is not in the scene
+      new_position = (new_y - 0.5,new_x - 0.5,0)
+
+      if duration == None:
+        if node_path != None:
+          self.tween_engine.stop(node_path)
+          node_path.setPos(new_position)
+      else:
+        what.disable_usage = True      # disable usage for the time of the movement
+        self.tween_engine.move(node_path,new_position,duration,on_done=lambda what=what: setattr(what,"disable_usage",False))
+
+    self.invalidate_focus()
+
+  ## Returns a context manager (ScriptBatch) for a batch of changes: inside
+  #  it, changes of object positions and tile steppability are only
+  #  remembered and then applied together when the batch ends, which is
+  #  cheaper when a script changes many things at once. Reading positions
+  #  and steppability inside the batch gives the changed values, queries of
+  #  objects near a position (and the scene) see the state before the
+  #  batch. Coroutine scripts shouldn't yield inside a batch. Use as:
+  #
+  #  with game.script_batch():
+  #    game.script_set_position(...)
+
+  def script_batch(self):
+    if self.open_script_batch == None:
+      self.open_script_batch = ScriptBatch(self.end_script_batch)
+
+    return self.open_script_batch
+
+  ## Applies the changes of a script batch when it ends (see script_batch).
+
+  def end_script_batch(self, batch, commit):
+    self.open_script_batch = None
+
+    if not commit:
+      return
+
+    if len(batch.steppable) != 0:
+      self.level.set_tile_values(STEPPABLE,batch.steppable)   # updates the collision mask
+
+    if len(batch.placements) != 0:
+      self.place_objects(batch.placements)
+
+  ## The following functions return waits for scripts that run over several
+  #  frames, the script continues after yielding the wait when it's over.
+  #  Yielding a number of seconds or None (next frame) works as well.
+
+  def script_wait(self, seconds):
+    return WaitSeconds(seconds)
+
+  def script_wait_frames(self, frames):
+    return WaitFrames(frames)
+
+  ## Waits until given event is sent (e.g. with script_send_event).
+
+  def script_wait_event(self, event_name):
+    return WaitEvent(event_name)
+
+  def script_send_event(self, event_name):
+    messenger.send(event_name)
+    
+  ## Returns a list of props and items within given distance from given
+  #  position.
+
+  def script_get_objects_near(self, x, y, radius):
+    return self.level.get_objects_in_radius((x,y),radius)
+
+  ## Returns the prop or item nearest to given position, None if there is
+  #  none within max_distance (if given).
+
+  def script_get_nearest_object(self, x, y, max_distance=None):
+    return self.level.get_nearest_object((x,y),max_distance)
+
+  ## Returns the tile at given position as a TileHandle, changes made
+  #  through it (e.g. tile.wall = False) are shown in the scene within a few
+  #  frames. Returns None for positions outside the level.
+
+  def script_get_tile(self, x, y):
+    if not self.level.is_inside(x,y):
+      return None
+
+    return self.level.get_tile(x,y)
+
+  def script_get_tile_steppable(self, x, y):
+    if self.open_script_batch != None and (x,y) in self.open_script_batch.steppable:
+      return self.open_script_batch.steppable[(x,y)]
+
+    return self.collision_mask.is_steppable(x,y)
+    
+  def script_set_tile_steppable(self, x, y, steppable):
+    if self.level.is_inside(x,y):
+      if self.open_script_batch != None:
+        self.open_script_batch.steppable[(x,y)] = steppable
+      else:
+        self.level.set_tile_value(x,y,STEPPABLE,steppable)   # updates the collision mask
+
+  ## Plays given sound effect, sounds with lower priority are stopped if
+  #  too many sounds play. The simulation alone has no sound.
+
+  def script_play_sound(self, filename, volume=1.0, priority=0):
+    pass
+
+  ## Plays given sound effect at given source, a prop or item (the sound
+  #  follows it) or (x,y) position, see script_play_sound.
+
+  def script_play_sound_at(self, filename, source, volume=1.0, priority=0):
+    pass
@@ -0,0 +1,158 @@
+## Uniform grid spatial index for objects placed in the level (props,
+#  items, ...). The plane is divided into square cells, each cell keeps a
+#  list of objects whose position lies in it, so that queries only have to
+#  look at the few cells around the queried area instead of all objects.
+
+from math import floor, sqrt
+
+class SpatialGrid:
+  def __init__(self, cell_size=2.0):
+    self.cell_size = float(cell_size)
+    self.cells = {}                  ##< (cell x,cell y) => list of objects in the cell
+    self.positions = {}              ##< object => (x,y) position under which the object is indexed
+    self.cell_bounds = None          ##< (min x,min y,max x,max y) of cells that have ever been used, or None
+
+  def __len__(self):
+    return len(self.positions)
+
+  def __contains__(self, what):
+    return what in self.positions
+
+  def get_cell(self, position):
+    return (int(floor(position[0] / self.cell_size)),int(floor(position[1] / self.cell_size)))
+
+  def insert(self, what, position):
+    position = (position[0],position[1])
+    cell = self.get_cell(position)
+    self.positions[what] = position
+    self.cells.setdefault(cell,[]).append(what)
+
+    if self.cell_bounds == None:
+      self.cell_bounds = (cell[0],cell[1],cell[0],cell[1])
+    else:
+      self.cell_bounds = (min(self.cell_bounds[0],cell[0]),min(self.cell_bounds[1],cell[1]),max(self.cell_bounds[2],cell[0]),max(self.cell_bounds[3],cell[1]))
+
+  def remove(self, what):
+    cell = self.get_cell(self.positions.pop(what))
+    objects = self.cells[cell]
+    objects.remove(what)
+
+    if len(objects) == 0:
+      del self.cells[cell]
+
+  ## Changes the position of an already indexed object.
+
+  def move(self, what, new_position):
+    old_position = self.positions[what]
+
+    if self.get_cell(old_position) == self.get_cell(new_position):
+      self.positions[what] = (new_position[0],new_position[1])
+    else:
+      self.remove(what)
+      self.insert(what,new_position)
+
+  def get_position(self, what):
+    return self.positions[what]
+
+  ## Returns a list of objects within given distance from given position.
+
+  def query_radius(self, position, radius):
+    result = []
+    cell1 = self.get_cell((position[0] - radius,position[1] - radius))
+    cell2 = self.get_cell((position[0] + radius,position[1] + radius))
+    radius_squared = radius * radius
+
+    for what in self.objects_in_cells(cell1,cell2):
+      object_position = self.positions[what]
+      dx = object_position[0] - position[0]
+      dy = object_position[1] - position[1]
+
+      if dx * dx + dy * dy <= radius_squared:
+        result.append(what)
+
+    return result
+
+  ## Returns a list of objects within given rectangle (including its border).
+
+  def query_rectangle(self, corner1, corner2):
+    x1, x2 = min(corner1[0],corner2[0]), max(corner1[0],corner2[0])
+    y1, y2 = min(corner1[1],corner2[1]), max(corner1[1],corner2[1])
+    result = []
+
+    for what in self.objects_in_cells(self.get_cell((x1,y1)),self.get_cell((x2,y2))):
+      object_position = self.positions[what]
+
+      if x1 <= object_position[0] <= x2 and y1 <= object_position[1] <= y2:
+        result.append(what)
+
+    return result
+
+  ## Returns the object nearest to given position or None if there is no
+  #  object (within max_distance, if given). Cells are searched in growing
+  #  square rings around the position until no closer object can exist.
+  #
+  #  @param accept optional function, objects for which it returns False are skipped
+
+  def query_nearest(self, position, max_distance=None, accept=None):
+    if self.cell_bounds == None:
+      return None
+
+    center = self.get_cell(position)
+    best = None
+    best_distance = max_distance if max_distance != None else float("inf")
+
+    max_ring = max(abs(center[0] - self.cell_bounds[0]),abs(center[0] - self.cell_bounds[2]),abs(center[1] - self.cell_bounds[1]),abs(center[1] - self.cell_bounds[3]))
+
+    if max_distance != None:
+      max_ring = min(max_ring,int(max_distance / self.cell_size) + 1)
+
+    ring = 0
+
+    while ring <= max_ring and (ring - 1) * self.cell_size <= best_distance:
+      for cell in self.ring_cells(center,ring):
+        for what in self.cells.get(cell,()):
+          if accept != None and not accept(what):
+            continue
+
+          object_position = self.positions[what]
+          distance = sqrt((object_position[0] - position[0]) ** 2 + (object_position[1] - position[1]) ** 2)
+
+          if distance <= best_distance:
+            best = what
+            best_distance = distance
+
+      ring += 1
+
+    return best
+
+  ## Yields cells that are exactly ring cells far from the center cell (in
+  #  the maximum metric).
+
+  def ring_cells(self, center, ring):
+    if ring == 0:
+      yield center
+      return
+
+    for x in range(center[0] - ring,center[0] + ring + 1):
+      yield (x,center[1] - ring)
+      yield (x,center[1] + ring)
+
+    for y in range(center[1] - ring + 1,center[1] + ring):
+      yield (center[0] - ring,y)
+      yield (center[0] + ring,y)
+
+  ## Yields all objects in the rectangle of cells between the two cells.
+
+  def objects_in_cells(self, cell1, cell2):
+    if (cell2[0] - cell1[0] + 1) * (cell2[1] - cell1[1] + 1) > len(self.cells):   # fewer used cells than the area, go through them instead
+      for cell in list(self.cells):
+        if cell1[0] <= cell[0] <= cell2[0] and cell1[1] <= cell[1] <= cell2[1]:
+          for what in self.cells[cell]:
+            yield what
+
+      return
+
+    for x in range(cell1[0],cell2[0] + 1):
+      for y in range(cell1[1],cell2[1] + 1):
+        for what in self.cells.get((x,y),()):
+          yield what
@@ -0,0 +1,123 @@
+## Tests of chunked levels (see chunked_level): modified chunks must be
+#  unloaded like the others, keep their changes and be saved. Run from the
+#  repository directory: python -m unittest discover tests
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunked_level import *
+from level_streaming import *
+
+LEVEL_SIZE = 96
+CHUNK_SIZE = 8
+RADIUS = 10
+PACKAGE_SPACING = 5                  ##< a package (prop) stands on every PACKAGE_SPACING-th tile in both directions
+
+## Makes a chunked level file with packages (props that make their tile not
+#  steppable when they're loaded, as resources/crate.py does), returns the
+#  file name.
+
+def make_package_level(directory):
+  level = Level(LEVEL_SIZE,LEVEL_SIZE)
+
+  for x in range(0,LEVEL_SIZE,PACKAGE_SPACING):
+    for y in range(0,LEVEL_SIZE,PACKAGE_SPACING):
+      package = LevelProp((x + 0.5,y + 0.5))
+      package.scripts_load = ["crate.py"]
+      level.add_prop(package)
+
+  filename = os.path.join(directory,"packages.lvl")
+  write_chunked_level_file(level,filename,CHUNK_SIZE)
+  return filename
+
+## Streams the chunks of the level along a path over the whole level, the
+#  package load scripts are emulated by the chunk building. Returns the
+#  maximum number of chunks loaded at once.
+
+def walk_level(level):
+  def build_chunk(chunk_x, chunk_y, region):
+    level.load_chunk(chunk_x,chunk_y)     # as building the chunk's tiles does
+
+    for package in level.get_objects_in_region(region,items=False):
+      level.set_tile_value(int(package.position[0]),int(package.position[1]),STEPPABLE,False)
+
+  streamer = ChunkStreamer(level,CHUNK_SIZE,RADIUS,build_chunk,lambda chunk_x, chunk_y, built_chunk: None)
+  max_loaded = 0
+
+  for y in range(0,LEVEL_SIZE,RADIUS):
+    for x in (range(LEVEL_SIZE) if (y // RADIUS) % 2 == 0 else reversed(range(LEVEL_SIZE))):
+      streamer.update((x,y),True)
+      max_loaded = max(max_loaded,len(level.get_loaded_chunks()))
+
+  streamer.update((LEVEL_SIZE - 1,LEVEL_SIZE - 1),True)   # ends far from the start
+  return max_loaded
+
+class ChunkedLevelTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.filename = make_package_level(self.directory)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_modified_chunks_are_unloaded(self):
+    level = ChunkedLevel(self.filename)
+    max_loaded = walk_level(level)
+    chunks_in_range = (2 * (RADIUS + 2 * CHUNK_SIZE) // CHUNK_SIZE + 2) ** 2    # range kept by ChunkStreamer.update
+
+    self.assertTrue(max_loaded <= chunks_in_range,str(max_loaded) + " chunks loaded")
+    self.assertTrue(max_loaded < level.get_chunk_count()[0] * level.get_chunk_count()[1] // 2)
+    self.assertFalse(level.is_chunk_loaded(0,0))
+
+    # the changes of the unloaded chunks are kept:
+
+    self.assertFalse(level.get_collision_mask().is_steppable(0,0))    # not loaded
+    self.assertFalse(level.get_tile(0,0).steppable)                   # loads the chunk again
+    self.assertFalse(level.get_collision_mask().is_steppable(0,0))
+    self.assertTrue(level.get_collision_mask().is_steppable(1,0))
+
+  def test_moved_object_changes_chunk(self):
+    level = ChunkedLevel(self.filename)
+    level.load_chunk(0,0)
+    package = level.get_objects_in_region((0,0,1,1))[0]
+    level.set_object_position(package,(CHUNK_SIZE + 2.5,2.5))
+    level.unload_chunk(0,0)
+    level.unload_chunk(1,0)
+
+    self.assertEqual(len(level.get_objects_in_region((0,0,CHUNK_SIZE,CHUNK_SIZE))),len([prop for prop in level.get_props() if prop.position[0] < CHUNK_SIZE and prop.position[1] < CHUNK_SIZE]))
+    level.load_chunk(1,0)
+    self.assertEqual(len(level.get_objects_in_region((CHUNK_SIZE + 2,2,1,1))),1)
+    level.load_chunk(0,0)
+    self.assertEqual(len(level.get_objects_in_region((0,0,1,1))),0)
+
+  def test_save_modified_level(self):
+    level = ChunkedLevel(self.filename)
+    walk_level(level)
+    level.set_tile_value(LEVEL_SIZE - 1,LEVEL_SIZE - 1,WALL,True)       # a change in a loaded chunk
+    Level.save_to_file(level,self.filename)        # overwrites the file the level is mapped from
+
+    saved_level = load_level(self.filename)
+    self.assertTrue(isinstance(saved_level,ChunkedLevel))
+    self.assertFalse(saved_level.get_tile(0,0).steppable)
+    self.assertTrue(saved_level.get_tile(1,0).steppable)
+    self.assertTrue(saved_level.get_tile(LEVEL_SIZE - 1,LEVEL_SIZE - 1).wall)
+
+    for chunk_x in range(saved_level.get_chunk_count()[0]):
+      for chunk_y in range(saved_level.get_chunk_count()[1]):
+        saved_level.load_chunk(chunk_x,chunk_y)
+
+    self.assertEqual(len(saved_level.get_objects_in_region((0,0,LEVEL_SIZE,LEVEL_SIZE))),((LEVEL_SIZE + PACKAGE_SPACING - 1) // PACKAGE_SPACING) ** 2)
+    self.assertFalse(level.get_tile(0,0).steppable)      # the old level still works
+
+  def test_resize(self):
+    level = ChunkedLevel(self.filename)
+    level.set_size(LEVEL_SIZE,LEVEL_SIZE)
+    self.assertRaises(ValueError,level.set_size,LEVEL_SIZE + 1,LEVEL_SIZE)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,148 @@
+## Tests of the game scene (see main.Game) built offscreen: nodes of props
+#  moved by scripts between chunks. Run from the repository directory:
+#  python -m unittest discover tests
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,REPOSITORY_PATH)
+
+from panda3d.core import loadPrcFileData
+
+loadPrcFileData("","window-type offscreen\naudio-library-name null")
+
+from main import *
+
+LEVEL_WIDTH = 96
+LEVEL_HEIGHT = 8
+CHUNK_SIZE = 8
+FOG_DISTANCE = 3                     ##< chunks within FOG_DISTANCE + Game.FOG_RANGE are built
+PACKAGE_POSITION = (CHUNK_SIZE - 0.5,2.5)
+FAR_POSITION = [LEVEL_WIDTH - 1.0,2.0]
+
+## Makes a chunked level file with one package (a crate prop, which makes
+#  its tile not steppable when loaded) at the right border of the first
+#  chunk, returns the file name.
+
+def make_package_level(directory):
+  level = Level(LEVEL_WIDTH,LEVEL_HEIGHT)
+  level.set_fog_distance(FOG_DISTANCE)
+  package = LevelProp(PACKAGE_POSITION)
+  package.model.model_name = "crate.obj"
+  package.model.texture_names = ["crate.png"]
+  package.scripts_load = ["crate.py"]
+  level.add_prop(package)
+
+  filename = os.path.join(directory,"package.lvl")
+  write_chunked_level_file(level,filename,CHUNK_SIZE)
+  return filename
+
+## The game scene of given level made as Game.__init__ makes it, without
+#  the window, input and GUI.
+
+class GameScene(Game):
+  def __init__(self, level_filename):
+    self.chunk_size = Game.CHUNK_SIZE
+    ShowBase.__init__(self)
+    Simulation.__init__(self,level_filename)
+    self.node_object_mapping = {}
+    self.sound_bank = SoundBank(self.loader,Game.SOUND_VOICES)
+    self.sound_scanned_scripts = set()
+    self.camera_path_recorder = None
+    self.setup_environment_scene(self.level)
+
+class GameSceneTest(unittest.TestCase):
+  def setUp(self):
+    self.working_directory = os.getcwd()
+    self.script_cache_path = Simulation.SCRIPT_CACHE_PATH
+    self.scene_cache_path = Game.SCENE_CACHE_PATH
+    os.chdir(REPOSITORY_PATH)          # resources are loaded relative to the game directory
+    Simulation.SCRIPT_CACHE_PATH = None
+    Game.SCENE_CACHE_PATH = None
+    self.directory = tempfile.mkdtemp()
+    self.game = GameScene(make_package_level(self.directory))
+
+  def tearDown(self):
+    self.game.destroy()
+    os.chdir(self.working_directory)
+    Simulation.SCRIPT_CACHE_PATH = self.script_cache_path
+    Game.SCENE_CACHE_PATH = self.scene_cache_path
+    shutil.rmtree(self.directory)
+
+  def get_package(self):
+    return self.game.level.get_props()[0]
+
+  ## Checks that the package has a node under the node of the chunk it
+  #  stands in.
+
+  def assert_package_in_chunk(self, chunk):
+    package = self.get_package()
+    chunk_node_path = self.game.chunk_streamer.get_built_chunks()[chunk]
+
+    self.assertNotEqual(package.node_path,None)
+    self.assertEqual(package.node_path.getParent(),chunk_node_path)
+    self.assertTrue(package.node_path.getName() in self.game.chunk_object_names[chunk])
+    self.assertTrue(self.game.node_object_mapping[package.node_path.getName()] is package)
+
+  def walk_away_and_back(self):
+    self.game.chunk_streamer.update(FAR_POSITION,True)
+    self.assertFalse((0,0) in self.game.chunk_streamer.get_built_chunks())
+    self.assertFalse((1,0) in self.game.chunk_streamer.get_built_chunks())
+    self.assertFalse(self.game.level.is_chunk_loaded(0,0))
+    self.assertFalse(self.game.level.is_chunk_loaded(1,0))
+    self.assertEqual(self.get_package_or_none(),None)
+
+    self.game.chunk_streamer.update(self.game.player_position,True)
+
+  ## Returns the package if its chunk is loaded, None otherwise.
+
+  def get_package_or_none(self):
+    props = self.game.level.get_props()
+    return props[0] if len(props) > 0 else None
+
+  def test_package_moved_to_built_chunk(self):
+    self.assertEqual(set(self.game.chunk_streamer.get_built_chunks()),set([(0,0),(1,0)]))
+    self.assert_package_in_chunk((0,0))
+
+    package = self.get_package()
+    self.assertFalse(self.game.collision_mask.is_steppable(7,2))   # by the load script
+    self.game.script_set_tile_steppable(7,2,True)                  # as the crate is pushed by its script
+    self.game.script_move(package,CHUNK_SIZE + 0.5,2.5,0.2)
+    self.game.script_set_tile_steppable(8,2,False)
+    self.assert_package_in_chunk((1,0))
+    self.assertFalse(package.node_path.getName() in self.game.chunk_object_names[(0,0)])
+
+    # both chunks unloaded and loaded again:
+
+    self.walk_away_and_back()
+    self.assert_package_in_chunk((1,0))
+    self.assertEqual(self.get_package().position,(CHUNK_SIZE + 0.5,2.5))
+    self.assertEqual(len(self.game.chunk_object_names[(0,0)]),0)
+    self.assertTrue(self.game.collision_mask.is_steppable(7,2))
+    self.assertFalse(self.game.collision_mask.is_steppable(8,2))
+
+  def test_package_moved_to_chunk_not_built(self):
+    package = self.get_package()
+    far_chunk_x = LEVEL_WIDTH // CHUNK_SIZE - 1
+    self.game.script_set_position(package,far_chunk_x * CHUNK_SIZE + 0.5,2.5)
+
+    self.assertEqual(package.node_path,None)
+    self.assertEqual(len(self.game.chunk_object_names[(0,0)]),0)
+    self.assertFalse(package in self.game.node_object_mapping.values())
+
+    self.game.chunk_streamer.update(FAR_POSITION,True)
+    self.assert_package_in_chunk((far_chunk_x,0))
+
+    # moved back to a chunk that is not built:
+
+    self.game.script_set_position(package,PACKAGE_POSITION[0],PACKAGE_POSITION[1])
+    self.assertEqual(package.node_path,None)
+    self.game.chunk_streamer.update(self.game.player_position,True)
+    self.assert_package_in_chunk((0,0))
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,36 @@
+## Smoke test of the headless simulation (see headless): a short run of a
+#  sample level with the input bot. Run from the repository directory:
+#  python -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,REPOSITORY_PATH)
+
+from headless import *
+
+SIMULATED_SECONDS = 10.0
+
+class HeadlessTest(unittest.TestCase):
+  def setUp(self):
+    self.working_directory = os.getcwd()
+    self.script_cache_path = Simulation.SCRIPT_CACHE_PATH
+    os.chdir(REPOSITORY_PATH)          # resources are loaded relative to the game directory
+    Simulation.SCRIPT_CACHE_PATH = None
+
+  def tearDown(self):
+    os.chdir(self.working_directory)
+    Simulation.SCRIPT_CACHE_PATH = self.script_cache_path
+
+  def test_interior(self):
+    simulation = Simulation("test_interior.txt")
+    tick_times, stalls = run_simulation(simulation,InputBot(simulation,0),SIMULATED_SECONDS)
+
+    self.assertEqual(len(tick_times),int(SIMULATED_SECONDS / Simulation.SIMULATION_STEP))
+    self.assertAlmostEqual(simulation.simulation_time,len(tick_times) * Simulation.SIMULATION_STEP)
+    self.assertTrue(simulation.level.is_inside(int(simulation.player_position[0] + 0.5),int(simulation.player_position[1] + 0.5)))
+
+if __name__ == "__main__":
+  unittest.main()
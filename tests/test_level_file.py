@@ -0,0 +1,247 @@
+## Tests of the binary level format (see level_file). Run from the
+#  repository directory: python -m unittest discover tests
+
+import os
+import sys
+import time
+import pickle
+import shutil
+import struct
+import tempfile
+import unittest
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,REPOSITORY_PATH)
+
+from level_file import *
+from level import *
+
+BIG_LEVEL_SIZE = 1024
+BIG_LEVEL_PROP_SPACING = 4           ##< a prop stands on every BIG_LEVEL_PROP_SPACING-th tile in both directions
+LOAD_TIME_LIMIT = 0.1                ##< seconds in which the big level has to open
+SAMPLE_LEVELS = ["test_exterior.txt","test_interior.txt"]   ##< levels in the old pickled format
+
+def get_tile_values(tile):
+  return (bool(tile.wall),bool(tile.ceiling),tile.ceiling_height,tile.floor_orientation % 4,bool(tile.steppable)) + tuple(model_to_record(getattr(tile,attribute)) for attribute in TILE_MODEL_ATTRIBUTES)
+
+def get_prop_values(prop):
+  return (tuple(prop.position),prop.orientation,model_to_record(prop.model),prop.caption,prop.data,list(prop.scripts_load),list(prop.scripts_use),list(prop.scripts_examine))
+
+def get_item_values(item):
+  return (tuple(item.position),item.orientation,item.data,item.db_id,list(item.scripts_pickup))
+
+## Reads a level file and decodes all its tiles and objects.
+
+def read_whole_level_file(filename):
+  result = read_level_file(filename)
+  result.get_props()
+  result.get_items()
+
+  for x in range(result.get_width()):
+    for y in range(result.get_height()):
+      result.get_tile(x,y)
+
+  return result
+
+class LevelFileTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def assert_levels_equal(self, level1, level2):
+    self.assertEqual((level1.get_width(),level1.get_height()),(level2.get_width(),level2.get_height()))
+
+    for x in range(level1.get_width()):
+      for y in range(level1.get_height()):
+        self.assertEqual(get_tile_values(level1.get_tile(x,y)),get_tile_values(level2.get_tile(x,y)),"tile " + str((x,y)))
+
+    self.assertEqual(sorted(get_prop_values(prop) for prop in level1.get_props()),sorted(get_prop_values(prop) for prop in level2.get_props()))
+    self.assertEqual(sorted(get_item_values(item) for item in level1.get_items()),sorted(get_item_values(item) for item in level2.get_items()))
+    self.assertEqual(level1.get_name(),level2.get_name())
+    self.assertEqual(level1.get_database_name(),level2.get_database_name())
+    self.assertEqual(level1.get_fog_distance(),level2.get_fog_distance())
+    self.assertEqual(tuple(level1.get_fog_color()),tuple(level2.get_fog_color()))
+    self.assertEqual(level1.get_ambient_light_amount(),level2.get_ambient_light_amount())
+    self.assertEqual([tuple(light) for light in level1.get_diffuse_lights()],[tuple(light) for light in level2.get_diffuse_lights()])
+    self.assertEqual(list(level1.get_skybox_textures()),list(level2.get_skybox_textures()))
+
+  ## Checks that a converted tile or prop has the values of the attributes
+  #  the old one has.
+
+  def assert_converted(self, converted, old):
+    for attribute in old.__dict__:
+      if attribute in TILE_MODEL_ATTRIBUTES or attribute == "model":
+        self.assertEqual(model_to_record(getattr(converted,attribute)),model_to_record(getattr(old,attribute)))
+      else:
+        self.assertEqual(getattr(converted,attribute),getattr(old,attribute))
+
+  ## Writes a small level with props and items, returns the file name and its
+  #  data.
+
+  def write_small_level(self):
+    small_level = Level(40,40)
+    small_level.set_tile_value(3,4,WALL,True)
+
+    for i in range(10):
+      prop = LevelProp((i * 4 + 0.5,2.5))
+      prop.model.model_name = "crate.obj"
+      prop.scripts_load = ["crate.py"]
+      small_level.add_prop(prop)
+      small_level.add_item(LevelItem((2.5,i * 4 + 0.5)))
+
+    filename = os.path.join(self.directory,"small.lvl")
+    write_level_file(small_level,filename)
+
+    input_file = open(filename,"rb")
+    data = input_file.read()
+    input_file.close()
+    return filename, data
+
+  def write_data(self, data):
+    filename = os.path.join(self.directory,"corrupted.lvl")
+    output_file = open(filename,"wb")
+    output_file.write(data)
+    output_file.close()
+    return filename
+
+  ## Returns the (offset of the entry in the section table,section offset)
+  #  of given section of a level file.
+
+  def find_section(self, data, tag):
+    section_count = struct.unpack_from(HEADER_FORMAT,data,0)[-1]
+
+    for i in range(section_count):
+      entry_offset = struct.calcsize(HEADER_FORMAT) + i * struct.calcsize(SECTION_FORMAT)
+      entry = struct.unpack_from(SECTION_FORMAT,data,entry_offset)
+
+      if entry[0] == tag:
+        return entry_offset, entry[1]
+
+    self.fail("no section " + str(tag))
+
+  ## The sample levels saved in the binary format load with the same tiles,
+  #  objects and properties.
+
+  def test_sample_levels_round_trip(self):
+    for name in SAMPLE_LEVELS:
+      sample_level = Level.load_from_file(os.path.join(REPOSITORY_PATH,name))
+      filename = os.path.join(self.directory,name + ".lvl")
+      write_level_file(sample_level,filename)
+      self.assertTrue(is_level_file(filename))
+      self.assert_levels_equal(read_level_file(filename),sample_level)
+
+  ## Levels pickled by the old editor are converted with the values they
+  #  were saved with, missing attributes get their defaults.
+
+  def test_legacy_conversion(self):
+    for name in SAMPLE_LEVELS:
+      filename = os.path.join(REPOSITORY_PATH,name)
+      input_file = open(filename,"r")
+      old_level = pickle.load(input_file)
+      input_file.close()
+
+      converted_level = read_legacy_level_file(filename)
+      self.assertEqual((converted_level.get_width(),converted_level.get_height()),(len(old_level.layout),len(old_level.layout[0])))
+
+      for x in range(len(old_level.layout)):
+        for y in range(len(old_level.layout[x])):
+          self.assert_converted(converted_level.get_tile(x,y),old_level.layout[x][y])
+
+      by_position = lambda prop: tuple(prop.position)
+      props = sorted(converted_level.get_props(),key=by_position)
+      old_props = sorted(old_level.props,key=by_position)
+      self.assertEqual(len(props),len(old_props))
+
+      for prop, old_prop in zip(props,old_props):
+        self.assert_converted(prop,old_prop)
+
+        if not "caption" in old_prop.__dict__:     # props saved before captions existed
+          self.assertEqual(prop.caption,"")
+
+    # an old level without items and fog:
+
+    old_level.__dict__.pop("items",None)
+    old_level.__dict__.pop("fog_distance",None)
+    filename = os.path.join(self.directory,"old.txt")
+    output_file = open(filename,"w")
+    pickle.dump(old_level,output_file)
+    output_file.close()
+
+    converted_level = Level.load_from_file(filename)
+    self.assertEqual(converted_level.get_items(),[])
+    self.assertEqual(converted_level.get_fog_distance(),Level(1,1).get_fog_distance())
+    self.assertEqual(len(converted_level.get_props()),len(old_level.props))
+
+  ## Truncated files raise IOError when opened instead of being read past
+  #  their end.
+
+  def test_truncated_file(self):
+    filename, data = self.write_small_level()
+    self.assert_levels_equal(read_whole_level_file(filename),read_whole_level_file(filename))
+
+    for size in [0,2,struct.calcsize(HEADER_FORMAT) + 1,len(data) // 3,len(data) // 2,len(data) - 1]:
+      self.assertRaises(IOError,read_whole_level_file,self.write_data(data[:size]))
+
+  ## Corrupted sizes, counts and indices raise IOError.
+
+  def test_corrupted_file(self):
+    filename, data = self.write_small_level()
+
+    def corrupt(offset, struct_format, value):
+      corrupted_data = bytearray(data)
+      struct.pack_into(struct_format,corrupted_data,offset,value)
+      return self.write_data(bytes(corrupted_data))
+
+    self.assertRaises(IOError,read_whole_level_file,corrupt(0,"<4s",b"XXXX"))
+
+    entry_offset, tile_offset = self.find_section(data,b"TILE")
+    self.assertRaises(IOError,read_whole_level_file,corrupt(entry_offset + 4,"<I",len(data)))         # section offset
+    self.assertRaises(IOError,read_whole_level_file,corrupt(entry_offset + 8,"<I",100))               # too small TILE section
+    self.assertRaises(IOError,read_whole_level_file,corrupt(entry_offset,"<4s",b"XXXX"))              # missing section
+
+    _, string_offset = self.find_section(data,b"STRS")
+    self.assertRaises(IOError,read_whole_level_file,corrupt(string_offset,"<I",0xffffffff))           # string count
+
+    _, prop_offset = self.find_section(data,b"PROP")
+    self.assertRaises(IOError,read_whole_level_file,corrupt(prop_offset + 4 + 24,"<I",1000))          # model index of the first prop (after the prop count)
+
+    _, block_offset = self.find_section(data,b"PBLK")
+    self.assertRaises(IOError,read_whole_level_file,corrupt(block_offset + struct.calcsize(BLOCK_TABLE_FORMAT) + 4,"<I",1000000))   # object count of the first block
+
+  ## A 1024x1024 level with many props opens in milliseconds, its tiles and
+  #  objects are only decoded when accessed.
+
+  def test_big_level_load_time(self):
+    big_level = Level(BIG_LEVEL_SIZE,BIG_LEVEL_SIZE)
+    big_level.set_tile_value(600,700,WALL,True)
+    big_level.set_tile_value(600,700,STEPPABLE,False)
+
+    for x in range(0,BIG_LEVEL_SIZE,BIG_LEVEL_PROP_SPACING):
+      for y in range(0,BIG_LEVEL_SIZE,BIG_LEVEL_PROP_SPACING):
+        prop = LevelProp((x + 0.5,y + 0.5))
+        prop.scripts_load = ["crate.py"]
+        big_level.add_prop(prop)
+
+    filename = os.path.join(self.directory,"big.lvl")
+    write_level_file(big_level,filename)
+
+    start = time.time()
+    loaded_level = read_level_file(filename)
+    load_time = time.time() - start
+
+    self.assertTrue(load_time < LOAD_TIME_LIMIT,"loaded in %.3f s" % load_time)
+    self.assertEqual((loaded_level.get_width(),loaded_level.get_height()),(BIG_LEVEL_SIZE,BIG_LEVEL_SIZE))
+    self.assertEqual(len(loaded_level.props),0)
+
+    # only the objects near the queried position are decoded:
+
+    self.assertEqual(len(loaded_level.get_objects_in_region((600,700,4,4))),1)
+    self.assertTrue(0 < len(loaded_level.props) < 1000)
+    self.assertTrue(loaded_level.get_tile(600,700).wall)
+    self.assertFalse(loaded_level.get_collision_mask().is_steppable(600,700))
+    self.assertEqual(len(loaded_level.get_props()),(BIG_LEVEL_SIZE // BIG_LEVEL_PROP_SPACING) ** 2)
+
+if __name__ == "__main__":
+  unittest.main()
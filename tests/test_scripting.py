@@ -0,0 +1,68 @@
+## Tests of the script scheduler (see scripting). Run from the repository
+#  directory: python -m unittest discover tests
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripting import *
+
+SCRIPTS = 10
+MAX_RESUMES = 3
+
+class ScriptSchedulerTest(unittest.TestCase):
+  ## Slow scripts don't change which scripts are resumed in which update,
+  #  they are only reported as budget overruns.
+
+  def test_resumes_dont_depend_on_time(self):
+    scheduler = ScriptScheduler(lambda: 0.0,MAX_RESUMES,budget=0.0001)
+    resumed = []
+
+    def script(number):
+      yield None
+      time.sleep(0.001)          # longer than the budget
+      resumed.append(number)
+
+    for number in range(SCRIPTS):
+      scheduler.start(script(number),"script " + str(number))
+
+    resumed_by_update = []
+
+    while scheduler.get_script_count() > 0:
+      scheduler.update()
+      resumed_by_update.append(len(resumed))
+
+    self.assertEqual(resumed,list(range(SCRIPTS)))
+    self.assertEqual(resumed_by_update,[min(MAX_RESUMES * i,SCRIPTS) for i in range(1,(SCRIPTS + MAX_RESUMES - 1) // MAX_RESUMES + 1)])
+    self.assertEqual(scheduler.overruns,len(resumed_by_update))
+
+class ScriptManagerTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp() + "/"
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  ## Scripts see the given globals, but don't change them for other runs.
+
+  def test_script_globals(self):
+    script_file = open(self.directory + "script.py","w")
+    script_file.write("result.append((CONSTANT,parameters))\nCONSTANT = 0\n")
+    script_file.close()
+
+    script_globals = {"CONSTANT": 5}
+    manager = ScriptManager(self.directory,None,script_globals)
+    result = []
+    manager.run("script.py",{"result": result,"parameters": 1})
+    manager.run("script.py",{"result": result,"parameters": 2})
+
+    self.assertEqual(result,[(5,1),(5,2)])
+    self.assertEqual(script_globals,{"CONSTANT": 5})
+
+if __name__ == "__main__":
+  unittest.main()
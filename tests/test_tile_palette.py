@@ -0,0 +1,78 @@
+## Tests of the tile handles and palettes (see tile_palette). Run from the
+#  repository directory: python -m unittest discover tests
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from level_file import *
+from level import *
+
+MODEL_CHANGES = 100
+
+class TilePaletteTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def get_layouts(self):
+    return [False,True] if numpy != None else [False]
+
+  ## Changing a tile doesn't change the other tiles sharing its record and
+  #  models, nor the handles and copies taken before.
+
+  def test_copy_on_write(self):
+    for array_backed in self.get_layouts():
+      test_level = Level(4,4,array_backed=array_backed)
+      test_level.get_tile(1,1).wall_model.model_name = "wall.obj"
+      test_level.set_tile(2,2,test_level.get_tile(1,1))      # shares the record and the models
+
+      other_tile = test_level.get_tile(2,2)
+      other_model = other_tile.wall_model
+      tile_copy = test_level.get_tile(1,1).copy()
+
+      tile = test_level.get_tile(1,1)
+      tile.wall_model.model_name = "changed.obj"
+      tile.wall_model.texture_names = ["changed.png"]
+      tile.ceiling_height = 2.0
+
+      self.assertEqual(tile.wall_model.model_name,"changed.obj")
+      self.assertEqual(tile.wall_model.texture_names,("changed.png",))
+      self.assertEqual(tile.ceiling_height,2.0)
+
+      for unchanged in [other_tile,test_level.get_tile(2,2),tile_copy]:
+        self.assertEqual(unchanged.wall_model.model_name,"wall.obj")
+        self.assertEqual(len(unchanged.wall_model.texture_names),0)
+        self.assertEqual(unchanged.ceiling_height,1.0)
+
+      self.assertEqual(other_model.model_name,"wall.obj")
+      self.assertEqual(test_level.get_tile(0,0).wall_model.model_name,"")
+
+  ## Models left in the palette by changed tiles aren't written to the
+  #  level file.
+
+  def test_unused_models_not_saved(self):
+    for array_backed in self.get_layouts():
+      test_level = Level(4,4,array_backed=array_backed)
+
+      for i in range(MODEL_CHANGES):
+        test_level.get_tile(1,1).floor_model.model_name = "floor" + str(i) + ".obj"
+
+      self.assertTrue(len(test_level.model_palette) > MODEL_CHANGES)
+
+      filename = os.path.join(self.directory,"level.lvl")
+      write_level_file(test_level,filename)
+      loaded_level = read_level_file(filename)
+
+      self.assertEqual(sorted(record[0] for record in loaded_level.model_palette.values),["","floor" + str(MODEL_CHANGES - 1) + ".obj"])
+      self.assertEqual(loaded_level.get_tile(1,1).floor_model.model_name,"floor" + str(MODEL_CHANGES - 1) + ".obj")
+      self.assertEqual(loaded_level.get_tile(0,1).floor_model.model_name,"")
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,243 @@
+## Storage of level tiles. A tile is stored as a record, a tuple of
+#  TILE_ATTRIBUTES values in which the models are model palette indices.
+#  There are two interchangeable layouts:
+#
+#  - PaletteTileLayout: pure Python, keeps a palette of unique records and
+#    a palette index for each tile (columns of array('H')).
+#  - ArrayTileLayout: keeps one NumPy array per tile attribute, whole-grid
+#    queries (collision mask, wall neighbours, resizing) are vectorized.
+#    Only available if NumPy is installed.
+#
+#  Grids returned by get_grid are indexed as grid[x][y], they are lists
+#  of lists for PaletteTileLayout and 2D arrays for ArrayTileLayout. Grids
+#  can also be requested for a region (x,y,width,height) lying inside the
+#  layout, the result is then indexed relative to the region corner.
+
+from array import array
+
+from tile_palette import *
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+WALL = TILE_ATTRIBUTE_INDICES["wall"]
+STEPPABLE = TILE_ATTRIBUTE_INDICES["steppable"]
+WALL_MODEL = TILE_ATTRIBUTE_INDICES["wall_model"]
+
+NEIGHBOUR_OFFSETS = [(0,1),(1,0),(-1,0),(0,-1)]      ##< down, right, left, up
+
+## Tile layout storing palette indices of tile records.
+
+class PaletteTileLayout:
+  def __init__(self, width, height, default_record, columns=None):
+    self.width = width
+    self.height = height
+    self.palette = Palette()                           ##< unique tile records
+    default_index = self.palette.intern(default_record)
+    self.columns = columns if columns != None else [array("H",[default_index]) * height for i in range(width)]   ##< columns of palette indices
+
+  def get_record(self, x, y):
+    return self.palette.values[self.columns[x][y]]
+
+  def get_value(self, x, y, attribute_index):
+    return self.palette.values[self.columns[x][y]][attribute_index]
+
+  def set_record(self, x, y, record):
+    tile_index = self.palette.intern(record)
+    column = self.columns[x]
+
+    try:
+      column[y] = tile_index
+    except OverflowError:     # palette too big for the column type, widen it
+      column = array("I",column)
+      column[y] = tile_index
+      self.columns[x] = column
+
+  ## Changes one attribute of a tile, the shared record is not modified
+  #  (a new record is interned).
+
+  def set_value(self, x, y, attribute_index, value):
+    record = list(self.get_record(x,y))
+    record[attribute_index] = value
+    self.set_record(x,y,tuple(record))
+
+  def resize(self, new_width, new_height, default_record):
+    default_index = self.palette.intern(default_record)
+    new_columns = []
+
+    for i in range(new_width):
+      column = self.columns[i][:new_height] if i < self.width else array("H")
+      column.extend([default_index] * (new_height - len(column)))
+      new_columns.append(column)
+
+    self.columns = new_columns
+    self.width = new_width
+    self.height = new_height
+
+  def get_grid(self, attribute_index, region=None):
+    values = [record[attribute_index] for record in self.palette.values]
+    return [[values[tile_index] for tile_index in column] for column in self.get_region_columns(region)]
+
+  ## Returns a grid of bools saying which tiles are walls with a model.
+
+  def get_solid_wall_grid(self, model_palette, region=None):
+    values = [record[WALL] and len(model_palette[record[WALL_MODEL]][0]) != 0 for record in self.palette.values]
+    return [[values[tile_index] for tile_index in column] for column in self.get_region_columns(region)]
+
+  def get_region_columns(self, region):
+    if region == None:
+      return self.columns
+
+    x, y, width, height = region
+    return [self.columns[i][y:y + height] for i in range(x,x + width)]
+
+## Tile layout storing each tile attribute in a separate NumPy array.
+
+class ArrayTileLayout:
+  ATTRIBUTE_TYPES = {
+    "wall": bool,
+    "ceiling": bool,
+    "ceiling_height": "float64",
+    "floor_orientation": "int32",
+    "steppable": bool,
+    "wall_model": "uint32",
+    "floor_model": "uint32",
+    "ceiling_model": "uint32"}
+
+  def __init__(self, width, height, default_record, arrays=None):
+    self.width = width
+    self.height = height
+
+    if arrays == None:
+      arrays = [numpy.full((width,height),value,dtype=ArrayTileLayout.ATTRIBUTE_TYPES[attribute]) for attribute, value in zip(TILE_ATTRIBUTES,default_record)]
+
+    self.arrays = arrays          ##< one 2D array per attribute, in TILE_ATTRIBUTES order
+
+  def get_record(self, x, y):
+    return tuple(values[x,y].item() for values in self.arrays)
+
+  def get_value(self, x, y, attribute_index):
+    return self.arrays[attribute_index][x,y].item()
+
+  def set_record(self, x, y, record):
+    for values, value in zip(self.arrays,record):
+      values[x,y] = value
+
+  def set_value(self, x, y, attribute_index, value):
+    self.arrays[attribute_index][x,y] = value
+
+  def resize(self, new_width, new_height, default_record):
+    padding = ((0,max(new_width - self.width,0)),(0,max(new_height - self.height,0)))
+    self.arrays = [numpy.pad(values[:new_width,:new_height],padding,mode="constant",constant_values=value) for values, value in zip(self.arrays,default_record)]
+    self.width = new_width
+    self.height = new_height
+
+  def get_grid(self, attribute_index, region=None):
+    return self.get_region_array(self.arrays[attribute_index],region)
+
+  def get_solid_wall_grid(self, model_palette, region=None):
+    model_is_empty = numpy.array([len(record[0]) == 0 for record in model_palette.values],dtype=bool)
+    return self.get_region_array(self.arrays[WALL],region) & ~model_is_empty[self.get_region_array(self.arrays[WALL_MODEL],region)]
+
+  ## Returns views of the attribute arrays for given region.
+
+  def get_region_arrays(self, region):
+    return [self.get_region_array(values,region) for values in self.arrays]
+
+  def get_region_array(self, values, region):
+    if region == None:
+      return values
+
+    x, y, width, height = region
+    return values[x:x + width,y:y + height]
+
+## Returns a grid of neighbour values: result[x][y] = grid[x + dx][y + dy],
+#  fill_value for neighbours outside the grid.
+
+def shift_grid(grid, dx, dy, fill_value):
+  width = len(grid)
+  height = len(grid[0]) if width > 0 else 0
+
+  if numpy != None and isinstance(grid,numpy.ndarray):
+    result = numpy.full_like(grid,fill_value)
+    result[max(-dx,0):width - max(dx,0),max(-dy,0):height - max(dy,0)] = grid[max(dx,0):width + min(dx,0),max(dy,0):height + min(dy,0)]
+    return result
+
+  return [[grid[x + dx][y + dy] if 0 <= x + dx < width and 0 <= y + dy < height else fill_value for y in range(height)] for x in range(width)]
+
+## Combines two bool grids with logical and, the second one optionally negated.
+
+def and_grids(grid1, grid2, negate_second=False):
+  if numpy != None and isinstance(grid1,numpy.ndarray):
+    return grid1 & ~grid2 if negate_second else grid1 & grid2
+
+  return [[value1 and (value2 != negate_second) for value1, value2 in zip(column1,column2)] for column1, column2 in zip(grid1,grid2)]
+
+def or_grids(grid1, grid2):
+  if numpy != None and isinstance(grid1,numpy.ndarray):
+    return grid1 | grid2
+
+  return [[value1 or value2 for value1, value2 in zip(column1,column2)] for column1, column2 in zip(grid1,grid2)]
+
+## Makes a new grid filled with given value, a NumPy array if use_numpy
+#  is True (and NumPy is available), otherwise a list of lists.
+
+def make_grid(width, height, value, use_numpy):
+  if use_numpy and numpy != None:
+    return numpy.full((width,height),value,dtype=type(value))
+
+  return [[value for y in range(height)] for x in range(width)]
+
+## Copies a rectangle of given size from the source grid at (source_x,
+#  source_y) into the destination grid at (destination_x,destination_y).
+
+def copy_grid_region(source, source_x, source_y, destination, destination_x, destination_y, width, height):
+  if width <= 0 or height <= 0:
+    return
+
+  if numpy != None and isinstance(destination,numpy.ndarray):
+    destination[destination_x:destination_x + width,destination_y:destination_y + height] = numpy.asarray(source)[source_x:source_x + width,source_y:source_y + height]
+    return
+
+  for i in range(width):
+    destination[destination_x + i][destination_y:destination_y + height] = list(source[source_x + i][source_y:source_y + height])
+
+## Returns a grid of given size such that result[x][y] = grid[x + x0][y + y0],
+#  fill_value for positions outside the grid.
+
+def crop_grid(grid, x0, y0, width, height, fill_value):
+  grid_width = len(grid)
+  grid_height = len(grid[0]) if grid_width > 0 else 0
+  result = make_grid(width,height,fill_value,numpy != None and isinstance(grid,numpy.ndarray))
+  left = max(x0,0)
+  top = max(y0,0)
+  copy_grid_region(grid,left,top,result,left - x0,top - y0,min(x0 + width,grid_width) - left,min(y0 + height,grid_height) - top)
+  return result
+
+## Computes the grids of exposed wall faces, four grids (one for each
+#  direction in NEIGHBOUR_OFFSETS) saying which wall tiles have a face
+#  exposed in that direction, i.e. the neighbour tile in that direction is
+#  not a wall.
+#
+#  @param padded_walls grid of wall values with one extra tile on each side
+
+def exposed_wall_faces(padded_walls):
+  width = len(padded_walls) - 2
+  height = len(padded_walls[0]) - 2
+  return [crop_grid(and_grids(padded_walls,shift_grid(padded_walls,offset[0],offset[1],True),True),1,1,width,height,False) for offset in NEIGHBOUR_OFFSETS]
+
+## Computes the grid saying which tiles neighbour with a solid wall (see
+#  get_solid_wall_grid) and should therefore have a wall shadow.
+#
+#  @param padded_solid_walls grid of solid wall values with one extra tile
+#         on each side
+
+def shadowed_tiles(padded_solid_walls):
+  result = shift_grid(padded_solid_walls,NEIGHBOUR_OFFSETS[0][0],NEIGHBOUR_OFFSETS[0][1],False)
+
+  for offset in NEIGHBOUR_OFFSETS[1:]:
+    result = or_grids(result,shift_grid(padded_solid_walls,offset[0],offset[1],False))
+
+  return crop_grid(result,1,1,len(padded_solid_walls) - 2,len(padded_solid_walls[0]) - 2,False)
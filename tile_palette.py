@@ -0,0 +1,132 @@
+## Flyweight storage of level tiles.
+#
+#  Instead of keeping a LevelTile object (with three AnimatedTextureModel
+#  objects) for every tile, the level keeps palettes of unique tile and
+#  model definitions and the layout only stores palette indices. Tiles are
+#  accessed through handles that write changes back to the level (see
+#  tile_layout for how the tiles are stored).
+
+from general import *
+
+TILE_ATTRIBUTES = ["wall","ceiling","ceiling_height","floor_orientation","steppable","wall_model","floor_model","ceiling_model"]
+TILE_MODEL_ATTRIBUTES = ["wall_model","floor_model","ceiling_model"]
+TILE_ATTRIBUTE_INDICES = dict((name,index) for index, name in enumerate(TILE_ATTRIBUTES))
+
+MODEL_ATTRIBUTES = ["model_name","texture_names","framerate"]
+MODEL_ATTRIBUTE_INDICES = dict((name,index) for index, name in enumerate(MODEL_ATTRIBUTES))
+
+## Makes a hashable model definition out of AnimatedTextureModel (or any
+#  object with the same attributes).
+
+def model_to_record(model):
+  return (model.model_name,tuple(model.texture_names),model.framerate)
+
+def record_to_model(record):
+  result = AnimatedTextureModel()
+  result.model_name = record[0]
+  result.texture_names = list(record[1])
+  result.framerate = record[2]
+  return result
+
+## List of unique hashable values, each value is identified by its index.
+
+class Palette:
+  def __init__(self):
+    self.values = []
+    self.indices = {}
+
+  ## Returns the index of given value, adds the value if it isn't in the
+  #  palette yet.
+
+  def intern(self, value):
+    try:
+      return self.indices[value]
+    except KeyError:
+      self.indices[value] = len(self.values)
+      self.values.append(value)
+      return len(self.values) - 1
+
+  def __getitem__(self, index):
+    return self.values[index]
+
+  def __len__(self):
+    return len(self.values)
+
+## Reference to one tile of a level, behaves like LevelTile. Changes are
+#  written to the level, shared definitions are never modified (copy on
+#  write).
+
+class TileHandle(object):
+  __slots__ = ("level","x","y")
+
+  def __init__(self, level, x, y):
+    level.layout.get_record(x,y)         # raises IndexError for tiles outside the level
+    object.__setattr__(self,"level",level)
+    object.__setattr__(self,"x",x)
+    object.__setattr__(self,"y",y)
+
+  def get_record(self):
+    return self.level.layout.get_record(self.x,self.y)
+
+  def __getattr__(self, name):
+    try:
+      index = TILE_ATTRIBUTE_INDICES[name]
+    except KeyError:
+      raise AttributeError(name)
+
+    if name in TILE_MODEL_ATTRIBUTES:
+      return ModelHandle(self,name)
+
+    return self.level.layout.get_value(self.x,self.y,index)
+
+  def __setattr__(self, name, value):
+    try:
+      index = TILE_ATTRIBUTE_INDICES[name]
+    except KeyError:
+      raise AttributeError(name)
+
+    self.level.set_tile_value(self.x,self.y,index,value)
+
+  def is_empty(self):
+    record = self.get_record()
+    model_index = record[TILE_ATTRIBUTE_INDICES["wall_model" if record[0] else "floor_model"]]
+    return len(self.level.model_palette[model_index][0]) == 0
+
+  ## Returns a standalone LevelTile with the same content.
+
+  def copy(self):
+    return self.level.make_tile(self.get_record())
+
+## Copy-on-write reference to one of the models of a tile, behaves like
+#  AnimatedTextureModel (texture_names is returned as a tuple, assign a new
+#  list to change it).
+
+class ModelHandle(object):
+  __slots__ = ("tile","attribute")
+
+  def __init__(self, tile, attribute):
+    object.__setattr__(self,"tile",tile)
+    object.__setattr__(self,"attribute",attribute)
+
+  def get_record(self):
+    level = self.tile.level
+    return level.model_palette.values[self.tile.get_record()[TILE_ATTRIBUTE_INDICES[self.attribute]]]
+
+  def __getattr__(self, name):
+    try:
+      return self.get_record()[MODEL_ATTRIBUTE_INDICES[name]]
+    except KeyError:
+      raise AttributeError(name)
+
+  def __setattr__(self, name, value):
+    try:
+      index = MODEL_ATTRIBUTE_INDICES[name]
+    except KeyError:
+      raise AttributeError(name)
+
+    record = list(self.get_record())
+    record[index] = tuple(value) if name == "texture_names" else value
+    setattr(self.tile,self.attribute,record_to_model(record))
+
+  def copy(self):
+    return record_to_model(self.get_record())
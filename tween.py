@@ -0,0 +1,137 @@
+## Movement of many scene nodes at once. TweenEngine keeps all the running
+#  movements (tweens) in one table of columns (arrays) and advances them all
+#  in one update a frame, instead of one interval and task per moved node.
+#  When a tween ends, its completion callback is called.
+
+from array import array
+
+EASE_LINEAR = 0
+EASE_IN = 1
+EASE_OUT = 2
+EASE_IN_OUT = 3
+
+EASINGS = [                    ##< easing functions by the constants above, map time <0,1> to progress <0,1>
+  lambda t: t,
+  lambda t: t * t,
+  lambda t: t * (2 - t),
+  lambda t: t * t * (3 - 2 * t)]
+
+class TweenEngine:
+  ## Creates the engine.
+  #
+  #  @param get_time function returning the current time in seconds
+
+  def __init__(self, get_time):
+    self.get_time = get_time
+    self.starts = array("d")             ##< start positions, 3 values per tween
+    self.ends = array("d")               ##< end positions, 3 values per tween
+    self.start_times = array("d")
+    self.durations = array("d")
+    self.easings = array("B")
+    self.node_paths = []                 ##< moved node paths, None for tweens that only wait
+    self.callbacks = []                  ##< functions called without arguments when the tweens end, or None
+    self.node_tweens = {}                ##< node path => index of its tween
+
+  def get_count(self):
+    return len(self.durations)
+
+  ## Starts moving given node path from its current position to a new one.
+  #  A tween already moving the node path is replaced (without calling its
+  #  callback).
+  #
+  #  @param node_path node path to move, None makes a tween that only
+  #         waits for the duration (and calls the callback)
+  #  @param end end position (x,y,z)
+  #  @param duration duration in seconds
+  #  @param easing one of the EASE_ constants
+  #  @param on_done optional function called without arguments when the
+  #         node gets to the end position
+
+  def move(self, node_path, end, duration, easing=EASE_LINEAR, on_done=None):
+    start = node_path.getPos() if node_path != None else end
+
+    if node_path != None and node_path in self.node_tweens:
+      self.remove(self.node_tweens[node_path])
+
+    if node_path != None:
+      self.node_tweens[node_path] = len(self.durations)
+
+    self.starts.extend((start[0],start[1],start[2]))
+    self.ends.extend((end[0],end[1],end[2]))
+    self.start_times.append(self.get_time())
+    self.durations.append(duration)
+    self.easings.append(easing)
+    self.node_paths.append(node_path)
+    self.callbacks.append(on_done)
+
+  ## Removes the tween with given index, the last tween takes its place.
+
+  def remove(self, index):
+    last = len(self.durations) - 1
+
+    if self.node_paths[index] != None:
+      del self.node_tweens[self.node_paths[index]]
+
+    if index != last:
+      self.starts[3 * index:3 * index + 3] = self.starts[3 * last:3 * last + 3]
+      self.ends[3 * index:3 * index + 3] = self.ends[3 * last:3 * last + 3]
+      self.start_times[index] = self.start_times[last]
+      self.durations[index] = self.durations[last]
+      self.easings[index] = self.easings[last]
+      self.node_paths[index] = self.node_paths[last]
+      self.callbacks[index] = self.callbacks[last]
+
+      if self.node_paths[index] != None:
+        self.node_tweens[self.node_paths[index]] = index
+
+    del self.starts[3 * last:]
+    del self.ends[3 * last:]
+    self.start_times.pop()
+    self.durations.pop()
+    self.easings.pop()
+    self.node_paths.pop()
+    self.callbacks.pop()
+
+  ## Stops moving given node path (where it is now), the callback is not
+  #  called.
+
+  def stop(self, node_path):
+    if node_path in self.node_tweens:
+      self.remove(self.node_tweens[node_path])
+
+  ## Moves all the nodes to their positions at the current time, finished
+  #  tweens are removed and their callbacks called.
+
+  def update(self):
+    current_time = self.get_time()
+    starts = self.starts
+    ends = self.ends
+    finished = []
+
+    for i in range(len(self.durations)):
+      duration = self.durations[i]
+      t = (current_time - self.start_times[i]) / duration if duration > 0 else 1.0
+
+      if t >= 1.0:
+        finished.append(i)
+        t = 1.0
+
+      node_path = self.node_paths[i]
+
+      if node_path != None and not node_path.isEmpty():
+        progress = EASINGS[self.easings[i]](t)
+        j = 3 * i
+        node_path.setPos(
+          starts[j] + (ends[j] - starts[j]) * progress,
+          starts[j + 1] + (ends[j + 1] - starts[j + 1]) * progress,
+          starts[j + 2] + (ends[j + 2] - starts[j + 2]) * progress)
+
+    callbacks = []
+
+    for i in reversed(finished):         # from the end so that the indices stay valid
+      callbacks.append(self.callbacks[i])
+      self.remove(i)
+
+    for callback in reversed(callbacks):
+      if callback != None:
+        callback()